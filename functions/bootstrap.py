@@ -0,0 +1,52 @@
+#! /usr/bin/env python3
+"""
+Estimates how stable a ranking is: ranks many bootstrap resamples of the votes, then writes each dog's median position
+and its 95% interval to stdout, as (dog, median, low, high).
+"""
+
+import argparse
+import functools
+
+from util.bootstrap import bootstrap_ranks, summarize_ranks
+from xranking import RANKING_METHODS, add_source_arguments, connect, format_rank, get_votes, rank_votes
+
+
+def main(args):
+    conn = connect(args)
+    filters = {
+        "education": args.education,
+        "location": args.location,
+        "gender": args.gender,
+        "age_min": args.age_min,
+        "age_max": args.age_max,
+        "first_n": args.first_n,
+        "ignore_dogs": args.ignore_dogs,
+        "voter": args.voter
+    }
+
+    votes = get_votes(conn, filters)
+    dogs, positions = bootstrap_ranks(functools.partial(rank_votes, args.method), votes, args.resamples, args.seed,
+                                      args.workers)
+    print(format_rank(summarize_ranks(dogs, positions, args.confidence), args.output_format))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    add_source_arguments(parser)
+    parser.add_argument("--method", required=True, choices=RANKING_METHODS)
+    parser.add_argument("--resamples", type=int, default=1000)
+    parser.add_argument("--confidence", type=float, default=95, help="Width of the interval, in percent.")
+    parser.add_argument("--seed", type=int, help="Seed for the resampling, so that a run can be reproduced.")
+    parser.add_argument("--workers", type=int,
+                        help="Number of processes to rank resamples in. Defaults to the number of CPUs.")
+    parser.add_argument("--output_format", default="python_array", choices=["python_array", "columns"])
+    parser.add_argument("--education")
+    parser.add_argument("--location")
+    parser.add_argument("--gender")
+    parser.add_argument("--age_min", type=int)
+    parser.add_argument("--age_max", type=int)
+    parser.add_argument("--voter", type=int)
+    parser.add_argument("--first_n", type=int)
+    parser.add_argument("--ignore_dogs", nargs="*")
+    args = parser.parse_args()
+    main(args)
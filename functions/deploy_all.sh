@@ -1,13 +1,17 @@
 #!/usr/bin/env bash
 
 ./deploy.sh get_dog &
+./deploy.sh get_dog_image &
 ./deploy.sh submit_dog &
 ./deploy.sh get_dog_pair &
 ./deploy.sh submit_vote &
 ./deploy.sh register_voter &
 ./deploy.sh get_votes &
+./deploy.sh get_votes_batch &
 ./deploy.sh list_dogs &
 ./deploy.sh submit &
 ./deploy.sh get_demographics &
+./deploy.sh get_scenario &
+./deploy.sh get_metrics &
 
 echo "Running deployment, this may take a sec."
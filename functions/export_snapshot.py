@@ -0,0 +1,22 @@
+#! /usr/bin/env python3
+"""
+Writes every vote, with the voters and dogs they refer to, to a snapshot file that xranking.py, bootstrap.py,
+intransitivity_stats.py and scripts/beatgraph.py can read with --snapshot, instead of querying the database.
+"""
+
+import argparse
+import json
+
+from util.get_pool import get_connection
+from util.snapshot import export_snapshot
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--credentials", required=True,
+                        help="Path to the credentials for the postgres instance the data is stored in.")
+    parser.add_argument("--output", required=True, help="Path to write the snapshot to.")
+    args = parser.parse_args()
+
+    with open(args.credentials) as f:
+        connection_details = json.load(f)
+    export_snapshot(get_connection(connection_details), args.output)
@@ -1,19 +1,18 @@
 #! /usr/bin/env python3
 
 import argparse
-import json
-import networkx as nx
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from concurrent.futures import ProcessPoolExecutor
 
-from util.get_pool import get_connection
-from xranking import get_victory_graph, get_votes, filter_statement, get_matchup_graph
+import numpy
+
+from util.cycles import has_directed_cycle, has_undirected_cycle
+from util.matchups import Matchups
+from util.snapshot import Snapshot
+from xranking import VOTES_FROM, VOTES_UNTIL, add_source_arguments, connect, filter_statement, get_votes
 
 
 def main(args):
-    with open(args.credentials) as f:
-        connection_details = json.load(f)
-    conn = get_connection(connection_details)
+    conn = connect(args)
     filters = {
         "education": args.education,
         "location": args.location,
@@ -25,50 +24,49 @@ def main(args):
         "voter": None
     }
 
-    out = get_number_of_intransitive_users(conn, filters)
+    out = get_number_of_intransitive_users(conn, filters, args.workers)
     print(out)
     return out
 
 
-def get_number_of_intransitive_users(conn, filters):
-    with conn.cursor() as cursor:
-        cursor.execute(
-            """SELECT voters.id
-               FROM voters
-               WHERE 1 = 1 
-               AND voters.creation_time >= make_date(2019, 4, 3)
-               AND voters.creation_time <= make_date(2019, 4, 22) """
-            + filter_statement(conn, filters))
-        voters = [row[0] for row in cursor]
+def get_number_of_intransitive_users(conn, filters, workers=None):
+    if isinstance(conn, Snapshot):
+        voters = conn.voter_ids(filters, VOTES_FROM, VOTES_UNTIL)
+    else:
+        with conn.cursor() as cursor:
+            window = bytes.decode(cursor.mogrify(
+                "AND voters.creation_time >= %s AND voters.creation_time <= %s", (VOTES_FROM, VOTES_UNTIL)))
+            cursor.execute(
+                """SELECT voters.id
+                   FROM voters
+                   WHERE 1 = 1 """
+                + window + " " + filter_statement(conn, filters))
+            voters = [row[0] for row in cursor]
 
-    count_intransitive = 0
-    count_opportunity_intransitive = 0
-    voters_with_no_votes = 0
-    for voter in voters:
-        filters["voter"] = voter
-        if not get_votes(conn, filters):
-            voters_with_no_votes += 1
-            continue
-        vg = get_victory_graph(conn, filters)
-        try:
-            nx.find_cycle(nx.to_undirected(vg))
-            count_opportunity_intransitive += 1
-        except:
-            pass
+    # Every voter's votes, in one query
+    votes_by_voter = get_votes(conn, {**filters, "voter": None}).by_voter()
+    voter_votes = [votes_by_voter[voter] for voter in voters if voter in votes_by_voter]
+    voters_with_no_votes = len(voters) - len(voter_votes)
 
-        try:
-            nx.find_cycle(vg)
-            count_intransitive += 1
-        except:
-            pass
+    with ProcessPoolExecutor(workers) as executor:
+        cycles = list(executor.map(victory_graph_cycles, voter_votes, chunksize=64))
 
+    count_intransitive = sum(directed for directed, _ in cycles)
+    count_opportunity_intransitive = sum(undirected for _, undirected in cycles)
     return count_intransitive, count_opportunity_intransitive, len(voters), voters_with_no_votes
 
 
+def victory_graph_cycles(votes):
+    """:return: whether one voter's victory graph has a directed cycle, and whether it has an undirected one"""
+    winners, losers = numpy.nonzero(~numpy.isnan(Matchups.from_votes(votes).victory_margins()))
+    n = len(votes.dogs())
+    return has_directed_cycle(n, winners.tolist(), losers.tolist()), \
+        has_undirected_cycle(n, winners.tolist(), losers.tolist())
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("--credentials", required=True,
-                        help="Path to the credentials for the postgres instance the data is stored in.")
+    add_source_arguments(parser)
     parser.add_argument("--output_format", default="python_array", choices=["python_array", "columns"])
     parser.add_argument("--flatten_ties", action="store_true")
     parser.add_argument("--remove_dogs")
@@ -79,5 +77,7 @@ if __name__ == '__main__':
     parser.add_argument("--age_max", type=int)
     parser.add_argument("--first_n", type=int)
     parser.add_argument("--ignore_dogs", nargs="*")
+    parser.add_argument("--workers", type=int,
+                        help="Number of processes to check voters with. Defaults to the number of CPUs.")
     args = parser.parse_args()
     main(args)
@@ -1,11 +1,18 @@
-import traceback
+import logging
 import uuid
+import numpy
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
-from util.cloudfunction import cloudfunction
-from util.elo import compute_elo
+from util.ballots import CANDIDATES, BallotCache, by_candidate, matrix_by_candidate, shares
+from util.cloudfunction import RawResponse, cloudfunction, pool_stats
+from util.elo import record_elo
+from util.image_store import VARIANTS, etag, get_image_store, image_urls, move_dog_image, put_image
+from util.logs import dropped_records, log
+from util.pair_sampler import sample_unseen_pair, seen_pair_index
 from util.ranked_pairs import ranked_pairs_ordering
+from util.tallies import record_vote
+from util.timing import dump_histograms
 
 
 @cloudfunction(
@@ -20,7 +27,13 @@ from util.ranked_pairs import ranked_pairs_ordering
     out_schema={
         "type": "object",
         "properties": {
-            "image": {"type": "string"},
+            "image_hash": {"type": "string", "pattern": "^[0-9a-f]{64}$"},
+            "image_urls": {
+                "type": "object",
+                "properties": {variant: {"type": "string"} for variant in VARIANTS},
+                "additionalProperties": False,
+                "minProperties": len(VARIANTS),
+            },
             "dog_age": {"type": "integer", "minimum": 0, "maximum": 2147483647},
             "dog_breed": {"type": "string"},
             "dog_weight": {
@@ -35,7 +48,7 @@ from util.ranked_pairs import ranked_pairs_ordering
             }
         },
         "additionalProperties": False,
-        "minProperties": 4,
+        "minProperties": 5,
     })
 def get_dog(request_json, conn):
     return _get_dog(request_json, conn)
@@ -46,7 +59,7 @@ def _get_dog(data, conn):
 
     with conn.cursor(cursor_factory=RealDictCursor) as cursor:
         cursor.execute("""
-            SELECT image, age_months AS dog_age, breed AS dog_breed, weight_id as dog_weight
+            SELECT image_hash, age_months AS dog_age, breed AS dog_breed, weight_id as dog_weight
               FROM dogs
               WHERE id = %s""",
                        (id,))
@@ -57,11 +70,40 @@ def _get_dog(data, conn):
                           WHERE id = %s""", (out["dog_weight"],))
         out["dog_weight"] = cursor.fetchone()
 
-    # Convert from wacky in-memory format (postgres BYTEA) to byte-string
-    out['image'] = str(bytes(out['image']), 'UTF-8')
+        if out["image_hash"] is None:
+            # Dogs submitted before the image store still have their image inline, move it over on first read.
+            cursor.execute("SELECT image FROM dogs WHERE id = %s", (id,))
+            out["image_hash"] = move_dog_image(conn, id, cursor.fetchone()["image"])
+
+    out["image_urls"] = image_urls(out["image_hash"])
     return out
 
 
+@cloudfunction(
+    in_schema={
+        "type": "object",
+        "properties": {
+            "hash": {"type": "string", "pattern": "^[0-9a-f]{64}$"},
+            "variant": {"enum": VARIANTS},
+        },
+        "additionalProperties": False,
+        "minProperties": 2,
+    },
+    query_args=True)
+def get_dog_image(request_json, conn):
+    return _get_dog_image(request_json, conn)
+
+
+def _get_dog_image(data, conn):
+    """Serves one variant of a stored image. The bytes behind a hash never change, so clients may cache it forever."""
+    image_hash = data["hash"]
+    variant = data["variant"]
+
+    # Only read from the store if the client doesn't already have the image, and 404 if there is no such image
+    store = get_image_store(conn)
+    return RawResponse(load=lambda: store.get(image_hash, variant), etag=etag(image_hash, variant), max_age=31536000)
+
+
 @cloudfunction(
     in_schema={
         "type": "object",
@@ -83,13 +125,15 @@ def submit_dog(request_json, conn):
 
 
 def _submit_dog(data, conn):
-    """Submits the specified dog.
+    """Submits the specified dog, storing its image (and resized variants of it) in the image store.
     :return: the id of the dog.
     """
+    image_hash = put_image(get_image_store(conn), data["image"])
+
     with conn.cursor() as cursor:
         cursor.execute(
-            'INSERT INTO dogs (image, age_months, breed, weight_id, submitter_email) VALUES (%s, %s, %s, %s, %s);',
-            (data["image"],
+            'INSERT INTO dogs (image_hash, age_months, breed, weight_id, submitter_email) VALUES (%s, %s, %s, %s, %s);',
+            (image_hash,
              data["dog_age"],
              data["dog_breed"],
              data["dog_weight"],
@@ -122,32 +166,18 @@ def get_dog_pair(request_json, conn):
 
 
 def _get_dog_pair(voter_uuid, conn):
-    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+    """Picks a random pair of dogs that the voter has not yet voted on, in either order.
+
+    :return: a dictionary of shape {"dog1": …, "dog2": …}, or None if the voter has seen every pair.
+    """
+    with conn.cursor() as cursor:
         cursor.execute("""
-        WITH dogs1 AS (SELECT dogs.id AS dog1 FROM dogs),
-             dogs2 AS (SELECT dogs.id AS dog2 FROM dogs),
-             dog_pairs AS (SELECT * FROM dogs1 CROSS JOIN dogs2 WHERE dog1 != dog2),
-             seen_pairs AS (
-              SELECT dog1_id, dog2_id AS dog FROM votes 
-              JOIN voters ON (voter_id = voters.id) 
-                WHERE voters.uuid = %(vid)s
-              UNION ALL 
-              SELECT dog2_id, dog1_id AS dog FROM votes 
-                JOIN voters ON (voter_id = voters.id) 
-                WHERE voters.uuid = %(vid)s
-             )
-        
-        SELECT dog1, dog2 FROM dog_pairs
-        WHERE (dog1, dog2) NOT IN (SELECT * FROM seen_pairs)
-          AND (dog2, dog1) NOT IN (SELECT * FROM seen_pairs)
-        ORDER BY RANDOM()
-        LIMIT 1
-        """, {"vid": voter_uuid})
-        try:
-            return cursor.fetchone()
-        except psycopg2.ProgrammingError:
-            traceback.print_exc()
-            return None
+        SELECT dog1_id, dog2_id FROM votes
+          JOIN voters ON (voter_id = voters.id)
+          WHERE voters.uuid = %s""", (voter_uuid,))
+        seen = seen_pair_index(cursor)
+
+    return sample_unseen_pair(_list_dogs(conn), seen)
 
 
 @cloudfunction(
@@ -269,10 +299,33 @@ def _submit_vote(data, conn):
 
         cursor.execute("""INSERT INTO votes (dog1_id, dog2_id, result, voter_id) VALUES (%s, %s, %s, %s)""",
                        (id1, id2, result[winner], voter_id))
+        record_vote(cursor, id1, id2, result[winner])
+        record_elo(cursor, id1, id2, result[winner])
 
     return _get_dog_pair(voter_uuid, conn)
 
 
+HEAD_TO_HEAD_SCHEMA = {
+    "type": "object",
+    "patternProperties": {
+        # this one is hard to read, but says keys are strings made of digits (dog ids), pointing to
+        # values that are dictionaries with win/loss/tie counts
+        # this is the results against each dog that has matchups against the dog with the given id.
+        "^[0-9]+$": {
+            "type": "object",
+            "properties": {
+                "wins": {"type": "integer", "minimum": 0},
+                "losses": {"type": "integer", "minimum": 0},
+                "ties": {"type": "integer", "minimum": 0}
+            },
+            "additionalProperties": False,
+            "minProperties": 3,
+        }
+    },
+    "additionalProperties": False,
+}
+
+
 @cloudfunction(
     in_schema={
         "type": "object",
@@ -282,58 +335,54 @@ def _submit_vote(data, conn):
         "additionalProperties": False,
         "minProperties": 1,
     },
-    out_schema={
-        "type": "object",
-        "patternProperties": {
-            # this one is hard to read, but says keys are strings made of digits (dog ids), pointing to
-            # values that are dictionaries with win/loss/tie counts
-            # this is the results against each dog that has matchups against the dog with the given id.
-            "^[0-9]+$": {
-                "type": "object",
-                "properties": {
-                    "wins": {"type": "integer", "minimum": 0},
-                    "losses": {"type": "integer", "minimum": 0},
-                    "ties": {"type": "integer", "minimum": 0}
-                },
-                "additionalProperties": False,
-                "minProperties": 3,
-            }
-        },
-        "additionalProperties": False,
-    })
+    out_schema=HEAD_TO_HEAD_SCHEMA)
 def get_votes(request_json, conn):
     return _get_votes(request_json, conn)
 
 
 def _get_votes(data, conn):
     dog_id = data["id"]
+    return _head_to_heads([dog_id], conn)[str(dog_id)]
+
+
+@cloudfunction(
+    in_schema={
+        "type": "object",
+        "properties": {
+            "ids": {"type": "array", "items": {"type": "integer"}, "maxItems": 1000}
+        },
+        "additionalProperties": False,
+        "minProperties": 1,
+    },
+    out_schema={
+        "type": "object",
+        # Each requested dog id, pointing to the same results that get_votes returns for it
+        "patternProperties": {"^[0-9]+$": HEAD_TO_HEAD_SCHEMA},
+        "additionalProperties": False,
+    },
+    validate_output="debug")
+def get_votes_batch(request_json, conn):
+    return _get_votes_batch(request_json, conn)
+
+
+def _get_votes_batch(data, conn):
+    return _head_to_heads(data["ids"], conn)
+
+
+def _head_to_heads(dog_ids, conn):
+    """
+    :return: a dictionary from each of dog_ids (as a string) to its wins, losses, and ties against each opponent, all
+             read in one query
+    """
+    results = {str(dog_id): {} for dog_id in dog_ids}
     with conn.cursor() as cursor:
-        select = """
-        WITH wins AS (
-          SELECT dog2_id AS dog FROM votes WHERE dog1_id = %(dog_id)s AND result = %(result1)s
-          UNION ALL
-          SELECT dog1_id AS dog FROM votes WHERE dog2_id = %(dog_id)s AND result = %(result2)s
-        )
-        SELECT dog, COUNT(*) FROM wins GROUP BY dog;
-        """
-
-        cursor.execute(select, {"dog_id": dog_id, "result1": "win", "result2": "loss"})
-        wins = {str(row[0]): row[1] for row in cursor}
-
-        cursor.execute(select, {"dog_id": dog_id, "result1": "loss", "result2": "win"})
-        losses = {str(row[0]): row[1] for row in cursor}
-
-        cursor.execute(select, {"dog_id": dog_id, "result1": "tie", "result2": "tie"})
-        ties = {str(row[0]): row[1] for row in cursor}
-
-        out = {}
-        for key in {*wins.keys(), *losses.keys(), *ties.keys()}:
-            out[key] = {
-                "wins": wins.get(key, 0),
-                "ties": ties.get(key, 0),
-                "losses": losses.get(key, 0),
-            }
-        return out
+        cursor.execute("""
+        SELECT dog_a, dog_b, wins, losses, ties FROM vote_tallies WHERE dog_a = ANY(%s)
+        """, (list(dog_ids),))
+
+        for dog, opponent, wins, losses, ties in cursor:
+            results[str(dog)][str(opponent)] = {"wins": wins, "ties": ties, "losses": losses}
+    return results
 
 
 @cloudfunction(
@@ -345,8 +394,8 @@ def _get_votes(data, conn):
             }
         ],
         "uniqueItems": True
-    }
-)
+    },
+    validate_output=0.1)
 def list_dogs(conn):
     return _list_dogs(conn)
 
@@ -366,90 +415,33 @@ def _list_dogs(conn):
             }
         ],
         "uniqueItems": True
-    })
+    },
+    validate_output=0.1)
 def get_ranking(conn):
     return _get_ranking(conn)
 
 
 def _get_ranking(conn):
     ids = _list_dogs(conn)
+    index = {dog: i for i, dog in enumerate(ids)}
 
     with conn.cursor(cursor_factory=RealDictCursor) as cursor:
         cursor.execute(
             """
-            WITH wins AS (
-                SELECT
-                  dog1,
-                  dog2,
-                  COUNT(*) AS win_count
-                FROM
-                  (SELECT
-                     dog1_id AS dog1,
-                     dog2_id AS dog2
-                   FROM votes
-                   WHERE result = 'win'
-                   UNION ALL
-                   SELECT
-                     dog2_id AS dog1,
-                     dog1_id AS dog2
-                   FROM votes
-                   WHERE result = 'loss') AS win
-                GROUP BY dog1, dog2
-            ), losses AS (
-                SELECT
-                  dog1,
-                  dog2,
-                  COUNT(*) AS loss_count
-                FROM
-                  (SELECT
-                     dog1_id AS dog1,
-                     dog2_id AS dog2
-                   FROM votes
-                   WHERE result = 'loss'
-                   UNION ALL
-                   SELECT
-                     dog2_id AS dog1,
-                     dog1_id AS dog2
-                   FROM votes
-                   WHERE result = 'win') AS loss
-                GROUP BY dog1, dog2
-            ), ties AS (
-                SELECT
-                  dog1,
-                  dog2,
-                  COUNT(*) AS tie_count
-                FROM
-                  (SELECT
-                     dog1_id AS dog1,
-                     dog2_id AS dog2
-                   FROM votes
-                   WHERE result = 'tie'
-                   UNION ALL
-                   SELECT
-                     dog2_id AS dog1,
-                     dog1_id AS dog2
-                   FROM votes
-                   WHERE result = 'tie') AS tie
-                GROUP BY dog1, dog2
-            )
             SELECT
-              dog1,
-              dog2,
-              SUM(win_count :: FLOAT - loss_count :: FLOAT) / SUM(loss_count + win_count + tie_count) AS margin
-            FROM losses
-              LEFT OUTER JOIN ties USING (dog1, dog2)
-              LEFT OUTER JOIN wins USING (dog1, dog2)
-            GROUP BY dog1, dog2
-            ORDER BY margin DESC;
+              dog_a AS dog1,
+              dog_b AS dog2,
+              (wins - losses) :: FLOAT / NULLIF(wins + losses + ties, 0) AS margin
+            FROM vote_tallies;
             """)
         results = cursor.fetchall()
 
-    mat = [[0 for _ in range(len(ids))] for _ in range(len(ids))]
+    mat = numpy.zeros((len(ids), len(ids)))
     for result in results:
         dog1 = result["dog1"]
         dog2 = result["dog2"]
         margin = result["margin"]
-        mat[ids.index(dog1)][ids.index(dog2)] = margin
+        mat[index[dog1], index[dog2]] = margin
 
     return ranked_pairs_ordering(ids, mat)
 
@@ -463,16 +455,45 @@ def _get_ranking(conn):
              }
         ],
         "uniqueItems": True
-    })
+    },
+    validate_output=0.1)
 def get_elo_ranking(conn):
     return _get_elo_ranking(conn)
 
 
 def _get_elo_ranking(conn):
     with conn.cursor() as cursor:
-        cursor.execute("SELECT dog1_id, dog2_id, result from votes")
-        return compute_elo(cursor)
-        
+        cursor.execute("SELECT dog_id, rating FROM elo_ratings ORDER BY rating DESC, dog_id")
+        return cursor.fetchall()
+
+
+@cloudfunction(
+    out_schema={
+        "type": "object",
+        "properties": {
+            "timings": {
+                "type": "object",
+                "additionalProperties": {
+                    "type": "object",
+                    "additionalProperties": {"type": "object"},
+                },
+            },
+            "pool": {"oneOf": [{"type": "object"}, {"type": "null"}]},
+            "dropped_log_records": {"type": "integer"},
+        },
+        "additionalProperties": False,
+        "minProperties": 3,
+    })
+def get_metrics(conn):
+    return _get_metrics(conn)
+
+
+def _get_metrics(conn):
+    """Latency histograms for each stage of each cloud function, connection pool statistics, and how many log records
+    were dropped because the log queue was full, since this instance started."""
+    return {"timings": dump_histograms(), "pool": pool_stats(), "dropped_log_records": dropped_records()}
+
+
 @cloudfunction(
     in_schema={
         # This code assumes that tiers are arrays in the database (since we are using postgreSQL) and that we do not have a tiers table
@@ -502,7 +523,9 @@ def _get_elo_ranking(conn):
         "additionalProperties": False,
         "minProperties": 10
     },
-    out_schema={"type": "null"}
+    out_schema={"type": "null"},
+    # Only once the ballot is committed will the cache find it
+    after_commit=lambda: ballot_cache.mark_changed()
     )
 
 def submit(request_json, conn):
@@ -629,9 +652,24 @@ def _get_demographics(conn):
     return out
 
 
+# The primaries ballots, shared by every request this instance handles
+ballot_cache = BallotCache()
+
+# The candidates get_normalized_plurality_drops counts the votes without
+DROPPED_CANDIDATES = ["Buttigieg", "Klobuchar", "Steyer"]
+
+# Each candidate's share of the vote, to weight ballots by
+CANDIDATE_SHARES_SCHEMA = {
+    "type": "object",
+    "properties": {candidate: {"type": "number"} for candidate in CANDIDATES},
+    "additionalProperties": False,
+    "minProperties": len(CANDIDATES)
+}
+
+
 @cloudfunction(
     out_schema={
-        "type": "array"
+        "type": "object"
     }
     )
 
@@ -639,60 +677,12 @@ def get_pairwise(conn):
     return _get_pairwise(conn)
 
 def _get_pairwise(conn):
-
-    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-        cursor.execute("""SELECT tier1, tier2, tier3, tier4, tier5, tier6, tier7, tier8, unranked 
-        from primaries_ballot WHERE submission_time <= '2020-03-03'::date""")
-
-        results = cursor.fetchall()
-
-    matrix = {
-        "Sanders": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Warren": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Biden": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Buttigieg": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Bloomberg": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Klobuchar": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Gabbard": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Steyer": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0}
-    }
-
-    for result in results:
-        tiers = []
-        tiers.append(result["tier1"])
-        tiers.append(result["tier2"])
-        tiers.append(result["tier3"])
-        tiers.append(result["tier4"])
-        tiers.append(result["tier5"])
-        tiers.append(result["tier6"])
-        tiers.append(result["tier7"])
-        tiers.append(result["tier8"])
-        for i in range(6):
-            for j in range(i + 1, 7):
-                for candidate1 in tiers[i]:
-                    for candidate2 in tiers[j]:
-                        matrix[candidate1][candidate2] = matrix[candidate1][candidate2] + 1
-
-    return matrix
+    return matrix_by_candidate(ballot_cache.groups(conn).pairwise())
 
 @cloudfunction(
-    in_schema={
-        "type": "object",
-        "properties": {
-            "Sanders": {"type": "number"},
-            "Warren": {"type": "number"},
-            "Biden": {"type": "number"},
-            "Buttigieg": {"type": "number"},
-            "Bloomberg": {"type": "number"},
-            "Klobuchar": {"type": "number"},
-            "Gabbard": {"type": "number"},
-            "Steyer": {"type": "number"}
-        },
-        "additionalProperties": False,
-        "minProperties": 8
-    },
+    in_schema=CANDIDATE_SHARES_SCHEMA,
     out_schema={
-        "type": "array"
+        "type": "object"
     }
     )
 
@@ -700,78 +690,13 @@ def get_normalized_pairwise(request_json, conn):
     return _get_normalized_pairwise(request_json, conn)
 
 def _get_normalized_pairwise(request_json, conn):
-
-    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-        cursor.execute("""SELECT tier1, tier2, tier3, tier4, tier5, tier6, tier7, tier8, unranked 
-        from primaries_ballot WHERE submission_time <= '2020-03-03'::date""")
-
-        results = cursor.fetchall()
-
-    top_candidate = {
-        "Sanders": 0,
-        "Warren": 0,
-        "Biden": 0,
-        "Buttigieg": 0,
-        "Bloomberg": 0,
-        "Klobuchar": 0,
-        "Gabbard": 0,
-        "Steyer": 0 
-    }
-
-    for result in results:
-        for candidate in result["tier1"]:
-            top_candidate[candidate] += 1
-
-    matrix = {
-        "Sanders": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Warren": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Biden": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Buttigieg": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Bloomberg": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Klobuchar": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Gabbard": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0},
-        "Steyer": {"Sanders": 0, "Warren": 0, "Biden": 0, "Buttigieg": 0, "Bloomberg": 0, "Klobuchar": 0, "Gabbard": 0, "Steyer": 0}
-    }
-
-    for result in results:
-        tiers = []
-        tiers.append(result["tier1"])
-        tiers.append(result["tier2"])
-        tiers.append(result["tier3"])
-        tiers.append(result["tier4"])
-        tiers.append(result["tier5"])
-        tiers.append(result["tier6"])
-        tiers.append(result["tier7"])
-        tiers.append(result["tier8"])
-        number_votes = 0
-        for candidate in tiers[0]:
-            number_votes += round(request_json[candidate] / top_candidate[candidate] * 1000)
-        for i in range(6):
-            for j in range(i + 1, 7):
-                for candidate1 in tiers[i]:
-                    for candidate2 in tiers[j]:
-                        matrix[candidate1][candidate2] = matrix[candidate1][candidate2] + number_votes
-
-    return matrix
+    # Each ballot counts for the weights of the candidates in its first tier, so only its group of first choices matters
+    return matrix_by_candidate(ballot_cache.groups(conn).pairwise(shares(request_json)))
 
 @cloudfunction(
-    in_schema={
-        "type": "object",
-        "properties": {
-            "Sanders": {"type": "number"},
-            "Warren": {"type": "number"},
-            "Biden": {"type": "number"},
-            "Buttigieg": {"type": "number"},
-            "Bloomberg": {"type": "number"},
-            "Klobuchar": {"type": "number"},
-            "Gabbard": {"type": "number"},
-            "Steyer": {"type": "number"}
-        },
-        "additionalProperties": False,
-        "minProperties": 8
-    },
+    in_schema=CANDIDATE_SHARES_SCHEMA,
     out_schema={
-        "type": "array"
+        "type": "object"
     }
     )
 
@@ -779,143 +704,59 @@ def get_normalized_plurality(request_json, conn):
     return _get_normalized_plurality(request_json, conn)
 
 def _get_normalized_plurality(request_json, conn):
+    ballots = ballot_cache.ballots(conn)
+    return by_candidate(ballots.plurality(ballots.normalized_weights(shares(request_json))))
 
-    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-        cursor.execute("""SELECT tier1, tier2, tier3, tier4, tier5, tier6, tier7, tier8, unranked 
-        from primaries_ballot WHERE submission_time <= '2020-03-03'::date""")
-
-        results = cursor.fetchall()
-
-    top_candidate = {
-        "Sanders": 0,
-        "Warren": 0,
-        "Biden": 0,
-        "Buttigieg": 0,
-        "Bloomberg": 0,
-        "Klobuchar": 0,
-        "Gabbard": 0,
-        "Steyer": 0 
+@cloudfunction(
+    in_schema=CANDIDATE_SHARES_SCHEMA,
+    out_schema={
+        "type": "object"
     }
+    )
 
-    for result in results:
-        for candidate in result["tier1"]:
-            top_candidate[candidate] += 1
-
-    votes = {
-        "Sanders": 0,
-        "Warren": 0,
-        "Biden": 0,
-        "Buttigieg": 0,
-        "Bloomberg": 0,
-        "Klobuchar": 0,
-        "Gabbard": 0,
-        "Steyer": 0 
-    }
+def get_normalized_plurality_drops(request_json, conn):
+    return _get_normalized_plurality_drops(request_json, conn)
 
-    for result in results:
-        number_votes = 0
-        for candidate in result["tier1"]:
-            votes[candidate] += round(request_json[candidate] / top_candidate[candidate] * 1000) * (1 / len(result["tier1"]))
+def _get_normalized_plurality_drops(request_json, conn):
+    scenarios = ballot_cache.scenarios(conn)
+    return by_candidate(scenarios.plurality(DROPPED_CANDIDATES, shares(request_json)))
 
-    return votes
-     
 @cloudfunction(
     in_schema={
         "type": "object",
         "properties": {
-            "Sanders": {"type": "number"},
-            "Warren": {"type": "number"},
-            "Biden": {"type": "number"},
-            "Buttigieg": {"type": "number"},
-            "Bloomberg": {"type": "number"},
-            "Klobuchar": {"type": "number"},
-            "Gabbard": {"type": "number"},
-            "Steyer": {"type": "number"}
+            "dropped": {"type": "array", "items": {"enum": CANDIDATES}, "uniqueItems": True},
+            "shares": CANDIDATE_SHARES_SCHEMA
         },
         "additionalProperties": False,
-        "minProperties": 8
+        "required": ["dropped"]
     },
     out_schema={
-        "type": "array"
+        "type": "object",
+        "properties": {
+            "plurality": {"type": "object"},
+            "instant_runoff": {"type": "array"}
+        },
+        "additionalProperties": False,
+        "minProperties": 2
     }
     )
 
-def get_normalized_plurality_drops(request_json, conn):
-    return _get_normalized_plurality_drops(request_json, conn)
-
-def _get_normalized_plurality_drops(request_json, conn):
-
-    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-        cursor.execute("""SELECT tier1, tier2, tier3, tier4, tier5, tier6, tier7, tier8, unranked 
-        from primaries_ballot WHERE submission_time <= '2020-03-03'::date""")
-
-        results = cursor.fetchall()
-
-    top_candidate = {
-        "Sanders": 0,
-        "Warren": 0,
-        "Biden": 0,
-        "Buttigieg": 0,
-        "Bloomberg": 0,
-        "Klobuchar": 0,
-        "Gabbard": 0,
-        "Steyer": 0 
+def get_scenario(request_json, conn):
+    return _get_scenario(request_json, conn)
+
+def _get_scenario(request_json, conn):
+    # Shares are optional, without them every ballot counts once
+    candidate_shares = shares(request_json["shares"]) if "shares" in request_json else None
+    scenarios = ballot_cache.scenarios(conn)
+    rounds, eliminated = scenarios.instant_runoff(request_json["dropped"], candidate_shares)
+    return {
+        "plurality": by_candidate(scenarios.plurality(request_json["dropped"], candidate_shares)),
+        "instant_runoff": _runoff_result(rounds, eliminated)
     }
 
-    for result in results:
-        for candidate in result["tier1"]:
-            top_candidate[candidate] += 1
-
-    votes = {
-        "Sanders": 0,
-        "Warren": 0,
-        "Biden": 0,
-        "Buttigieg": 0,
-        "Bloomberg": 0,
-        "Klobuchar": 0,
-        "Gabbard": 0,
-        "Steyer": 0 
-    }
-
-    for result in results:
-        number_votes = 0
-        for candidate in result["tier1"]:
-            number_votes += round(request_json[candidate] / top_candidate[candidate] * 1000)
-
-        result["tier1"] = list(filter(lambda x: x != "Buttigieg" and x != "Klobuchar" and x != "Steyer", result["tier1"]))
-        result["tier2"] = list(filter(lambda x: x != "Buttigieg" and x != "Klobuchar" and x != "Steyer", result["tier2"]))
-        result["tier3"] = list(filter(lambda x: x != "Buttigieg" and x != "Klobuchar" and x != "Steyer", result["tier3"]))
-
-        if len(result["tier1"]) > 0:
-            for candidate in result["tier1"]:
-                votes[candidate] += number_votes * (1 / len(result["tier1"]))
-        elif len(result["tier2"]) > 0:
-            for candidate in result["tier2"]:
-                votes[candidate] += number_votes * (1 / len(result["tier2"]))
-        elif len(result["tier3"]) > 0:
-            for candidate in result["tier3"]:
-                votes[candidate] += number_votes * (1 / len(result["tier3"]))
-        else:
-            for candidate in result["tier4"]:
-                votes[candidate] += number_votes * (1 / len(result["tier4"]))
-    return votes
-
 @cloudfunction(
-    in_schema={
-        "type": "object",
-        "properties": {
-            "Sanders": {"type": "number"},
-            "Warren": {"type": "number"},
-            "Biden": {"type": "number"},
-            "Buttigieg": {"type": "number"},
-            "Bloomberg": {"type": "number"},
-            "Klobuchar": {"type": "number"},
-            "Gabbard": {"type": "number"},
-            "Steyer": {"type": "number"}
-        },
-        "additionalProperties": False,
-        "minProperties": 8
-    },
+    in_schema=CANDIDATE_SHARES_SCHEMA,
     out_schema={
         "type": "array"
     }
@@ -925,139 +766,17 @@ def get_normalized_instant_runoff(request_json, conn):
     return _get_normalized_instant_runoff(request_json, conn)
 
 def _get_normalized_instant_runoff(request_json, conn):
+    return _instant_runoff(ballot_cache.ballots(conn), shares(request_json))
 
-    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-        cursor.execute("""SELECT tier1, tier2, tier3, tier4, tier5, tier6, tier7, tier8, unranked 
-        from primaries_ballot WHERE submission_time <= '2020-03-03'::date""")
-
-        results = cursor.fetchall()
-
-    done = False
-    removedCandidates = []
-
-    while(not done):
-        for result in results:
-            result["tier1"] = list(filter(lambda x: not x in removedCandidates, result["tier1"]))
-            result["tier2"] = list(filter(lambda x: not x in removedCandidates, result["tier2"]))
-            result["tier3"] = list(filter(lambda x: not x in removedCandidates, result["tier3"]))
-            result["tier4"] = list(filter(lambda x: not x in removedCandidates, result["tier4"]))
-            result["tier5"] = list(filter(lambda x: not x in removedCandidates, result["tier5"]))
-            result["tier6"] = list(filter(lambda x: not x in removedCandidates, result["tier6"]))
-            result["tier7"] = list(filter(lambda x: not x in removedCandidates, result["tier7"]))
-            result["tier8"] = list(filter(lambda x: not x in removedCandidates, result["tier8"]))
-
-        top_candidate = {
-            "Sanders": 0,
-            "Warren": 0,
-            "Biden": 0,
-            "Buttigieg": 0,
-            "Bloomberg": 0,
-            "Klobuchar": 0,
-            "Gabbard": 0,
-            "Steyer": 0 
-        }
-
-        for candidate in removedCandidates:
-            top_candidate.pop(candidate)
-
-        for result in results:
-            if len(result["tier1"]) > 0:
-                for candidate in result["tier1"]:
-                    top_candidate[candidate] += 1
-            elif len(result["tier2"]) > 0:
-                for candidate in result["tier2"]:
-                    top_candidate[candidate] += 1
-            elif len(result["tier3"]) > 0:
-                for candidate in result["tier3"]:
-                    top_candidate[candidate] += 1
-            elif len(result["tier4"]) > 0:
-                for candidate in result["tier4"]:
-                    top_candidate[candidate] += 1
-            elif len(result["tier5"]) > 0:
-                for candidate in result["tier5"]:
-                    top_candidate[candidate] += 1
-            elif len(result["tier6"]) > 0:
-                for candidate in result["tier6"]:
-                    top_candidate[candidate] += 1
-            elif len(result["tier7"]) > 0:
-                for candidate in result["tier7"]:
-                    top_candidate[candidate] += 1
-            else:
-                for candidate in result["tier8"]:
-                    top_candidate[candidate] += 1
-
-        votes = {
-            "Sanders": 0,
-            "Warren": 0,
-            "Biden": 0,
-            "Buttigieg": 0,
-            "Bloomberg": 0,
-            "Klobuchar": 0,
-            "Gabbard": 0,
-            "Steyer": 0 
-        }
+def _instant_runoff(ballots, candidate_shares=None):
+    rounds, eliminated = ballots.instant_runoff(candidate_shares)
+    log(logging.INFO, "instant runoff", rounds=rounds, eliminated=eliminated)
+    return _runoff_result(rounds, eliminated)
 
-        for candidate in removedCandidates:
-            votes.pop(candidate)
-
-        for result in results:
-            number_votes = 0
-
-            if len(result["tier1"]) > 0:
-                for candidate in result["tier1"]:
-                    number_votes += round(request_json[candidate] / top_candidate[candidate] * 1000)
-                for candidate in result["tier1"]:
-                    votes[candidate] += number_votes * (1 / len(result["tier1"]))
-            elif len(result["tier2"]) > 0:
-                for candidate in result["tier2"]:
-                    number_votes += round(request_json[candidate] / top_candidate[candidate] * 1000)
-                for candidate in result["tier2"]:
-                    votes[candidate] += number_votes * (1 / len(result["tier2"]))
-            elif len(result["tier3"]) > 0:
-                for candidate in result["tier3"]:
-                    number_votes += round(request_json[candidate] / top_candidate[candidate] * 1000)
-                for candidate in result["tier3"]:
-                    votes[candidate] += number_votes * (1 / len(result["tier3"]))
-            elif len(result["tier4"]) > 0:
-                for candidate in result["tier4"]:
-                    number_votes += round(request_json[candidate] / top_candidate[candidate] * 1000)
-                for candidate in result["tier4"]:
-                    votes[candidate] += number_votes * (1 / len(result["tier4"]))
-            elif len(result["tier5"]) > 0:
-                for candidate in result["tier5"]:
-                    number_votes += round(request_json[candidate] / top_candidate[candidate] * 1000)
-                for candidate in result["tier5"]:
-                    votes[candidate] += number_votes * (1 / len(result["tier5"]))
-            elif len(result["tier6"]) > 0:
-                for candidate in result["tier6"]:
-                    number_votes += round(request_json[candidate] / top_candidate[candidate] * 1000)
-                for candidate in result["tier6"]:
-                    votes[candidate] += number_votes * (1 / len(result["tier6"]))
-            elif len(result["tier7"]) > 0:
-                for candidate in result["tier7"]:
-                    number_votes += round(request_json[candidate] / top_candidate[candidate] * 1000)
-                for candidate in result["tier7"]:
-                    votes[candidate] += number_votes * (1 / len(result["tier7"]))
-            else:
-                for candidate in result["tier8"]:
-                    number_votes += round(request_json[candidate] / top_candidate[candidate] * 1000)
-                for candidate in result["tier8"]:
-                    votes[candidate] += number_votes * (1 / len(result["tier8"]))
-        
-        if (bool(_majorirty(votes))):
-            return [votes, removedCandidates]
-        else:
-            print([votes, removedCandidates])
-            if len(removedCandidates) == 8:
-                return ["no winner"]
-            else:
-                minVotes = min(votes.values())
-                minVotesCandidate = [key for key in votes if votes[key] == minVotes] 
-                removedCandidates.append(minVotesCandidate[0])
-
-def _majorirty(votes):
-    neededForMajority = sum(votes.values()) / 2
-    return {k:v for (k,v) in votes.items() if v >= neededForMajority}
+def _runoff_result(rounds, eliminated):
+    if not rounds[-1]:
+        return ["no winner"]
+    return [rounds[-1], eliminated]
 
 @cloudfunction(
     out_schema={
@@ -1069,76 +788,4 @@ def get_instant_runoff(conn):
     return _get_instant_runoff(conn)
 
 def _get_instant_runoff(conn):
-
-    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-        cursor.execute("""SELECT tier1, tier2, tier3, tier4, tier5, tier6, tier7, tier8, unranked 
-        from primaries_ballot WHERE submission_time <= '2020-03-03'::date""")
-
-        results = cursor.fetchall()
-
-    done = False
-    removedCandidates = []
-
-    while(not done):
-        for result in results:
-            result["tier1"] = list(filter(lambda x: not x in removedCandidates, result["tier1"]))
-            result["tier2"] = list(filter(lambda x: not x in removedCandidates, result["tier2"]))
-            result["tier3"] = list(filter(lambda x: not x in removedCandidates, result["tier3"]))
-            result["tier4"] = list(filter(lambda x: not x in removedCandidates, result["tier4"]))
-            result["tier5"] = list(filter(lambda x: not x in removedCandidates, result["tier5"]))
-            result["tier6"] = list(filter(lambda x: not x in removedCandidates, result["tier6"]))
-            result["tier7"] = list(filter(lambda x: not x in removedCandidates, result["tier7"]))
-            result["tier8"] = list(filter(lambda x: not x in removedCandidates, result["tier8"]))
-
-        votes = {
-            "Sanders": 0,
-            "Warren": 0,
-            "Biden": 0,
-            "Buttigieg": 0,
-            "Bloomberg": 0,
-            "Klobuchar": 0,
-            "Gabbard": 0,
-            "Steyer": 0 
-        }
-
-        for candidate in removedCandidates:
-            votes.pop(candidate)
-
-        for result in results:
-            number_votes = 0
-
-            if len(result["tier1"]) > 0:
-                for candidate in result["tier1"]:
-                    votes[candidate] += (1 / len(result["tier1"]))
-            elif len(result["tier2"]) > 0:
-                for candidate in result["tier2"]:
-                    votes[candidate] += (1 / len(result["tier2"]))
-            elif len(result["tier3"]) > 0:
-                for candidate in result["tier3"]:
-                    votes[candidate] += (1 / len(result["tier3"]))
-            elif len(result["tier4"]) > 0:
-                for candidate in result["tier4"]:
-                    votes[candidate] += (1 / len(result["tier4"]))
-            elif len(result["tier5"]) > 0:
-                for candidate in result["tier5"]:
-                    votes[candidate] += (1 / len(result["tier5"]))
-            elif len(result["tier6"]) > 0:
-                for candidate in result["tier6"]:
-                    votes[candidate] += (1 / len(result["tier6"]))
-            elif len(result["tier7"]) > 0:
-                for candidate in result["tier7"]:
-                    votes[candidate] += (1 / len(result["tier7"]))
-            else:
-                for candidate in result["tier8"]:
-                    votes[candidate] += (1 / len(result["tier8"]))
-        
-        if (bool(_majorirty(votes))):
-            return [votes, removedCandidates]
-        else:
-            print([votes, removedCandidates])
-            if len(removedCandidates) == 8:
-                return ["no winner"]
-            else:
-                minVotes = min(votes.values())
-                minVotesCandidate = [key for key in votes if votes[key] == minVotes] 
-                removedCandidates.append(minVotesCandidate[0])
+    return _instant_runoff(ballot_cache.ballots(conn))
@@ -0,0 +1,64 @@
+#! /usr/bin/env python3
+"""
+Rebuilds the aggregate tables that the cloud functions keep up to date as votes come in, for when they have been
+created after the fact or have drifted from `votes`, and moves data over after schema migrations.
+"""
+
+import argparse
+import json
+
+from util.elo import REPLAY_ORDERS, rebuild_elo
+from util.get_pool import get_connection
+from util.image_store import migrate_images
+from util.tallies import rebuild_tallies
+
+
+def main(args):
+    with open(args.credentials) as f:
+        connection_details = json.load(f)
+
+    conn = get_connection(connection_details)
+    args.command(conn, args)
+    conn.commit()
+
+
+def rebuild_tallies_command(conn, args):
+    rebuild_tallies(conn)
+
+
+def rebuild_elo_command(conn, args):
+    rebuild_elo(conn, args.order, args.seed, args.checkpoint_every)
+
+
+def migrate_images_command(conn, args):
+    print(f"Moved {migrate_images(conn, args.batch_size)} images into the image store")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--credentials", required=True,
+                        help="Path to the credentials for the postgres instance the data is stored in.")
+    subparsers = parser.add_subparsers(required=True)
+
+    tallies_parser = subparsers.add_parser("rebuild_tallies",
+                                           help="Recompute vote_tallies from votes, e.g. after running "
+                                                "sql/migrate_vote_tallies.sql.")
+    tallies_parser.set_defaults(command=rebuild_tallies_command)
+
+    elo_parser = subparsers.add_parser("rebuild_elo",
+                                       help="Recompute elo_ratings by replaying votes, e.g. after running "
+                                            "sql/migrate_elo_ratings.sql.")
+    elo_parser.add_argument("--order", default="submission", choices=REPLAY_ORDERS)
+    elo_parser.add_argument("--seed", type=int, help="Seed for --order shuffle.")
+    elo_parser.add_argument("--checkpoint_every", type=int,
+                            help="Write the ratings to elo_checkpoints after every this many votes.")
+    elo_parser.set_defaults(command=rebuild_elo_command)
+
+    images_parser = subparsers.add_parser("migrate_images",
+                                          help="Move images stored inline in dogs into the image store, after running "
+                                               "sql/migrate_image_store.sql.")
+    images_parser.add_argument("--batch_size", type=int, default=100, help="Commit after moving this many images.")
+    images_parser.set_defaults(command=migrate_images_command)
+
+    args = parser.parse_args()
+    main(args)
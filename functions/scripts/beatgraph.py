@@ -1,45 +1,27 @@
-from collections import defaultdict
-
-from util.get_pool import get_connection
-from xranking import get_victory_graph
-import networkx as nx
-import json
-import pygraphviz as pgv
-
-with open('../../credentials.json') as creds:
-    conn = get_connection(json.load(creds))
+#! /usr/bin/env python3
+"""
+Draws which dogs beat which, as the transitive reduction of the ranked pairs graph.
+"""
 
-matchups = get_victory_graph(conn, defaultdict(bool))
-
-win_edges = sorted([edge for edge in matchups.edges],
-                   key=lambda x: matchups.get_edge_data(x[0], x[1])["margin"],
-                   reverse=True)
-
-print(win_edges)
-new_graph = nx.DiGraph()
-new_graph.add_nodes_from(matchups.nodes)
-for (u, v) in win_edges:
-    if v not in nx.descendants(new_graph, u):
-        new_graph.add_edge(u, v)
-        print(f"adding {u}, {v}")
+import argparse
+from collections import defaultdict
 
-to_remove = []
-e = [x for x in new_graph.edges]
-for (u, v) in e:
-    new_graph.remove_edge(u, v)
-    has_other_path = nx.has_path(new_graph, u, v)
+from util.beatgraph import beat_graph, render
+from xranking import add_source_arguments, connect, get_matchups
 
-    # print(u, v, list(paths), len(list(paths)))
-    if not has_other_path:
-        print(f"keeping {u}, {v}")
-        new_graph.add_edge(u, v)
 
-new_graph.remove_edges_from(to_remove)
+def main(args):
+    conn = connect(args)
+    dogs, edges = beat_graph(get_matchups(conn, defaultdict(bool)), args.top)
+    print(edges)
+    render(dogs, edges, args.output, args.layout_cache)
 
-G = pgv.AGraph(directed=True)
-G.add_nodes_from(matchups.nodes)
-G.node_attr['shape'] = 'square'
-G.add_edges_from(new_graph.edges)
 
-G.layout(prog='dot')
-G.draw('file.png')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    add_source_arguments(parser)
+    parser.add_argument("--top", type=int, help="Only draw this many of the best dogs.")
+    parser.add_argument("--output", default="file.png")
+    parser.add_argument("--layout_cache",
+                        help="Directory to keep layouts in, so drawing an unchanged graph again skips laying it out.")
+    main(parser.parse_args())
@@ -2,7 +2,9 @@ import random
 
 import pytest
 
+from util.elo import rebuild_elo
 from util.get_pool import get_connection
+from util.tallies import rebuild_tallies
 
 def connect_to_clean_db():
     conn = get_connection()
@@ -43,6 +45,8 @@ def populated_database_conn():
             winner = ["win", "loss", "tie"][random.randint(0, 2)]
             cursor.execute("""INSERT INTO votes (voter_id, dog1_id, dog2_id, result) VALUES (%s, %s, %s, %s) """,
                            (1, dog1, dog2, winner))
+    rebuild_tallies(conn)
+    rebuild_elo(conn)
 
     yield conn
     conn.close()
@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import json
 from unittest.mock import Mock
 
@@ -28,7 +29,8 @@ def test_submit_dog_happy_path():
         dog_id = json.loads(submit_dog(mock_request(data))[0])
 
         dog_data = json.loads(get_dog(mock_request({"id": dog_id}))[0])
-        assert dog_data["image"] == image_data, 'UTF-8'
+        assert dog_data["image_hash"] == hashlib.sha256(b"This is a test image").hexdigest()
+        assert set(dog_data["image_urls"]) == {"original", "thumbnail", "display"}
         assert dog_data["dog_age"] == 12
         assert dog_data["dog_breed"] == "mutt"
         assert dog_data["dog_weight"] == \
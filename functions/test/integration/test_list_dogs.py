@@ -1,4 +1,4 @@
-from main import _list_dogs, _submit_dog, _get_dog, _get_votes
+from main import _list_dogs, _submit_dog, _get_dog, _get_votes, _get_votes_batch
 from test.fixtures import conn, populated_database_conn
 
 
@@ -36,3 +36,10 @@ def test_list_dogs_all_dogs_valid_for_get_votes(conn):
     for dog in _list_dogs(conn):
         _get_votes({"id": dog}, conn)
         _get_dog({"id": dog}, conn)
+
+
+def test_get_votes_batch_matches_get_votes(populated_database_conn):
+    conn = populated_database_conn
+    dogs = _list_dogs(conn)
+
+    assert _get_votes_batch({"ids": dogs}, conn) == {str(dog): _get_votes({"id": dog}, conn) for dog in dogs}
@@ -0,0 +1,266 @@
+import random
+from unittest.mock import MagicMock
+
+import numpy
+import pytest
+
+from util.ballots import CANDIDATES, BallotCache, Ballots, FirstChoiceGroups, Scenarios, by_candidate, \
+    matrix_by_candidate, shares
+
+
+def random_rows(seed, count=200):
+    rng = random.Random(seed)
+    rows = []
+    for ballot_id in range(count):
+        candidates = CANDIDATES[:]
+        rng.shuffle(candidates)
+        tiers = [[] for _ in range(8)]
+        # Every ballot has a first choice, and ranks each candidate at most once
+        tiers[0].append(candidates[0])
+        for candidate in candidates[1:rng.randrange(1, len(candidates) + 1)]:
+            tiers[rng.randrange(len(tiers))].append(candidate)
+        rows.append((ballot_id, *tiers))
+    return rows
+
+
+def reference_pairwise(rows, weight=lambda tiers: 1):
+    """The nested loops these arrays replaced"""
+    matrix = {c1: {c2: 0 for c2 in CANDIDATES} for c1 in CANDIDATES}
+    for _, *tiers in rows:
+        for i in range(6):
+            for j in range(i + 1, 7):
+                for candidate1 in tiers[i]:
+                    for candidate2 in tiers[j]:
+                        matrix[candidate1][candidate2] += weight(tiers)
+    return matrix
+
+
+def reference_first_choices(rows):
+    top_candidate = {candidate: 0 for candidate in CANDIDATES}
+    for _, tier1, *_ in rows:
+        for candidate in tier1:
+            top_candidate[candidate] += 1
+    return top_candidate
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pairwise(seed):
+    rows = random_rows(seed)
+    assert matrix_by_candidate(Ballots.from_rows(rows).pairwise()) == reference_pairwise(rows)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_normalized_pairwise_and_plurality(seed):
+    rows = random_rows(seed)
+    request_json = {candidate: random.Random(seed).random() for candidate in CANDIDATES}
+    top_candidate = reference_first_choices(rows)
+
+    def number_votes(tiers):
+        return sum(round(request_json[c] / top_candidate[c] * 1000) for c in tiers[0])
+
+    ballots = Ballots.from_rows(rows)
+    weights = ballots.normalized_weights([request_json[c] for c in CANDIDATES])
+    assert matrix_by_candidate(ballots.pairwise(ballots.ballot_weights(weights))) == \
+        reference_pairwise(rows, number_votes)
+
+    votes = {candidate: 0 for candidate in CANDIDATES}
+    for _, tier1, *_ in rows:
+        for candidate in tier1:
+            votes[candidate] += round(request_json[candidate] / top_candidate[candidate] * 1000) * (1 / len(tier1))
+    assert by_candidate(ballots.plurality(weights)) == pytest.approx(votes)
+
+
+def test_missing_tiers_and_unknown_candidates():
+    ballots = Ballots.from_rows([(1, ["Sanders", "Someone"], None, ["Warren"], None, None, None, None, None)])
+    assert by_candidate(ballots.plurality())["Sanders"] == 1
+    assert matrix_by_candidate(ballots.pairwise())["Sanders"]["Warren"] == 1
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_first_choice_groups(seed):
+    rows = random_rows(seed)
+    ballots = Ballots.from_rows(rows)
+    groups = FirstChoiceGroups.from_ballots(Ballots.from_rows(rows[:50])) + \
+        FirstChoiceGroups.from_ballots(Ballots.from_rows(rows[50:]))
+    candidate_shares = [random.Random(seed).random() for _ in CANDIDATES]
+
+    assert numpy.array_equal(groups.pairwise(), ballots.pairwise())
+    weights = ballots.ballot_weights(ballots.normalized_weights(candidate_shares))
+    assert numpy.array_equal(groups.pairwise(candidate_shares), ballots.pairwise(weights))
+
+
+def reference_instant_runoff(rows, request_json=None, dropped=(), fixed_weights=False):
+    """The loops the runoff engine replaced, returning every round. With fixed_weights, ballots are weighted once by
+    their first choices, as in Scenarios, rather than every round by their current choices."""
+    first_choices = reference_first_choices(rows)
+    removed = list(dropped)
+    rounds = []
+    while True:
+        current = [[[c for c in tier if c not in removed] for tier in tiers] for _, *tiers in rows]
+        top_tiers = [next((tier for tier in tiers if tier), []) for tiers in current]
+        top_candidate = {candidate: 0 for candidate in CANDIDATES if candidate not in removed}
+        for tier in top_tiers:
+            for candidate in tier:
+                top_candidate[candidate] += 1
+        votes = {candidate: 0 for candidate in CANDIDATES if candidate not in removed}
+        for (_, tier1, *_), tier in zip(rows, top_tiers):
+            number_votes = 1
+            if request_json is not None and fixed_weights:
+                number_votes = sum(round(request_json[c] / first_choices[c] * 1000) for c in tier1)
+            elif request_json is not None:
+                number_votes = sum(round(request_json[c] / top_candidate[c] * 1000) for c in tier)
+            for candidate in tier:
+                votes[candidate] += number_votes * (1 / len(tier))
+        rounds.append(votes)
+        if any(v >= sum(votes.values()) / 2 for v in votes.values()) or len(removed) == 8:
+            return rounds, removed[len(dropped):]
+        min_votes = min(votes.values())
+        removed.append(next(key for key in votes if votes[key] == min_votes))
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("normalized", [False, True])
+def test_instant_runoff(seed, normalized):
+    # Few ballots, so that runoffs last several rounds
+    rows = random_rows(seed, count=30)
+    request_json = {candidate: random.Random(seed).random() for candidate in CANDIDATES} if normalized else None
+    rounds, eliminated = Ballots.from_rows(rows).instant_runoff(shares(request_json) if normalized else None)
+    expected_rounds, expected_eliminated = reference_instant_runoff(rows, request_json)
+    assert eliminated == expected_eliminated
+    assert rounds == [pytest.approx(votes) for votes in expected_rounds]
+
+
+def test_eliminated_ballots_move_or_exhaust():
+    rows = [(1, ["Warren"], None, None, None, None, None, None, None),
+            (2, ["Sanders"], ["Warren"], None, None, None, None, None, None),
+            (3, ["Biden"], None, None, None, None, None, None, None),
+            (4, ["Biden"], None, None, None, None, None, None, None),
+            (5, ["Klobuchar"], None, None, None, None, None, None, None)]
+    rounds, eliminated = Ballots.from_rows(rows).instant_runoff()
+    assert eliminated == ["Buttigieg", "Bloomberg", "Gabbard", "Steyer", "Sanders", "Klobuchar"]
+    assert rounds[-2] == {"Warren": 2, "Biden": 2, "Klobuchar": 1}
+    # Nobody's ballot goes on past Klobuchar, so 2 of the 4 ballots left is a majority
+    assert rounds[-1] == {"Warren": 2, "Biden": 2}
+
+
+def reference_plurality_drops(rows, dropped, request_json=None):
+    """The loop get_normalized_plurality_drops had, for any candidates dropped and looking past tier 4"""
+    top_candidate = reference_first_choices(rows)
+    votes = {candidate: 0 for candidate in CANDIDATES}
+    for _, *tiers in rows:
+        number_votes = 1
+        if request_json is not None:
+            number_votes = sum(round(request_json[c] / top_candidate[c] * 1000) for c in tiers[0])
+        tier = next((tier for tier in ([c for c in tier if c not in dropped] for tier in tiers) if tier), [])
+        for candidate in tier:
+            votes[candidate] += number_votes * (1 / len(tier))
+    return votes
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("normalized", [False, True])
+def test_scenarios(seed, normalized):
+    rows = random_rows(seed, count=60)
+    rng = random.Random(seed)
+    request_json = {candidate: rng.random() for candidate in CANDIDATES} if normalized else None
+    candidate_shares = shares(request_json) if normalized else None
+    scenarios = Scenarios(Ballots.from_rows(rows))
+
+    for dropped in [[], ["Buttigieg", "Klobuchar", "Steyer"], rng.sample(CANDIDATES, 5), CANDIDATES]:
+        expected = reference_plurality_drops(rows, dropped, request_json)
+        assert by_candidate(scenarios.plurality(dropped, candidate_shares)) == pytest.approx(expected)
+        # Memoized the second time
+        assert by_candidate(scenarios.plurality(dropped, candidate_shares)) == pytest.approx(expected)
+
+        rounds, eliminated = scenarios.instant_runoff(dropped, candidate_shares)
+        expected_rounds, expected_eliminated = reference_instant_runoff(rows, request_json, dropped, fixed_weights=True)
+        assert eliminated == expected_eliminated
+        assert rounds == [pytest.approx(votes) for votes in expected_rounds]
+        assert scenarios.instant_runoff(dropped, candidate_shares) == (rounds, eliminated)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_scenario_runoff_starts_from_plurality(seed):
+    rng = random.Random(seed)
+    scenarios = Scenarios(Ballots.from_rows(random_rows(seed, count=60)))
+    candidate_shares = [rng.random() for _ in CANDIDATES]
+    dropped = ["Sanders", *rng.sample(CANDIDATES[1:], 2)]
+
+    plurality = by_candidate(scenarios.plurality(dropped, candidate_shares))
+    first_round = scenarios.instant_runoff(dropped, candidate_shares)[0][0]
+    assert first_round == {candidate: plurality[candidate] for candidate in CANDIDATES if candidate not in dropped}
+
+
+def test_scenario_runoffs_are_bounded():
+    scenarios = Scenarios(Ballots.from_rows(random_rows(0, count=10)), runoff_entries=2)
+    for candidate in CANDIDATES[:3]:
+        scenarios.instant_runoff([candidate])
+    assert len(scenarios._runoffs) == 2
+
+
+def table_connection(table):
+    """A connection to a primaries_ballot table of (id, tier1, ..., tier8) rows, answering load_ballots and
+    ballot_marker"""
+    cursor = MagicMock()
+
+    def execute(query, params):
+        if "MAX(id)" in query:
+            cursor.fetchone.return_value = (max((row[0] for row in table), default=None), len(table))
+        else:
+            cursor.fetchall.return_value = [row for row in table if row[0] > params[1]]
+
+    cursor.execute.side_effect = execute
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cursor
+    return conn, cursor
+
+
+def loads(cursor):
+    return [call.args[1][1] for call in cursor.execute.call_args_list if "MAX(id)" not in call.args[0]]
+
+
+def test_ballot_cache_refreshes_by_id():
+    table = random_rows(0, count=10)
+    conn, cursor = table_connection(table)
+    now = [0]
+    cache = BallotCache(check_seconds=60, clock=lambda: now[0])
+
+    assert cache.ballots(conn).ids.tolist() == list(range(10))
+    table.append((10, ["Warren"], [], [], [], [], [], [], []))
+    # Not checked again until check_seconds have passed...
+    assert len(cache.ballots(conn)) == 10
+    # ...unless a ballot was submitted here, and then only the new ballot is loaded
+    cache.mark_changed()
+    assert cache.ballots(conn).ids.tolist() == list(range(11))
+    assert loads(cursor) == [-1, 9]
+    assert matrix_by_candidate(cache.groups(conn).pairwise()) == reference_pairwise(table)
+    assert cache.scenarios(conn).instant_runoff() == cache.ballots(conn).instant_runoff()
+
+    now[0] = 60
+    assert len(cache.ballots(conn)) == 11
+    assert loads(cursor) == [-1, 9]
+
+    del table[3]
+    now[0] = 120
+    assert 3 not in cache.ballots(conn).ids.tolist()
+    assert loads(cursor) == [-1, 9, 10, -1]
+    assert matrix_by_candidate(cache.ballots(conn).pairwise()) == reference_pairwise(table)
+    assert matrix_by_candidate(cache.groups(conn).pairwise()) == reference_pairwise(table)
+
+
+def test_ballot_cache_change_during_refresh_is_not_lost():
+    table = random_rows(0, count=3)
+    conn, cursor = table_connection(table)
+    cache = BallotCache(check_seconds=60, clock=lambda: 0)
+    execute = cursor.execute.side_effect
+
+    def commit_during_refresh(query, params):
+        execute(query, params)
+        # Another request's ballot is committed after this read has loaded the ballots
+        if "MAX(id)" not in query and len(table) == 3:
+            table.append((3, ["Warren"], [], [], [], [], [], [], []))
+            cache.mark_changed()
+
+    cursor.execute.side_effect = commit_during_refresh
+    assert len(cache.ballots(conn)) == 3
+    assert len(cache.ballots(conn)) == 4
@@ -0,0 +1,41 @@
+import random
+
+import networkx
+import pytest
+
+from util.beatgraph import beat_graph, transitive_reduction
+from util.matchups import Matchups
+from util.ranked_pairs import topological_order
+from util.vote_columns import RESULTS, VoteColumns
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_transitive_reduction_matches_networkx(seed):
+    rng = random.Random(seed)
+    n = rng.randrange(1, 12)
+    children = [[v for v in range(u + 1, n) if rng.random() < 0.4] for u in range(n)]
+    permutation = list(range(n))
+    rng.shuffle(permutation)
+    children = [[permutation[v] for v in children[permutation.index(u)]] for u in range(n)]
+
+    g = networkx.DiGraph([(u, v) for u in range(n) for v in children[u]])
+    g.add_nodes_from(range(n))
+    assert sorted(transitive_reduction(children, topological_order(children))) == \
+        sorted(networkx.transitive_reduction(g).edges)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_top_dogs_keep_their_paths(seed):
+    rng = random.Random(seed)
+    votes = VoteColumns.from_rows([(rng.randrange(10), rng.randrange(10), rng.randrange(len(RESULTS)), 0, 0.0)
+                                   for _ in range(150)])
+    dogs, edges = beat_graph(Matchups.from_votes(votes))
+    top_dogs, top_edges = beat_graph(Matchups.from_votes(votes), top=4)
+
+    full = networkx.DiGraph(edges)
+    full.add_nodes_from(dogs)
+    assert networkx.is_directed_acyclic_graph(full)
+    assert top_dogs == dogs[:4]
+
+    closure = networkx.transitive_closure_dag(full).subgraph(top_dogs)
+    assert sorted(top_edges) == sorted(networkx.transitive_reduction(closure).edges)
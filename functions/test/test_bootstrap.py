@@ -0,0 +1,27 @@
+import functools
+import random
+
+import numpy
+
+from util.bootstrap import bootstrap_ranks, summarize_ranks
+from util.vote_columns import VoteColumns, WIN
+from xranking import rank_votes
+
+
+def test_bootstrap_is_reproducible_and_ordered():
+    rng = random.Random(0)
+    # Lower ids almost always win
+    rows = []
+    for _ in range(300):
+        dog1, dog2 = rng.sample(range(6), 2)
+        rows.append((min(dog1, dog2), max(dog1, dog2), WIN if rng.random() < 0.9 else 1, 0, 0.0))
+    votes = VoteColumns.from_rows(rows)
+    rank = functools.partial(rank_votes, "elo")
+
+    dogs, positions = bootstrap_ranks(rank, votes, 40, seed=1, workers=2)
+    assert positions.shape == (40, 6)
+    assert numpy.array_equal(positions, bootstrap_ranks(rank, votes, 40, seed=1, workers=1)[1])
+
+    summary = summarize_ranks(dogs, positions)
+    assert [dog for dog, *_ in summary] == [0, 1, 2, 3, 4, 5]
+    assert all(low <= median <= high for _, median, low, high in summary)
@@ -0,0 +1,118 @@
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from util import cloudfunction as cf
+from util.timing import dump_histograms
+
+
+def mock_request(data):
+    return Mock(method="POST", get_json=Mock(return_value=data), args=data, headers={})
+
+
+@pytest.fixture(autouse=True)
+def mock_pool(monkeypatch):
+    pool = Mock()
+    monkeypatch.setattr(cf, "pg_pool", pool)
+    return pool
+
+
+def test_valid_request():
+    @cf.cloudfunction(in_schema={"type": "integer"}, out_schema={"type": "integer"})
+    def double(request_json, conn):
+        return request_json * 2
+
+    body, status, headers = double(mock_request(21))
+    assert status == 200
+    assert json.loads(body) == 42
+    assert headers["Access-Control-Allow-Origin"] == "*"
+
+
+def test_invalid_request():
+    @cf.cloudfunction(in_schema={"type": "integer"}, out_schema={"type": "integer"})
+    def double(request_json, conn):
+        return request_json * 2
+
+    assert double(mock_request("21"))[1] == 500
+
+
+@pytest.mark.parametrize("validate_output, status", [("always", 500), ("debug", 200), (0, 200), (1, 500)])
+def test_validate_output(validate_output, status):
+    @cf.cloudfunction(out_schema={"type": "integer"}, validate_output=validate_output)
+    def wrong_type(conn):
+        return "not an integer"
+
+    assert wrong_type(mock_request(None))[1] == status
+
+
+def test_stage_timings():
+    @cf.cloudfunction(in_schema={"type": "integer"}, out_schema={"type": "integer"})
+    def timed(request_json, conn):
+        return request_json
+
+    headers = timed(mock_request(1))[2]
+    stages = [timing.split(";")[0] for timing in headers["Server-Timing"].split(", ")]
+    assert stages == ["pool", "parse", "validate_input", "handler", "validate_output", "commit", "serialize", "total"]
+
+    histograms = dump_histograms()["timed"]
+    assert histograms["handler"]["count"] >= 1
+    assert histograms["total"]["p50_ms"] is not None
+
+
+def test_payload_logging(monkeypatch):
+    records = []
+    monkeypatch.setattr(cf, "log", lambda level, message, **fields: records.append((message, fields)))
+    monkeypatch.setattr(cf, "LOG_RESPONSE_SAMPLE_RATE", 0)
+
+    @cf.cloudfunction(in_schema={"type": "object"}, out_schema={"type": "object"})
+    def echo(request_json, conn):
+        return request_json
+
+    echo(mock_request({"image": "a" * 10000}))
+    assert [message for message, _ in records] == ["request", "timings"]
+    assert records[0][1]["request_json"] == {"image": "a" * 10000}
+
+
+@pytest.mark.parametrize("if_none_match, status, loads", [('"abc-original"', 304, 0), ('"other"', 200, 1), ("", 200, 1)])
+def test_raw_response_loads_only_when_sent(if_none_match, status, loads):
+    loaded = []
+
+    @cf.cloudfunction(query_args=True, in_schema={"type": "object"})
+    def image(request_json, conn):
+        return cf.RawResponse(load=lambda: loaded.append(1) or (b"bytes", "image/png"), etag='"abc-original"',
+                              max_age=60)
+
+    request = mock_request({})
+    request.headers = {"If-None-Match": if_none_match}
+    body, response_status, headers = image(request)
+    assert response_status == status
+    assert len(loaded) == loads
+    assert headers["ETag"] == '"abc-original"'
+    if status == 200:
+        assert body == b"bytes" and headers["Content-Type"] == "image/png"
+
+
+def test_raw_response_not_found():
+    @cf.cloudfunction(query_args=True, in_schema={"type": "object"})
+    def image(request_json, conn):
+        return cf.RawResponse(load=lambda: None, etag='"abc-original"', max_age=60)
+
+    body, status, headers = image(mock_request({}))
+    assert status == 404
+    assert "Cache-Control" not in headers
+
+
+def test_after_commit(mock_pool):
+    committed = []
+    conn = mock_pool.getconn.return_value
+    conn.commit.side_effect = lambda: committed.append("commit")
+
+    @cf.cloudfunction(in_schema={"type": "integer"}, after_commit=lambda: committed.append("after_commit"))
+    def check(request_json, conn):
+        assert request_json > 0
+
+    check(mock_request(1))
+    assert committed == ["commit", "after_commit"]
+    assert check(mock_request(-1))[1] == 500
+    assert committed == ["commit", "after_commit"]
@@ -0,0 +1,42 @@
+import random
+
+import networkx
+import pytest
+
+from intransitivity_stats import victory_graph_cycles
+from util.cycles import has_directed_cycle, has_undirected_cycle
+from util.vote_columns import VoteColumns
+
+
+def has_cycle(g):
+    try:
+        networkx.find_cycle(g)
+        return True
+    except networkx.NetworkXNoCycle:
+        return False
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_matches_networkx(seed):
+    rng = random.Random(seed)
+    n = rng.randrange(1, 8)
+    # At most one edge between each pair of nodes, like a victory graph
+    pairs = [(u, v) for u in range(n) for v in range(u + 1, n) if rng.random() < 0.4]
+    edges = [(u, v) if rng.random() < 0.5 else (v, u) for u, v in pairs]
+    g = networkx.DiGraph(edges)
+    g.add_nodes_from(range(n))
+
+    sources = [u for u, _ in edges]
+    targets = [v for _, v in edges]
+    assert has_directed_cycle(n, sources, targets) == has_cycle(g)
+    assert has_undirected_cycle(n, sources, targets) == has_cycle(networkx.to_undirected(g))
+
+
+def test_victory_graph_cycles():
+    # 1 beats 2, 2 beats 3, 3 beats 1, and 1 ties 4
+    rock_paper_scissors = VoteColumns.from_rows([(1, 2, 0, 0, 0.0), (2, 3, 0, 0, 1.0), (1, 3, 1, 0, 2.0),
+                                                 (1, 4, 2, 0, 3.0)])
+    assert victory_graph_cycles(rock_paper_scissors) == (True, True)
+
+    transitive = VoteColumns.from_rows([(1, 2, 0, 0, 0.0), (2, 3, 0, 0, 1.0), (1, 3, 0, 0, 2.0)])
+    assert victory_graph_cycles(transitive) == (False, True)
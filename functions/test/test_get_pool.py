@@ -0,0 +1,110 @@
+from unittest.mock import MagicMock, Mock
+
+import pytest
+from psycopg2 import OperationalError
+from psycopg2.pool import PoolError
+
+from util import get_pool
+
+
+class FakeThreadedPool:
+    """Hands out mock connections, failing to connect `failures` times first. Like psycopg2's pools, it keeps at most
+    `minconn` idle connections, closing any others returned."""
+
+    def __init__(self, minconn, maxconn, failures=0, **kwargs):
+        self.minconn = minconn
+        self.failures = failures
+        self.idle = []
+        self.closed = []
+
+    def getconn(self):
+        if self.idle:
+            return self.idle.pop()
+        if self.failures:
+            self.failures -= 1
+            raise OperationalError("could not connect")
+        return MagicMock(closed=0)
+
+    def putconn(self, conn, close=False):
+        if close or len(self.idle) >= self.minconn:
+            conn.closed = 1
+            self.closed.append(conn)
+        else:
+            self.idle.append(conn)
+
+
+@pytest.fixture()
+def pool(monkeypatch):
+    monkeypatch.setattr(get_pool, "ThreadedConnectionPool", FakeThreadedPool)
+    monkeypatch.setattr(get_pool, "CONNECT_RETRY_DELAY", 0)
+    return get_pool.ConnectionPool(1, 2)
+
+
+def test_waits_for_a_free_connection(pool):
+    conn1 = pool.getconn()
+    pool.getconn()
+    with pytest.raises(PoolError):
+        pool.getconn(timeout=0.01)
+
+    pool.putconn(conn1)
+    pool.getconn(timeout=0.01)
+    assert pool.stats()["in_use"] == 2
+
+
+def test_broken_connections_are_replaced(pool):
+    conn = pool.getconn()
+    conn.closed = 1
+    pool.putconn(conn)
+
+    assert pool.getconn() is not conn
+    assert pool._pool.closed == [conn]
+    assert pool.stats()["discarded"] == 1
+
+
+def test_returned_connections_are_kept_open(pool):
+    conns = [pool.getconn(), pool.getconn()]
+    for conn in conns:
+        pool.putconn(conn)
+
+    # Both are kept, though the pool was started with one, and the two are remembered until they are handed out again
+    assert pool._pool.closed == []
+    assert sorted(pool._returned_at) == sorted(id(conn) for conn in conns)
+    assert {id(pool.getconn()), id(pool.getconn())} == {id(conn) for conn in conns}
+    assert pool._returned_at == {}
+
+
+def test_closed_connections_are_forgotten(pool):
+    conn = pool.getconn()
+    pool._pool.minconn = 0
+    pool.putconn(conn)
+
+    assert pool._pool.closed == [conn]
+    assert pool._returned_at == {}
+
+
+def test_dead_idle_connections_are_replaced(pool, monkeypatch):
+    monkeypatch.setattr(get_pool, "POOL_CHECK_AFTER_IDLE", 0)
+    dead = MagicMock(closed=0)
+    dead.cursor.return_value.__enter__.side_effect = OperationalError("server closed the connection")
+    pool._pool.getconn = Mock(side_effect=[dead, MagicMock(closed=0)])
+
+    assert pool.getconn() is not dead
+    assert pool._pool.closed == [dead]
+
+
+def test_retries_failed_connects(monkeypatch):
+    monkeypatch.setattr(get_pool, "ThreadedConnectionPool",
+                        lambda minconn, maxconn, **kwargs: FakeThreadedPool(minconn, maxconn, failures=2))
+    monkeypatch.setattr(get_pool, "CONNECT_RETRY_DELAY", 0)
+    pool = get_pool.ConnectionPool(1, 1)
+
+    pool.putconn(pool.getconn())
+    assert pool.stats()["checkouts"] == 1
+
+    # The database restarts, closing the idle connection, and takes a while to accept new ones
+    pool._pool.idle[0].closed = 1
+    pool._pool.failures = 3
+    with pytest.raises(OperationalError):
+        pool.getconn()
+    # The failed checkout doesn't hold on to the only slot
+    pool.getconn(timeout=0.01)
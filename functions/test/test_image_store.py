@@ -0,0 +1,65 @@
+import base64
+import hashlib
+import io
+from unittest.mock import MagicMock
+
+import pytest
+
+from util import image_store
+from util.image_store import LocalImageStore, VARIANTS, decode_image, migrate_images, put_image
+
+
+def test_decode_data_url():
+    data, content_type = decode_image("data:image/png;base64," + str(base64.b64encode(b"png bytes"), "utf8"))
+    assert data == b"png bytes"
+    assert content_type == "image/png"
+
+
+def test_non_base64_images_are_kept_as_is():
+    assert decode_image("base64")[0] == b"base64"
+
+
+def test_images_are_content_addressed(tmp_path):
+    store = LocalImageStore(str(tmp_path))
+    image = str(base64.b64encode(b"This is a test image"), "utf8")
+
+    image_hash = put_image(store, image)
+    assert image_hash == hashlib.sha256(b"This is a test image").hexdigest()
+    assert put_image(store, image) == image_hash
+
+    # Not a real image, so every variant is the original
+    for variant in VARIANTS:
+        assert store.get(image_hash, variant)[0] == b"This is a test image"
+    assert store.get("0" * 64, "original") is None
+
+
+def test_variants_are_resized(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    out = io.BytesIO()
+    Image.new("RGB", (1000, 500)).save(out, format="PNG")
+
+    store = LocalImageStore(str(tmp_path))
+    image_hash = put_image(store, str(base64.b64encode(out.getvalue()), "utf8"))
+
+    assert store.get(image_hash, "original") == (out.getvalue(), "image/png")
+    thumbnail, content_type = store.get(image_hash, "thumbnail")
+    assert content_type == "image/jpeg"
+    assert Image.open(io.BytesIO(thumbnail)).size == (160, 80)
+
+
+def test_migrate_images_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, "IMAGE_STORE_PATH", str(tmp_path))
+    images = {dog_id: memoryview(base64.b64encode(f"dog {dog_id}".encode())) for dog_id in range(5)}
+    cursor = MagicMock()
+    batches = iter([[(dog_id, images[dog_id]) for dog_id in range(3)], [(3, images[3]), (4, images[4])], []])
+    cursor.fetchall.side_effect = lambda: next(batches)
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cursor
+
+    assert migrate_images(conn, batch_size=3) == 5
+    assert conn.commit.call_count == 2
+    updates = [call.args[1] for call in cursor.execute.call_args_list if call.args[0].startswith("UPDATE")]
+    assert [dog_id for _, dog_id in updates] == list(range(5))
+    image_hash = hashlib.sha256(b"dog 0").hexdigest()
+    assert updates[0][0] == image_hash
+    assert LocalImageStore(str(tmp_path)).get(image_hash, "original")[0] == b"dog 0"
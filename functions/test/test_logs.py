@@ -0,0 +1,69 @@
+import json
+import logging
+import queue
+import sys
+
+from util import logs
+
+
+def test_summarize():
+    image = "data:image/png;base64," + "A" * 100000
+    summary = logs.summarize({"image": image, "user": "a", "votes": list(range(5)), "name": "x" * 10}, max_length=3)
+
+    assert summary["image"]["length"] == len(image)
+    assert len(summary["image"]["sha256"]) == 64
+    assert summary["user"] == "a"
+    assert summary["votes"] == [0, 1, 2, "... 2 more"]
+    assert set(summary["name"]) == {"length", "sha256"}
+    assert len(json.dumps(summary)) < 1000
+
+
+def test_formatter_keeps_tracebacks():
+    handler = logs.BoundedQueueHandler(queue.Queue(), logging.NullHandler())
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        record = logging.LogRecord("test", logging.ERROR, __file__, 0, "error", None, sys.exc_info())
+    record.fields = logs.summarize({"request_json": {"image": "A" * 1000}})
+
+    entry = json.loads(logs.JsonFormatter().format(handler.prepare(record)))
+    assert entry["severity"] == "ERROR"
+    assert "ValueError: broken" in entry["traceback"]
+    assert entry["request_json"]["image"]["length"] == 1000
+
+
+def test_full_queue_drops_only_below_error():
+    written = []
+    error_handler = logging.Handler()
+    error_handler.emit = written.append
+    handler = logs.BoundedQueueHandler(queue.Queue(1), error_handler)
+    info = logging.LogRecord("test", logging.INFO, __file__, 0, "info", None, None)
+    handler.handle(info)
+    handler.handle(info)
+    assert handler.dropped == 1
+
+    # Errors are written on the calling thread, not queued, so a full queue doesn't hold them up
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        error = logging.LogRecord("test", logging.ERROR, __file__, 0, "error", None, sys.exc_info())
+    handler.handle(error)
+    assert written == [error] and "ValueError: broken" in error.exc_text
+    assert handler.queue.qsize() == 1 and handler.dropped == 1
+
+
+def test_fields_are_summarized_when_logged():
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logs.logger.addHandler(handler)
+    try:
+        request_json = {"user": "a"}
+        logs.log(logging.INFO, "request", request_json=request_json)
+        # The handler changes its request after it has been logged
+        request_json["uuid"] = "b"
+        del request_json["user"]
+    finally:
+        logs.logger.removeHandler(handler)
+
+    assert records[0].fields == {"request_json": {"user": "a"}}
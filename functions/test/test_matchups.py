@@ -0,0 +1,100 @@
+import random
+
+import networkx
+import numpy
+import pytest
+
+from util.matchups import Matchups, ranked
+from util.ranked_pairs import ranked_pairs_ordering
+from util.vote_columns import RESULTS, VoteColumns
+
+
+def random_votes(seed, dogs=8, votes=60):
+    rng = random.Random(seed)
+    rows = [(rng.randrange(dogs), rng.randrange(dogs), rng.randrange(len(RESULTS)), 0, 0.0) for _ in range(votes)]
+    return VoteColumns.from_rows(rows)
+
+
+def reference_matchup_graph(votes):
+    """The dictionary and graph based implementation these matrices replaced"""
+    results = [r for r in votes.results() if r[0] != r[1]]
+    dogs = sorted({r[0] for r in results} | {r[1] for r in results})
+    matchups = {dog: {other: {"wins": 0, "losses": 0, "ties": 0} for other in dogs if other != dog} for dog in dogs}
+    for dog1, dog2, result in results:
+        if result == "win":
+            matchups[dog1][dog2]["wins"] += 1
+            matchups[dog2][dog1]["losses"] += 1
+        if result == "loss":
+            matchups[dog1][dog2]["losses"] += 1
+            matchups[dog2][dog1]["wins"] += 1
+        if result == "tie":
+            matchups[dog1][dog2]["ties"] += 1
+            matchups[dog2][dog1]["ties"] += 1
+
+    g = networkx.DiGraph()
+    g.add_nodes_from(dogs)
+    for dog1 in matchups:
+        for dog2, counts in matchups[dog1].items():
+            total = sum(counts.values())
+            if total:
+                g.add_edge(dog1, dog2, margin=counts["wins"] / total, **counts)
+    return g, matchups
+
+
+def edges(g):
+    return sorted(g.edges(data=True))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_graph_implementation(seed):
+    votes = random_votes(seed)
+    g, counts = reference_matchup_graph(votes)
+    matchups = Matchups.from_votes(votes)
+
+    assert matchups.dogs.tolist() == list(g.nodes)
+    assert edges(matchups.matchup_graph()) == edges(g)
+
+    victories = g.copy()
+    victories.remove_edges_from([(u, v) for u, v in g.edges if g[u][v]["margin"] <= g[v][u]["margin"]])
+    assert edges(matchups.victory_graph()) == edges(victories)
+
+    copeland = sorted([(n, victories.out_degree(n) - victories.in_degree(n)) for n in victories.nodes],
+                      key=lambda x: x[1], reverse=True)
+    assert ranked(matchups.dogs, matchups.copeland_scores(), reverse=True) == copeland
+
+    minimax = sorted(g.nodes, key=lambda n: max(g[u][n]["margin"] for u, _ in g.in_edges(n)))
+    assert [dog for dog, _ in ranked(matchups.dogs, matchups.worst_defeats())] == minimax
+
+    for dog, ratio in zip(matchups.dogs.tolist(), matchups.win_ratios(ties_count_as_wins=True).tolist()):
+        wins = sum(c["wins"] + c["ties"] for c in counts[dog].values())
+        losses = sum(c["losses"] for c in counts[dog].values())
+        assert ratio == pytest.approx(wins / ((wins + losses) or float("inf")))
+
+
+def test_self_votes_are_ignored():
+    votes = VoteColumns.from_rows([(1, 1, 0, 0, 0.0), (1, 2, 0, 0, 0.0)])
+    matchups = Matchups.from_votes(votes)
+    assert matchups.dogs.tolist() == [1, 2]
+    assert numpy.array_equal(matchups.wins, [[0, 1], [0, 0]])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_condorcet_winner_and_loser(seed):
+    votes = random_votes(seed, dogs=4, votes=40)
+    matchups = Matchups.from_votes(votes)
+    victories = matchups.victory_graph()
+    others = len(victories) - 1
+
+    winners = [n for n in victories.nodes if victories.out_degree(n) == others]
+    losers = [n for n in victories.nodes if victories.in_degree(n) == others]
+    assert matchups.condorcet_winner() == (winners[0] if winners else None)
+    assert matchups.condorcet_loser() == (losers[0] if losers else None)
+    if winners:
+        assert ranked_pairs_ordering(matchups.dogs.tolist(), matchups.victory_margins())[0] == winners[0]
+
+
+def test_minimax_without_matchups():
+    # Dog 3 has no matchups, so nothing has a margin against it
+    matchups = Matchups(numpy.array([1, 2, 3]), numpy.array([[0, 2, 0], [1, 0, 0], [0, 0, 0]]), numpy.zeros((3, 3)))
+    assert matchups.worst_defeats().tolist() == [pytest.approx(1 / 3), pytest.approx(2 / 3), 0]
+    assert matchups.condorcet_winner() is None
@@ -0,0 +1,50 @@
+import random
+
+from hypothesis import given
+from hypothesis import strategies as st
+
+from util.pair_sampler import pair_key, sample_unseen_pair, seen_pair_index
+
+
+@st.composite
+def ids_and_seen(draw):
+    ids = draw(st.lists(st.integers(min_value=1, max_value=10000), min_size=2, max_size=8, unique=True))
+    all_pairs = [(a, b) for i, a in enumerate(ids) for b in ids[i + 1:]]
+    seen = draw(st.lists(st.sampled_from(all_pairs), max_size=len(all_pairs)))
+    return ids, seen
+
+
+@given(ids_and_seen(), st.integers())
+def test_sampled_pair_is_unseen(ids_and_seen, seed):
+    ids, seen_pairs = ids_and_seen
+    seen = seen_pair_index(seen_pairs)
+
+    pair = sample_unseen_pair(ids, seen, random.Random(seed))
+    if len(seen) == len(ids) * (len(ids) - 1) // 2:
+        assert pair is None
+    else:
+        assert pair["dog1"] != pair["dog2"]
+        assert pair["dog1"] in ids and pair["dog2"] in ids
+        assert pair_key(pair["dog1"], pair["dog2"]) not in seen
+
+
+def test_seen_pairs_are_unordered():
+    seen = seen_pair_index([(2, 1)])
+    assert pair_key(1, 2) in seen
+    assert sample_unseen_pair([1, 2], seen) is None
+
+
+def test_sampled_pairs_are_uniform():
+    ids = [1, 2, 3, 4]
+    seen = seen_pair_index([(1, 2), (4, 3)])
+    rng = random.Random(0)
+
+    counts = {}
+    for _ in range(8000):
+        pair = sample_unseen_pair(ids, seen, rng)
+        key = (pair["dog1"], pair["dog2"])
+        counts[key] = counts.get(key, 0) + 1
+
+    # 4 unseen unordered pairs, each in both orientations
+    assert len(counts) == 8
+    assert all(800 < count < 1200 for count in counts.values())
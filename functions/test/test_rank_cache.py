@@ -0,0 +1,65 @@
+import os
+
+import xranking
+from util import rank_cache
+from util.rank_cache import RankCache, cache_key
+
+
+def test_key_normalizes_filters():
+    marker = [10, 5]
+    assert cache_key("elo", {"gender": None, "ignore_dogs": ["2", "1"]}, marker) == \
+        cache_key("elo", {"ignore_dogs": ["1", "2", "1"], "first_n": None}, marker)
+    assert cache_key("elo", {}, marker) != cache_key("elo", {}, [11, 6])
+    assert cache_key("elo", {}, marker) != cache_key("copeland", {}, marker)
+    assert cache_key("elo", {}, marker, ("2019-04-03", "2019-04-22")) != \
+        cache_key("elo", {}, marker, ("2019-04-03", "2019-04-23"))
+
+
+def test_key_includes_version(monkeypatch):
+    key = cache_key("elo", {}, [10, 5])
+    monkeypatch.setattr(rank_cache, "RANK_CACHE_VERSION", rank_cache.RANK_CACHE_VERSION + 1)
+    assert cache_key("elo", {}, [10, 5]) != key
+
+
+def test_no_marker_is_not_cached(tmp_path):
+    assert cache_key("elo", {}, [None, None]) is None
+    cache = RankCache(str(tmp_path))
+    cache.put(None, [1])
+    assert cache.get(None) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_memory_and_disk(tmp_path):
+    cache = RankCache(str(tmp_path), max_entries=1)
+    cache.put("a", [(1, 2.0)])
+    cache.put("b", [3])
+    assert list(cache._memory) == ["b"]
+
+    # Evicted from memory, but still on disk, including for a new process
+    assert cache.get("a") == [(1, 2.0)]
+    assert RankCache(str(tmp_path)).get("b") == [3]
+    assert cache.get("c") is None
+
+
+def test_disk_evicts_least_recently_used(tmp_path):
+    cache = RankCache(str(tmp_path))
+    for key in ["c", "a", "b"]:
+        cache.put(key, list(range(20)))
+    # Last used in the order a, b, c
+    for i, key in enumerate(["a", "b", "c"]):
+        os.utime(tmp_path / f"{key}.pickle", (i, i))
+
+    cache.max_bytes = 2 * os.path.getsize(tmp_path / "a.pickle")
+    cache.put("d", list(range(20)))
+    assert sorted(os.listdir(tmp_path)) == ["c.pickle", "d.pickle"]
+
+
+def test_rank_function_reuses_cached_rankings(monkeypatch, tmp_path):
+    loads = []
+    monkeypatch.setattr(xranking, "get_votes", lambda conn, filters: loads.append(filters))
+    monkeypatch.setattr(xranking, "rank_votes", lambda method, votes: [1, 2, 3])
+    monkeypatch.setattr(xranking, "vote_marker", lambda conn: [10, 5])
+
+    rank = xranking.rank_function("copeland", {"gender": None}, RankCache(str(tmp_path)))
+    assert rank(None) == rank(None) == [1, 2, 3]
+    assert len(loads) == 1
@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+import xranking
+from util.rank_stats import kendall_tau, rank_correlations, ranking_order, spearman_rho
+from util.vote_columns import RESULTS, VoteColumns
+
+
+def test_correlations():
+    assert spearman_rho([1, 2, 3, 4], [1, 2, 3, 4]) == 1
+    assert kendall_tau([1, 2, 3, 4], [4, 3, 2, 1]) == -1
+    # One swapped pair out of six
+    assert kendall_tau([1, 2, 3, 4], [2, 1, 3, 4]) == pytest.approx(4 / 6)
+    assert spearman_rho([1, 2, 3, 4], [2, 1, 3, 4]) == pytest.approx(0.8)
+    # Only dogs in both rankings count
+    assert kendall_tau([1, 5, 2, 3], [1, 2, 6, 3]) == 1
+
+
+def test_rank_all_matches_separate_runs():
+    rng = random.Random(0)
+    votes = VoteColumns.from_rows([(rng.randrange(10), rng.randrange(10), rng.randrange(len(RESULTS)), 0, 0.0)
+                                   for _ in range(200)])
+    methods = [method for method in xranking.RANKING_METHODS if method != "elo"]
+
+    rankings = xranking.rank_all(methods, votes, workers=2)
+    assert rankings == {method: xranking.rank_votes(method, votes) for method in methods}
+
+    correlations = rank_correlations(rankings)
+    assert len(correlations) == len(methods) * (len(methods) - 1) // 2
+    assert ranking_order(rankings["copeland"]) == [dog for dog, _ in rankings["copeland"]]
+
+
+def test_format_selection_as_columns():
+    assert xranking.format_rank({"winner": 3, "loser": None}, "columns") == "winner,3\nloser,"
+    assert xranking.format_rank([[1, 2], [3]], "columns") == "1,2\n3"
@@ -1,5 +1,7 @@
 import random
 
+import networkx
+import numpy
 import pytest
 from hypothesis import strategies as st
 from hypothesis import given
@@ -76,3 +78,44 @@ def test_correct_ranked_pairs():
     assert ranked_pairs_ordering(ids, matrix) == true_ranks
     assert ranked_pairs_ordering(ids, list(zip(*matrix))) == list(reversed(true_ranks))
 
+
+def networkx_ranked_pairs_ordering(dog_ids, matchups):
+    """The straightforward implementation: lock each edge, and take it back out if the graph now has a cycle."""
+    g = networkx.DiGraph()
+    g.add_nodes_from(range(len(matchups)))
+
+    edges = [(i, j, matchups[i][j]) for i in range(len(matchups)) for j in range(len(matchups))
+             if matchups[i][j] is not None]
+    edges.sort(key=lambda x: x[2], reverse=True)
+    for i, j, _ in edges:
+        g.add_edge(i, j)
+        if not networkx.is_directed_acyclic_graph(g):
+            g.remove_edge(i, j)
+
+    return [dog_ids[x] for x in networkx.topological_sort(g)]
+
+
+@given(ids_and_matrix())
+def test_same_ordering_as_networkx(ids_and_matrix):
+    ids, matrix = ids_and_matrix
+
+    assert ranked_pairs_ordering(ids, matrix) == networkx_ranked_pairs_ordering(ids, matrix)
+
+
+@given(st.integers(min_value=1, max_value=12), st.data())
+def test_same_ordering_with_ties_and_missing_matchups(n, data):
+    matrix = data.draw(st.lists(st.lists(st.sampled_from([None, -1, -0.5, 0, 0.5, 1]), min_size=n, max_size=n),
+                                min_size=n, max_size=n))
+    ids = list(range(n))
+
+    assert ranked_pairs_ordering(ids, matrix) == networkx_ranked_pairs_ordering(ids, matrix)
+
+
+def test_numpy_matrix():
+    ids = [10, 20, 30]
+    matrix = numpy.array([[numpy.nan, 0.5, 0.2],
+                          [-0.5, numpy.nan, 0.9],
+                          [-0.2, -0.9, numpy.nan]])
+
+    assert ranked_pairs_ordering(ids, matrix) == [10, 20, 30]
+    assert ranked_pairs_ordering(ids, matrix.tolist()) == [10, 20, 30]
@@ -0,0 +1,87 @@
+import calendar
+from datetime import date
+from unittest.mock import MagicMock
+
+import numpy
+import pytest
+
+from util.snapshot import Snapshot, export_snapshot, write_snapshot
+from util.vote_columns import LOSS, TIE, WIN, VoteColumns
+
+DAY = 24 * 60 * 60
+START = calendar.timegm(date(2019, 4, 3).timetuple())
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    votes = VoteColumns.from_rows([
+        # dog1, dog2, result, voter, time
+        (1, 2, WIN, 1, START + DAY),
+        (2, 3, LOSS, 1, START + 2 * DAY),
+        (3, 1, TIE, 2, START + DAY),
+        (1, 3, WIN, 1, START + 3 * DAY),
+        (4, 2, LOSS, 3, START + DAY),
+        (4, 1, WIN, 3, START - DAY),
+    ])
+    path = tmp_path / "votes.snapshot"
+    write_snapshot(path, {
+        "votes": {name: getattr(votes, name) for name in ["dog1", "dog2", "result", "voter_id", "submission_time"]},
+        "voters": {
+            "id": numpy.array([1, 2, 3], numpy.int32),
+            "creation_time": numpy.array([START, START, START - DAY], numpy.float64),
+            "gender_identity": numpy.array([0, -1, 1], numpy.int32),
+            "age": numpy.array([20, numpy.nan, 40], numpy.float32),
+            "education": numpy.array([-1, -1, -1], numpy.int32),
+            "location": numpy.array([-1, -1, -1], numpy.int32),
+        },
+        "dogs": {"id": numpy.empty(0, numpy.int32)},
+    }, categories={"voters": {"gender_identity": ["Female", "Male"]}}, metadata={"vote_count": 6})
+    return Snapshot(path)
+
+
+FILTERS = {"education": None, "location": None, "gender": None, "age_min": None, "age_max": None, "voter": None,
+           "first_n": None, "ignore_dogs": None}
+
+
+def results(snapshot, **filters):
+    return sorted(snapshot.votes({**FILTERS, **filters}, date(2019, 4, 3), date(2019, 4, 22)).results())
+
+
+def test_columns_are_memory_mapped(snapshot):
+    assert isinstance(snapshot.tables["votes"]["dog1"], numpy.memmap)
+    assert len(snapshot.tables["dogs"]["id"]) == 0
+    assert snapshot.metadata == {"vote_count": 6}
+
+
+def test_filters(snapshot):
+    assert results(snapshot) == [(1, 2, "win"), (1, 3, "win"), (2, 3, "loss"), (3, 1, "tie"), (4, 2, "loss")]
+    assert results(snapshot, gender="Male") == [(4, 2, "loss")]
+    assert results(snapshot, gender="Other") == []
+    # Voter 2's age is NULL, which no age filter matches
+    assert results(snapshot, age_max=30) == [(1, 2, "win"), (1, 3, "win"), (2, 3, "loss")]
+    assert results(snapshot, first_n=1) == [(1, 2, "win"), (3, 1, "tie"), (4, 2, "loss")]
+    assert results(snapshot, first_n=1, ignore_dogs=["1"]) == [(4, 2, "loss")]
+
+
+def test_voter_ids(snapshot):
+    assert snapshot.voter_ids(FILTERS, date(2019, 4, 3), date(2019, 4, 22)) == [1, 2]
+    assert snapshot.voter_ids({**FILTERS, "age_min": 30}, date(2019, 4, 2), date(2019, 4, 22)) == [3]
+
+
+def test_export_reads_the_marker_with_the_votes(tmp_path):
+    cursor = MagicMock()
+    cursor.fetchone.return_value = (7, 6)
+    cursor.fetchmany.return_value = []
+    cursor.fetchall.return_value = []
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cursor
+
+    export_snapshot(conn, tmp_path / "votes.snapshot")
+
+    # The marker and the votes come from the same REPEATABLE READ transaction, which is ended afterwards
+    queries = [call.args[0] for call in cursor.execute.call_args_list]
+    assert queries[0] == "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY"
+    assert queries[1] == "SELECT MAX(id), COUNT(*) FROM votes"
+    assert "FROM votes LEFT JOIN voters" in queries[2]
+    conn.rollback.assert_called_once()
+    assert Snapshot(tmp_path / "votes.snapshot").metadata["max_vote_id"] == 7
@@ -0,0 +1,9 @@
+from unittest.mock import MagicMock
+
+from util.tallies import record_vote
+
+
+def test_rows_are_locked_in_key_order():
+    cursor = MagicMock()
+    record_vote(cursor, 7, 3, "win")
+    assert [call.args[1] for call in cursor.execute.call_args_list] == [(3, 7, 0, 1, 0), (7, 3, 1, 0, 0)]
@@ -0,0 +1,93 @@
+from unittest.mock import MagicMock
+
+import numpy
+
+import xranking
+from util.vote_columns import LOSS, TIE, WIN, VoteColumns, load_votes
+
+ROWS = [
+    # dog1, dog2, result, voter, time
+    (1, 2, WIN, 10, 3.0),
+    (2, 3, LOSS, 10, 1.0),
+    (3, 1, TIE, 11, 2.0),
+    (1, 3, WIN, 10, 2.0),
+    (4, 2, LOSS, 11, 1.0),
+]
+
+
+def mock_connection(rows):
+    cursor = MagicMock()
+    chunks = iter([rows[i:i + 2] for i in range(0, len(rows), 2)] + [[]])
+    cursor.fetchmany.side_effect = lambda size: next(chunks)
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cursor
+    return conn, cursor
+
+
+def test_load_votes_in_chunks():
+    conn, cursor = mock_connection(ROWS)
+    votes = load_votes(conn, chunk_size=2)
+
+    assert conn.cursor.call_args.kwargs["name"]
+    assert cursor.fetchmany.call_count == 4
+    assert votes.dog1.dtype == numpy.int32 and votes.result.dtype == numpy.int8
+    assert votes.results() == [(1, 2, "win"), (2, 3, "loss"), (3, 1, "tie"), (1, 3, "win"), (4, 2, "loss")]
+    assert votes.dogs().tolist() == [1, 2, 3, 4]
+
+
+def test_load_no_votes():
+    conn, _ = mock_connection([])
+    votes = load_votes(conn)
+    assert len(votes) == 0
+    assert not votes
+
+
+def test_filters():
+    votes = VoteColumns.from_rows(ROWS)
+    # Voter 10's first two votes are at times 1 and 2, voter 11's at 1 and 2
+    assert sorted(votes.filtered(first_n=2).results()) == [(1, 3, "win"), (2, 3, "loss"), (3, 1, "tie"), (4, 2, "loss")]
+    # Dogs are ignored after each voter's first votes are picked
+    assert sorted(votes.filtered(first_n=1, ignore_dogs=["4"]).results()) == [(2, 3, "loss")]
+    assert len(votes.filtered()) == len(ROWS)
+
+
+def test_filters_keep_the_first_of_simultaneous_votes():
+    votes = VoteColumns.from_rows([(1, 2, WIN, 10, 1.0), (2, 3, LOSS, 10, 1.0), (3, 4, TIE, 10, 1.0)])
+    assert votes.filtered(first_n=2).results() == [(1, 2, "win"), (2, 3, "loss")]
+
+
+def test_filters_are_in_the_query():
+    conn, cursor = mock_connection([])
+    cursor.mogrify.side_effect = lambda query, args: (query % tuple(repr(arg) for arg in args)).encode()
+    load_votes(conn, "AND voters.age >= 18", first_n=20, ignore_dogs=[3, 4])
+
+    query = cursor.execute.call_args.args[0]
+    assert "ROW_NUMBER() OVER (PARTITION BY votes.voter_id ORDER BY votes.submission_time, votes.id)" in query
+    # The first n votes are picked from those matching the other filters, before ignored dogs are removed
+    assert query.index("voters.age >= 18") < query.index("AS filtered") < query.index("place <= 20")
+    assert "dog1_id <> ALL([3, 4]) AND dog2_id <> ALL([3, 4])" in query
+
+
+def test_no_filters_in_the_query():
+    conn, cursor = mock_connection([])
+    load_votes(conn)
+
+    query = cursor.execute.call_args.args[0]
+    assert "ROW_NUMBER" not in query and "ALL(" not in query
+
+
+def test_load_votes_in_id_order():
+    conn, cursor = mock_connection([])
+    load_votes(conn, in_id_order=True)
+    assert "ORDER BY id" in cursor.execute.call_args.args[0]
+
+
+def test_get_votes_passes_filters(monkeypatch):
+    calls = []
+    monkeypatch.setattr(xranking, "load_votes", lambda conn, where, **kwargs: calls.append(kwargs))
+    monkeypatch.setattr(xranking, "filter_statement", lambda conn, filters: "")
+
+    conn, cursor = mock_connection([])
+    cursor.mogrify.return_value = b""
+    xranking.get_votes(conn, {"first_n": 2, "ignore_dogs": ["3"]})
+    assert calls == [{"first_n": 2, "ignore_dogs": [3]}]
@@ -1,6 +1,13 @@
+from datetime import date, timedelta
+
 import pytest
 
 from main import _register_voter, _submit_vote, _get_votes
+from xranking import filter_statement
+from util.elo import rebuild_elo, record_elo
+from util.snapshot import Snapshot, export_snapshot
+from util.tallies import record_vote
+from util.vote_columns import COLUMNS, load_votes
 from test.fixtures import populated_database_conn
 
 def test_voting_changes_vote_counts(populated_database_conn):
@@ -102,3 +109,62 @@ def test_vote_duplicate(populated_database_conn):
         dog2 = result["dog2"]
 
     assert num_votes == len(seen_pairs)
+
+
+def test_recorded_tallies_match_rebuilt(populated_database_conn):
+    conn = populated_database_conn
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT dog_a, dog_b, wins, losses, ties FROM vote_tallies ORDER BY dog_a, dog_b")
+        rebuilt = cursor.fetchall()
+
+        # Replay every vote the way submit_vote records it, into empty tallies
+        cursor.execute("DELETE FROM vote_tallies")
+        cursor.execute("SELECT dog1_id, dog2_id, result FROM votes ORDER BY id")
+        for dog1, dog2, result in cursor.fetchall():
+            record_vote(cursor, dog1, dog2, result)
+
+        cursor.execute("SELECT dog_a, dog_b, wins, losses, ties FROM vote_tallies ORDER BY dog_a, dog_b")
+        assert cursor.fetchall() == rebuilt
+
+
+def test_recorded_elo_matches_rebuilt(populated_database_conn):
+    conn = populated_database_conn
+    rebuild_elo(conn, order="submission")
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT dog_id, rating FROM elo_ratings ORDER BY dog_id")
+        rebuilt = cursor.fetchall()
+
+        # Replay every vote in submission order the way submit_vote records it, into empty ratings
+        cursor.execute("DELETE FROM elo_ratings")
+        cursor.execute("SELECT dog1_id, dog2_id, result FROM votes ORDER BY submission_time, id")
+        for dog1, dog2, result in cursor.fetchall():
+            record_elo(cursor, dog1, dog2, result)
+
+        cursor.execute("SELECT dog_id, rating FROM elo_ratings ORDER BY dog_id")
+        recorded = cursor.fetchall()
+    assert [dog_id for dog_id, _ in recorded] == [dog_id for dog_id, _ in rebuilt]
+    assert [rating for _, rating in recorded] == pytest.approx([rating for _, rating in rebuilt])
+
+
+@pytest.mark.parametrize("first_n, ignore_dogs", [(None, None), (3, None), (None, [2, 5]), (3, [2, 5])])
+def test_snapshot_votes_match_database(populated_database_conn, tmp_path, first_n, ignore_dogs):
+    conn = populated_database_conn
+    path = tmp_path / "votes.snapshot"
+    # export_snapshot reads in a transaction of its own
+    conn.commit()
+    export_snapshot(conn, path)
+
+    filters = {"education": None, "location": None, "gender": None, "age_min": None, "age_max": None, "voter": None,
+               "first_n": first_n, "ignore_dogs": ignore_dogs}
+    since, until = date(2000, 1, 1), date.today() + timedelta(days=1)
+    with conn.cursor() as cursor:
+        window = bytes.decode(cursor.mogrify(
+            "AND votes.submission_time >= %s AND votes.submission_time <= %s", (since, until)))
+    from_database = load_votes(conn, window + filter_statement(conn, filters), first_n, ignore_dogs)
+    from_snapshot = Snapshot(path).votes(filters, since, until)
+
+    def rows(votes):
+        return sorted(zip(*(getattr(votes, name).tolist() for name, _ in COLUMNS)))
+
+    # The fixture casts every vote at the same time, so this also checks that both keep the same first votes
+    assert rows(from_snapshot) == rows(from_database)
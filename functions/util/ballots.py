@@ -0,0 +1,431 @@
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+
+import numpy
+
+# Every candidate on the primaries ballot. Tallies are arrays indexed by position in this list.
+CANDIDATES = ["Sanders", "Warren", "Biden", "Buttigieg", "Bloomberg", "Klobuchar", "Gabbard", "Steyer"]
+CANDIDATE_INDEX = {candidate: i for i, candidate in enumerate(CANDIDATES)}
+
+TIERS = ["tier1", "tier2", "tier3", "tier4", "tier5", "tier6", "tier7", "tier8"]
+
+# The rank of a candidate that isn't in any tier
+UNRANKED = len(TIERS)
+
+# Pairwise counts compare candidates in one of the first 6 tiers with those in lower tiers, down to the 7th
+PAIRWISE_WINNER_TIERS = 6
+PAIRWISE_LOSER_TIERS = 7
+
+# Only ballots submitted by primary day are counted
+BALLOTS_UNTIL = "2020-03-03"
+
+# How many instant runoff scenarios are kept, by candidates dropped and shares
+SCENARIO_RUNOFF_ENTRIES = int(getenv('SCENARIO_RUNOFF_ENTRIES', "1024"))
+
+# How often a cached set of ballots checks whether ballots were added or removed by another instance
+BALLOT_CACHE_CHECK_SECONDS = float(getenv('BALLOT_CACHE_CHECK_SECONDS', "60"))
+
+# A bitmask of candidates has bit i set for CANDIDATES[i]
+CANDIDATE_BITS = 1 << numpy.arange(len(CANDIDATES), dtype=numpy.int64)
+
+# Every bitmask of candidates, as a (masks x candidates) boolean array
+CANDIDATE_SETS = (numpy.arange(1 << len(CANDIDATES))[:, None] & CANDIDATE_BITS) > 0
+
+# A ballot's vote is split evenly between the candidates in a tier, so counting in 1/840ths (divisible by 1 to 8)
+# keeps every split a whole number, and runoff majorities and eliminations exact
+SPLIT_UNITS = 840
+
+
+class Ballots:
+    """Primaries ballots, each encoded as the tier (0 for tier1) of every candidate, or UNRANKED."""
+
+    def __init__(self, ids, ranks):
+        self.ids = ids
+        self.ranks = ranks
+
+    @classmethod
+    def from_rows(cls, rows):
+        """:param rows: (id, tier1, ..., tier8) tuples, each tier a list of candidate names or None. Names that aren't
+                        in CANDIDATES are ignored, and a candidate in several tiers is ranked in the highest."""
+        ranks = numpy.full((len(rows), len(CANDIDATES)), UNRANKED, dtype=numpy.int8)
+        for ballot, (_, *tiers) in enumerate(rows):
+            for tier in reversed(range(len(TIERS))):
+                for candidate in tiers[tier] or []:
+                    if candidate in CANDIDATE_INDEX:
+                        ranks[ballot, CANDIDATE_INDEX[candidate]] = tier
+        return cls(numpy.array([row[0] for row in rows], dtype=numpy.int64), ranks)
+
+    @classmethod
+    def concatenate(cls, ballots):
+        return cls(numpy.concatenate([b.ids for b in ballots]), numpy.concatenate([b.ranks for b in ballots]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def first_choices(self):
+        """:return: a (ballots x candidates) boolean array of which candidates are in each ballot's first tier"""
+        return self.ranks == 0
+
+    def first_choice_counts(self):
+        """:return: how many ballots have each candidate in their first tier"""
+        return self.first_choices().sum(axis=0)
+
+    def normalized_weights(self, shares):
+        """:param shares: each candidate's share, in CANDIDATES order
+        :return: each candidate's votes per first choice ballot, see normalized_weights"""
+        return normalized_weights(shares, self.first_choice_counts())
+
+    def ballot_weights(self, candidate_weights):
+        """:return: each ballot's weight, the sum of the weights of the candidates in its first tier"""
+        return self.first_choices() @ numpy.asarray(candidate_weights)
+
+    def preferences(self):
+        """:return: a (ballots x candidates x candidates) boolean array of whether each ballot ranks each candidate in a
+                    higher tier than each other, as counted by pairwise"""
+        ranks = self.ranks.astype(numpy.int16)
+        winner = ranks[:, :, None]
+        loser = ranks[:, None, :]
+        return (winner < loser) & (winner < PAIRWISE_WINNER_TIERS) & (loser < PAIRWISE_LOSER_TIERS)
+
+    def pairwise(self, ballot_weights=None):
+        """:return: a (candidates x candidates) matrix, of the (weighted) number of ballots ranking each candidate in a
+                    higher tier than each other"""
+        preferred = self.preferences()
+        if ballot_weights is None:
+            return preferred.sum(axis=0)
+        return numpy.tensordot(numpy.asarray(ballot_weights), preferred, axes=1)
+
+    def plurality(self, candidate_weights=None):
+        """:return: each candidate's (weighted) votes, where a ballot's vote is split evenly between the candidates in
+                    its first tier, and each candidate's share is multiplied by its weight"""
+        first = self.first_choices()
+        per_candidate = first.sum(axis=1)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            split = numpy.where(first, 1 / per_candidate[:, None], 0)
+        votes = split.sum(axis=0)
+        if candidate_weights is None:
+            return votes
+        return votes * numpy.asarray(candidate_weights)
+
+    def instant_runoff(self, shares=None):
+        """Eliminates the candidate with the fewest votes until one has a majority. A ballot votes for the candidates in
+        its highest tier that has any left, split evenly, and ballots with none left are exhausted. Ties for fewest
+        votes eliminate the first in CANDIDATES order.
+
+        :param shares: if given, each round weights ballots with the normalized_weights of the candidates they vote for
+        :return: the votes of the remaining candidates in every round, and the candidate eliminated after each round
+                 but the last
+        """
+        return Runoff(self.ranks).run(shares)
+
+
+class FirstChoiceGroups:
+    """Ballots' pairwise preferences summed separately for each set of first choices.
+
+    A normalized ballot's weight only depends on its first choices, so a normalized pairwise matrix is a weighted sum
+    of these, whatever the shares, without going through the ballots again.
+    """
+
+    def __init__(self, counts, pairwise):
+        """:param counts: how many ballots have each bitmask of candidates as their first choices
+        :param pairwise: for each bitmask, its ballots' pairwise matrix"""
+        self.counts = counts
+        self.pairwise_counts = pairwise
+
+    @classmethod
+    def from_ballots(cls, ballots):
+        keys = ballots.first_choices() @ CANDIDATE_BITS
+        counts = numpy.bincount(keys, minlength=len(CANDIDATE_SETS))
+        pairwise = numpy.zeros((len(CANDIDATE_SETS), len(CANDIDATES), len(CANDIDATES)), dtype=numpy.int64)
+        if len(ballots):
+            order = numpy.argsort(keys, kind="stable")
+            present, starts = numpy.unique(keys[order], return_index=True)
+            pairwise[present] = numpy.add.reduceat(ballots.preferences()[order], starts, axis=0, dtype=numpy.int64)
+        return cls(counts, pairwise)
+
+    def __add__(self, other):
+        return FirstChoiceGroups(self.counts + other.counts, self.pairwise_counts + other.pairwise_counts)
+
+    def first_choice_counts(self):
+        """:return: how many ballots have each candidate in their first tier"""
+        return self.counts @ CANDIDATE_SETS
+
+    def pairwise(self, shares=None):
+        """:param shares: if given, weights ballots as Ballots.normalized_weights does
+        :return: the same matrix as Ballots.pairwise, unweighted or weighted by the normalized weights"""
+        if shares is None:
+            return self.pairwise_counts.sum(axis=0)
+        weights = normalized_weights(shares, self.first_choice_counts())
+        return numpy.tensordot(CANDIDATE_SETS @ weights, self.pairwise_counts, axes=1)
+
+
+class Runoff:
+    """The state of an instant runoff: ballots bucketed by their current choice, the bitmask of the remaining
+    candidates in their highest tier with any. Eliminating a candidate only moves the ballots in buckets it's in."""
+
+    def __init__(self, ranks, counts=None, remaining=None):
+        """:param ranks: the ballots' ranks, as in Ballots
+        :param counts: if given, how many ballots each row of ranks stands for, or how many votes with weighted ballots
+        :param remaining: if given, which candidates are running, by default all of them"""
+        self.ranks = ranks
+        self.counts = numpy.ones(len(ranks), dtype=numpy.int64) if counts is None else counts
+        self.remaining = numpy.ones(len(CANDIDATES), dtype=bool) if remaining is None else remaining.copy()
+        self.buckets = {}
+        self._add(numpy.arange(len(ranks)))
+
+    def _add(self, ballots):
+        choices = current_choices(self.ranks[ballots], self.remaining)
+        order = numpy.argsort(choices, kind="stable")
+        keys, starts = numpy.unique(choices[order], return_index=True)
+        for key, bucket in zip(keys.tolist(), numpy.split(ballots[order], starts[1:])):
+            # Exhausted ballots have no choice left, and never move again
+            if key:
+                self.buckets[key] = numpy.concatenate([self.buckets[key], bucket]) if key in self.buckets else bucket
+
+    def eliminate(self, candidate):
+        """:param candidate: the index of the candidate in CANDIDATES"""
+        self.remaining[candidate] = False
+        moved = [self.buckets.pop(key) for key in list(self.buckets) if key & (1 << candidate)]
+        if moved:
+            self._add(numpy.concatenate(moved))
+
+    def choices(self):
+        """:return: a (choices x candidates) boolean array of the current choices, and how many ballots have each"""
+        keys = numpy.array(list(self.buckets), dtype=numpy.int64)
+        counts = numpy.array([self.counts[self.buckets[key]].sum() for key in keys.tolist()], dtype=numpy.int64)
+        return (keys[:, None] & CANDIDATE_BITS) > 0, counts
+
+    def tally(self, shares=None):
+        """:param shares: if given, weights each ballot by the normalized_weights of its current choice's candidates,
+                          counting first choices as the ballots with each candidate in their current choice
+        :return: each candidate's votes, in SPLIT_UNITS"""
+        choices, counts = self.choices()
+        votes = counts
+        if shares is not None:
+            votes = counts * (choices @ normalized_weights(shares, counts @ choices))
+        return (votes * SPLIT_UNITS // choices.sum(axis=1)) @ choices
+
+    def run(self, shares=None):
+        """Eliminates the candidate with the fewest votes until one has a majority. Ties for fewest votes eliminate the
+        first in CANDIDATES order.
+
+        :param shares: if given, each round weights ballots as tally does
+        :return: the votes of the remaining candidates in every round, and the candidate eliminated after each round
+                 but the last
+        """
+        rounds = []
+        eliminated = []
+        while True:
+            tally = self.tally(shares)
+            remaining = numpy.flatnonzero(self.remaining)
+            rounds.append({CANDIDATES[c]: tally[c] / SPLIT_UNITS for c in remaining.tolist()})
+            if not len(remaining) or (tally[remaining] * 2 >= tally.sum()).any():
+                return rounds, eliminated
+            loser = remaining[numpy.argmin(tally[remaining])].item()
+            eliminated.append(CANDIDATES[loser])
+            self.eliminate(loser)
+
+
+class Scenarios:
+    """Plurality and instant runoff results with any set of candidates dropped from the ballots, as if they hadn't run.
+
+    With shares, each ballot's weight is set once, by its first choices before any candidate is dropped, so a dropped
+    candidate's share goes to its voters' next choices. Plurality and every round of the instant runoff use that
+    weight, so the plurality votes are the runoff's first round. (get_normalized_instant_runoff instead normalizes
+    again every round, by the ballots' current choices.)
+
+    Ballots are counted once per distinct set of ranks. Each set of dropped candidates' plurality votes are worked out
+    the first time it's asked for, for any shares, and the most recent instant runoffs are kept.
+    """
+
+    def __init__(self, ballots, runoff_entries=SCENARIO_RUNOFF_ENTRIES):
+        self.ranks, self.counts = numpy.unique(ballots.ranks, axis=0, return_counts=True)
+        first = self.ranks == 0
+        self.first_choices = first @ CANDIDATE_BITS
+        self.first_choice_counts = self.counts @ first
+        self.runoff_entries = runoff_entries
+        self._plurality = {}
+        self._runoffs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def plurality(self, dropped=(), shares=None):
+        """:param dropped: the names of the candidates to drop
+        :param shares: if given, weights ballots by their first choices before any are dropped, see Scenarios
+        :return: each candidate's votes, a ballot's vote split evenly between the remaining candidates in its highest
+                 tier with any"""
+        mask = candidate_mask(dropped)
+        with self._lock:
+            if mask not in self._plurality:
+                self._plurality[mask] = self._plurality_by_first_choices(mask)
+            by_first_choices = self._plurality[mask]
+        if shares is None:
+            weights = numpy.ones(len(CANDIDATE_SETS), dtype=numpy.int64)
+        else:
+            weights = CANDIDATE_SETS @ normalized_weights(shares, self.first_choice_counts)
+        return weights @ by_first_choices / SPLIT_UNITS
+
+    def _plurality_by_first_choices(self, mask):
+        """:return: a (first choices x candidates) array of the votes, in SPLIT_UNITS, of the ballots with each bitmask
+                    of first choices"""
+        choices = current_choices(self.ranks, (CANDIDATE_BITS & mask) == 0)
+        n = len(CANDIDATE_SETS)
+        counts = numpy.bincount(self.first_choices * n + choices, weights=self.counts, minlength=n * n)
+        sizes = numpy.maximum(CANDIDATE_SETS.sum(axis=1), 1)[:, None]
+        split = numpy.where(CANDIDATE_SETS, SPLIT_UNITS // sizes, 0)
+        return counts.astype(numpy.int64).reshape(n, n) @ split
+
+    def instant_runoff(self, dropped=(), shares=None):
+        """:param dropped: the names of the candidates to drop before the first round
+        :param shares: if given, weights ballots by their first choices before any are dropped, see Scenarios
+        :return: the rounds and eliminated candidates, as Runoff.run"""
+        mask = candidate_mask(dropped)
+        key = (mask, None if shares is None else tuple(shares))
+        with self._lock:
+            if key in self._runoffs:
+                self._runoffs.move_to_end(key)
+                return self._runoffs[key]
+        counts = self.counts
+        if shares is not None:
+            counts = counts * ((self.ranks == 0) @ normalized_weights(shares, self.first_choice_counts))
+        result = Runoff(self.ranks, counts, (CANDIDATE_BITS & mask) == 0).run()
+        with self._lock:
+            self._runoffs[key] = result
+            while len(self._runoffs) > self.runoff_entries:
+                self._runoffs.popitem(last=False)
+        return result
+
+
+def current_choices(ranks, remaining):
+    """:param ranks: ballots' ranks, as in Ballots
+    :param remaining: which candidates are still running
+    :return: each ballot's current choice, the bitmask of the remaining candidates in its highest tier with any, or 0
+             if it has none left"""
+    ranks = numpy.where(remaining, ranks, UNRANKED)
+    top = ranks.min(axis=1, initial=UNRANKED)[:, None]
+    return ((ranks == top) & (top < UNRANKED)) @ CANDIDATE_BITS
+
+
+def candidate_mask(candidates):
+    """:return: the bitmask of the candidates with these names"""
+    return sum(1 << CANDIDATE_INDEX[candidate] for candidate in set(candidates))
+
+
+def normalized_weights(shares, counts):
+    """Weights candidates so that each one's first choice ballots together count for its share (times 1000) rather
+    than for how many of them there are.
+
+    :param shares: each candidate's share, in CANDIDATES order
+    :param counts: how many ballots have each candidate as their first choice
+    :return: each candidate's votes per first choice ballot, rounded to a whole number
+    """
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        weights = numpy.round(numpy.asarray(shares, dtype=float) / counts * 1000)
+    # A candidate with no first choice ballots has no ballots to weight
+    return numpy.where(counts > 0, weights, 0).astype(numpy.int64)
+
+
+def load_ballots(conn, after_id=None):
+    """:param after_id: if given, only load ballots with a higher id
+    :return: every primaries ballot submitted by BALLOTS_UNTIL, as Ballots"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"""SELECT id, {", ".join(TIERS)}
+        FROM primaries_ballot WHERE submission_time <= %s::date AND id > %s ORDER BY id""",
+                       (BALLOTS_UNTIL, -1 if after_id is None else after_id))
+        return Ballots.from_rows(cursor.fetchall())
+
+
+def ballot_marker(conn):
+    """:return: something that changes whenever ballots are added or removed: the highest ballot id and the number of
+                ballots"""
+    with conn.cursor() as cursor:
+        cursor.execute("""SELECT MAX(id), COUNT(*) FROM primaries_ballot WHERE submission_time <= %s::date""",
+                       (BALLOTS_UNTIL,))
+        return tuple(cursor.fetchone())
+
+
+class BallotCache:
+    """The ballots and their FirstChoiceGroups, loaded once per instance and then only read again when they change.
+
+    Changes are noticed by comparing ballot_marker at most every check_seconds, or on the next read after
+    mark_changed. Ballots with a higher id than any loaded are added on their own, to both; anything else, like a
+    deleted ballot, reloads them all. Scenarios are made again after any change.
+    """
+
+    def __init__(self, check_seconds=BALLOT_CACHE_CHECK_SECONDS, clock=time.monotonic):
+        self.check_seconds = check_seconds
+        self.clock = clock
+        self._ballots = None
+        self._groups = None
+        self._scenarios = None
+        self._marker = None
+        self._checked = None
+        self._changes = 0
+        self._lock = threading.Lock()
+
+    def mark_changed(self):
+        """Makes the next read check for changes, e.g. once a submitted ballot is committed"""
+        self._changes += 1
+        self._checked = None
+
+    def ballots(self, conn):
+        """:return: every ballot, as load_ballots"""
+        return self._current(conn)[0]
+
+    def groups(self, conn):
+        """:return: the FirstChoiceGroups of every ballot"""
+        return self._current(conn)[1]
+
+    def scenarios(self, conn):
+        """:return: the Scenarios of every ballot, made the first time they're asked for after the ballots change"""
+        with self._lock:
+            self._check(conn)
+            if self._scenarios is None:
+                self._scenarios = Scenarios(self._ballots)
+            return self._scenarios
+
+    def _current(self, conn):
+        with self._lock:
+            self._check(conn)
+            return self._ballots, self._groups
+
+    def _check(self, conn):
+        now = self.clock()
+        if self._checked is None or now - self._checked >= self.check_seconds:
+            changes = self._changes
+            self._refresh(conn)
+            # If a change was marked while refreshing, it may not have been seen yet, so check again next time
+            self._checked = now if changes == self._changes else None
+
+    def _refresh(self, conn):
+        marker = ballot_marker(conn)
+        if self._ballots is not None and marker == self._marker:
+            return
+        self._scenarios = None
+        if self._ballots is not None and len(self._ballots):
+            last_id = self._ballots.ids[-1].item()
+            added = load_ballots(conn, after_id=last_id)
+            if len(self._ballots) + len(added) == marker[1]:
+                self._ballots = Ballots.concatenate([self._ballots, added])
+                self._groups = self._groups + FirstChoiceGroups.from_ballots(added)
+                self._marker = marker
+                return
+        self._ballots = load_ballots(conn)
+        self._groups = FirstChoiceGroups.from_ballots(self._ballots)
+        self._marker = marker
+
+
+def by_candidate(tally):
+    """:return: a tally array as a dictionary from candidate name"""
+    return dict(zip(CANDIDATES, tally.tolist()))
+
+
+def matrix_by_candidate(matrix):
+    """:return: a (candidates x candidates) array as a dictionary from candidate name to dictionary from candidate name"""
+    return {candidate: by_candidate(row) for candidate, row in zip(CANDIDATES, matrix)}
+
+
+def shares(request_json):
+    """:return: the share of each candidate given in a request, in CANDIDATES order"""
+    return [request_json[candidate] for candidate in CANDIDATES]
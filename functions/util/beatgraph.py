@@ -0,0 +1,83 @@
+import hashlib
+import os
+
+import numpy
+
+from util.ranked_pairs import lock_pairs, topological_order
+
+
+def beat_graph(matchups, top=None):
+    """The simplest graph of which dogs beat which: the victory graph with the edges that would close a cycle dropped
+    (keeping the larger margins, as in ranked pairs), then transitively reduced, so a dog only points to the dogs it
+    beats that no other dog in between also beats.
+
+    :param matchups: a Matchups
+    :param top: if given, only the first `top` dogs in the graph's topological order
+    :return: the dog ids, best first, and the edges between them as (winner, loser) dog id pairs
+    """
+    margins = matchups.victory_margins()
+    winners, losers = numpy.nonzero(~numpy.isnan(margins))
+    by_margin = numpy.argsort(-margins[winners, losers], kind="stable")
+    children = lock_pairs(len(matchups.dogs), zip(winners[by_margin].tolist(), losers[by_margin].tolist()))
+
+    order = topological_order(children)
+    if top is not None:
+        # Every path between two of the first k nodes of a topological order stays within them, so cutting the rest
+        # off doesn't change which of them beat which
+        order = order[:top]
+    kept = set(order)
+    children = [[child for child in node_children if child in kept] for node_children in children]
+
+    dogs = matchups.dogs.tolist()
+    return [dogs[node] for node in order], \
+           [(dogs[u], dogs[v]) for u, v in transitive_reduction(children, order)]
+
+
+def transitive_reduction(children, order):
+    """Finds the edges of a DAG that aren't implied by a longer path.
+
+    Going through the nodes from last to first in topological order, each node's descendants are known by the time it
+    is reached. A node's children are visited nearest first, so a child that is also reachable through another child is
+    already among the descendants found when it is visited, and its edge is dropped.
+
+    :param children: each node's children
+    :param order: a topological order of the nodes to reduce, which may leave some out
+    :return: the (u, v) edges to keep
+    """
+    position = {node: i for i, node in enumerate(order)}
+    descendants = {}
+    edges = []
+    for node in reversed(order):
+        reach = 0
+        for child in sorted(children[node], key=position.__getitem__):
+            if not reach >> child & 1:
+                edges.append((node, child))
+                reach |= descendants[child] | 1 << child
+        descendants[node] = reach
+    return edges
+
+
+def render(dogs, edges, path, layout_cache=None):
+    """Draws the graph with graphviz's dot layout. Laying out a large graph is slow, so when layout_cache is a
+    directory, the laid out graph is kept there, and drawing the same graph again reuses its positions."""
+    import pygraphviz as pgv
+
+    graph = pgv.AGraph(directed=True)
+    graph.add_nodes_from(dogs)
+    graph.node_attr['shape'] = 'square'
+    graph.add_edges_from(edges)
+
+    if layout_cache is None:
+        graph.layout(prog='dot')
+        graph.draw(path)
+        return
+
+    cached = os.path.join(layout_cache, hashlib.sha256(graph.string().encode()).hexdigest() + ".dot")
+    if os.path.exists(cached):
+        graph = pgv.AGraph(cached)
+    else:
+        graph.layout(prog='dot')
+        os.makedirs(layout_cache, exist_ok=True)
+        graph.write(cached)
+    # neato -n2 draws nodes and edges where the layout put them, without laying them out again
+    graph.draw(path, prog='neato', args='-n2')
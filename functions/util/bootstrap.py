@@ -0,0 +1,55 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from util.rank_stats import ranking_order
+
+# The snapshot each worker process resamples, set once when the worker starts rather than sent with every task
+_votes = None
+_dogs = None
+
+
+def bootstrap_ranks(rank, votes, resamples, seed=None, workers=None):
+    """Ranks `resamples` bootstrap samples of the votes: each is as many votes as the original, drawn with replacement.
+
+    Every resample gets its own seed, spawned from `seed`, so the result only depends on the seed and not on how the
+    resamples are split between workers.
+
+    :param rank: a function from (VoteColumns, seed) to a ranking, which must be picklable
+    :param votes: a VoteColumns
+    :param workers: the number of processes to rank resamples in, defaulting to the number of CPUs
+    :return: the ids of every dog in votes, and a (resamples x dogs) array of each dog's position in each resample's
+             ranking (1 being first), NaN where a resample has no votes with the dog
+    """
+    dogs = votes.dogs()
+    seeds = numpy.random.SeedSequence(seed).spawn(resamples)
+    with ProcessPoolExecutor(workers, initializer=_start_worker, initargs=(votes, dogs)) as executor:
+        positions = list(executor.map(_rank_resample, [rank] * resamples, seeds, chunksize=max(1, resamples // 64)))
+    return dogs, numpy.array(positions).reshape(resamples, len(dogs))
+
+
+def _start_worker(votes, dogs):
+    global _votes, _dogs
+    _votes = votes
+    _dogs = dogs
+
+
+def _rank_resample(rank, seed):
+    rng = numpy.random.default_rng(seed)
+    sample = _votes.take(rng.integers(0, len(_votes), len(_votes)))
+    order = ranking_order(rank(sample, int(rng.integers(2 ** 32))))
+
+    positions = numpy.full(len(_dogs), numpy.nan)
+    positions[numpy.searchsorted(_dogs, order)] = numpy.arange(1, len(order) + 1)
+    return positions
+
+
+def summarize_ranks(dogs, positions, confidence=95):
+    """
+    :return: (dog, median position, low, high) for each dog, where low to high is the central `confidence` percent
+             interval of its positions, best median first
+    """
+    tail = (100 - confidence) / 2
+    median, low, high = numpy.nanpercentile(positions, [50, tail, 100 - tail], axis=0)
+    order = numpy.lexsort((high, median))
+    return [(dogs[i].item(), median[i].item(), low[i].item(), high[i].item()) for i in order]
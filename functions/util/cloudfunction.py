@@ -1,32 +1,88 @@
 import functools
 import json
+import logging
+import random
+import threading
 import traceback
+from os import getenv
 
 import jsonschema
 from util.get_pool import get_pool
+from util.logs import log, log_exception
+from util.timing import StageTimer, server_timing
 
 pg_pool = None
+pg_pool_lock = threading.Lock()
 
+# Set CLOUDFUNCTION_DEBUG=true to validate every output, including for endpoints that only validate in debug
+DEBUG = getenv('CLOUDFUNCTION_DEBUG', "") == "true"
 
-def cloudfunction(in_schema=None, out_schema=None):
+# Set LOG_PAYLOADS=false to stop logging each request and response body
+LOG_PAYLOADS = getenv('LOG_PAYLOADS', "true") == "true"
+
+# The fraction of response bodies to log. Requests are always logged, and so are responses to requests that fail.
+LOG_RESPONSE_SAMPLE_RATE = float(getenv('LOG_RESPONSE_SAMPLE_RATE', "0.01"))
+
+
+class RawResponse:
+    """A non-json response, such as an image. If it has an etag, requests with a matching `If-None-Match` header get an
+    empty 304 response instead of the body.
+
+    The body can be given as `load` instead, a function returning a (body, content_type) tuple, or None if there is
+    nothing to serve (a 404). It is only called when the body is actually sent.
+    """
+
+    def __init__(self, body=None, content_type=None, etag=None, max_age=None, load=None):
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self.max_age = max_age
+        self.load = load
+
+
+def cloudfunction(in_schema=None, out_schema=None, query_args=False, validate_output="always", after_commit=None):
     """
 
     :param in_schema: the schema for the input, or a falsy value if there is no input
     :param out_schema: the schema for the output, or a falsy value if there is no output
+    :param query_args: read the input from the url's query string instead of the json body, for endpoints that are
+                       linked to directly (like images)
+    :param validate_output: when to check the output against out_schema: "always", "debug" (only when
+                            CLOUDFUNCTION_DEBUG is set), or a number between 0 and 1, the fraction of responses to
+                            check. Large outputs are slow to validate, so endpoints that return them can sample.
+    :param after_commit: a function to call once the function's transaction has been committed, e.g. to tell caches
+                         about what it wrote, which other requests can only see from then on
     :return: the cloudfunction wrapped function
     """
     # Both schemas must be valid according to jsonschema draft 7, if they are provided.
+    # The validators are built once here, rather than on every request.
+    in_validator = None
+    out_validator = None
     if in_schema:
         jsonschema.Draft7Validator.check_schema(in_schema)
+        in_validator = jsonschema.Draft7Validator(in_schema)
     if out_schema:
         jsonschema.Draft7Validator.check_schema(out_schema)
+        out_validator = jsonschema.Draft7Validator(out_schema)
+
+    if validate_output == "always":
+        def should_validate_output():
+            return True
+    elif validate_output == "debug":
+        def should_validate_output():
+            return DEBUG
+    else:
+        assert 0 <= validate_output <= 1
+
+        def should_validate_output():
+            return DEBUG or random.random() < validate_output
 
     def cloudfunction_decorator(f):
         """ Wraps a function with two arguments, the first of which is a json object that it expects to be sent with the
         request, and the second is a postgresql pool. It modifies it by:
          - setting CORS headers and responding to OPTIONS requests with `Allow-Origin *`
          - passing a connection from a global postgres connection pool
-         - adding logging, of all inputs as well as error tracebacks.
+         - adding structured logging, of all inputs (summarized), a sample of outputs, and error tracebacks.
 
         :param f: A function that takes a `request` and a `pgpool` and returns a json-serializable object
         :return: a function that accepts one argument, a Flask request, and calls f with the modifications listed
@@ -43,31 +99,52 @@ def cloudfunction(in_schema=None, out_schema=None):
             headers = {'Access-Control-Allow-Origin': '*'}
 
             if not pg_pool:
-                pg_pool = get_pool()
+                with pg_pool_lock:
+                    # Another thread may have created it while we waited for the lock
+                    if not pg_pool:
+                        pg_pool = get_pool()
 
+            timer = StageTimer()
+            request_json = None
             try:
-                conn = pg_pool.getconn()
-
-                if in_schema:
-                    request_json = request.get_json()
-                    print(repr({"request_json": request_json}))
-                    jsonschema.validate(request_json, in_schema)
-                    function_output = f(request_json, conn)
+                with timer.stage("pool"):
+                    conn = pg_pool.getconn()
+
+                if in_validator:
+                    with timer.stage("parse"):
+                        request_json = dict(request.args.items()) if query_args else request.get_json()
+                    if LOG_PAYLOADS:
+                        log(logging.INFO, "request", function=f.__name__, request_json=request_json)
+                    with timer.stage("validate_input"):
+                        in_validator.validate(request_json)
+                    with timer.stage("handler"):
+                        function_output = f(request_json, conn)
                 else:
-                    function_output = f(conn)
+                    with timer.stage("handler"):
+                        function_output = f(conn)
+
+                if out_validator and should_validate_output():
+                    with timer.stage("validate_output"):
+                        out_validator.validate(function_output)
 
-                if out_schema:
-                    jsonschema.validate(function_output, out_schema)
+                with timer.stage("commit"):
+                    conn.commit()
+                if after_commit:
+                    after_commit()
 
-                conn.commit()
-                print(repr({"response_json": function_output}))
+                if isinstance(function_output, RawResponse):
+                    response = raw_response(request, function_output, headers)
+                else:
+                    if LOG_PAYLOADS and random.random() < LOG_RESPONSE_SAMPLE_RATE:
+                        log(logging.INFO, "response", function=f.__name__, response_json=function_output)
 
-                response_json = json.dumps(function_output)
-                # TODO allow functions to specify return codes in non-exceptional cases
-                return (response_json, 200, headers)
+                    with timer.stage("serialize"):
+                        response_json = json.dumps(function_output)
+                    # TODO allow functions to specify return codes in non-exceptional cases
+                    response = (response_json, 200, headers)
             except:
-                print("Error: Exception traceback: " + repr(traceback.format_exc()))
-                return (traceback.format_exc(), 500, headers)
+                log_exception("error", function=f.__name__, request_json=request_json if LOG_PAYLOADS else None)
+                response = (traceback.format_exc(), 500, headers)
             finally:
                 # Make sure to put the connection back in the pool, even if there has been an exception
                 try:
@@ -75,11 +152,40 @@ def cloudfunction(in_schema=None, out_schema=None):
                 except NameError:  # conn might not be defined, depending on where the error happens above
                     pass
 
+            timings_ms = timer.record(f.__name__)
+            response[2]['Server-Timing'] = server_timing(timings_ms)
+            log(logging.INFO, "timings", function=f.__name__, status=response[1], timings_ms=timings_ms)
+            return response
+
         return wrapped
 
     return cloudfunction_decorator
 
 
+def pool_stats():
+    """:return: statistics about this instance's connection pool, or None if it hasn't been created yet"""
+    return pg_pool.stats() if pg_pool else None
+
+
+def raw_response(request, response, headers):
+    cache_headers = {}
+    if response.max_age is not None:
+        cache_headers['Cache-Control'] = f'public, max-age={response.max_age}, immutable'
+    if response.etag is not None:
+        cache_headers['ETag'] = response.etag
+        if_none_match = [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]
+        if '*' in if_none_match or response.etag in (tag[2:] if tag.startswith('W/') else tag for tag in if_none_match):
+            return ('', 304, {**headers, **cache_headers})
+
+    body, content_type = response.body, response.content_type
+    if response.load is not None:
+        loaded = response.load()
+        if loaded is None:
+            return ('Not found', 404, headers)
+        body, content_type = loaded
+    return (body, 200, {**headers, **cache_headers, 'Content-Type': content_type})
+
+
 # If given an OPTIONS request, tell the requester that we allow all CORS requests (pre-flight stage)
 def cors_options():
     # Allows GET and POST requests from any origin with the Content-Type
@@ -0,0 +1,44 @@
+def has_directed_cycle(n, sources, targets):
+    """Kahn's algorithm: repeatedly removes nodes with no remaining in-edges, which only gets stuck on a cycle.
+
+    :param n: the number of nodes, which are the integers 0 to n - 1
+    :param sources: the start of each edge
+    :param targets: the end of each edge
+    """
+    children = [[] for _ in range(n)]
+    indegree = [0] * n
+    for source, target in zip(sources, targets):
+        children[source].append(target)
+        indegree[target] += 1
+
+    ready = [node for node in range(n) if indegree[node] == 0]
+    removed = 0
+    while ready:
+        node = ready.pop()
+        removed += 1
+        for child in children[node]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+    return removed < n
+
+
+def has_undirected_cycle(n, sources, targets):
+    """Union-find: an edge between two nodes that are already connected closes a cycle. Assumes there is at most one
+    edge between any two nodes, in either direction.
+    """
+    parent = list(range(n))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for source, target in zip(sources, targets):
+        source_root = find(source)
+        target_root = find(target)
+        if source_root == target_root:
+            return True
+        parent[source_root] = target_root
+    return False
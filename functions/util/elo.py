@@ -1,41 +1,113 @@
-import math
+import json
 import random
 
+from psycopg2.extras import execute_values
 
-def compute_elo(results):
+# k represents a scaling factor that affects how quickly scores change
+# some dispute, see https://en.wikipedia.org/wiki/Elo_rating_system#Most_accurate_K-factor
+# we choose a low k-factor, because a photo's cuteness is unlikely to change over time
+K = 10
+
+# The rating of a dog that hasn't been voted on yet
+INITIAL_RATING = 1200
+
+REPLAY_ORDERS = ["submission", "shuffle"]
+
+
+def compute_elo(results, shuffle=True, seed=None):
     """
     :param results: a list of (id1, id2, outcome) tuples, where outcome is one of "win", "loss", or "tie"
+    :param shuffle: replay the results in a random order, rather than the order given
+    :param seed: seed for the shuffle, so that a ranking can be reproduced
     :return: an array of tuples, like [[1, 2134], [2, 1987], ... [last_id, lowest_elo]]
     """
-    # k represents a scaling factor that affects how quickly scores change
-    # some dispute, see https://en.wikipedia.org/wiki/Elo_rating_system#Most_accurate_K-factor
-    # we choose a low k-factor, because a photo's cuteness is unlikely to change over time
-    k = 10
     results = [x for x in results]
-    random.shuffle(results)
+    if shuffle:
+        random.Random(seed).shuffle(results)
 
     elo = {}
     for id1, id2, result in results:
-        # Get the current rankings, or 1200 if they haven't been seen yet
-        rank1 = elo.get(id1, 1200)
-        rank2 = elo.get(id2, 1200)
+        apply_result(elo, id1, id2, result)
+
+    return sorted([(id, elo_score) for id, elo_score in elo.items()], key=lambda r: r[1], reverse=True)
 
-        # This implements a ratio such that dogs with a difference in elo of 400
-        # have an expected outcome of 10:1 win:loss.
-        expected_outcome = int(1 / (1 + 10 ** ((rank2 - rank1) / 400)) * 1000) / 1000
 
+def apply_result(elo, id1, id2, result):
+    """Updates the ratings in `elo` (a dictionary from id to rating) with the outcome of one vote."""
+    # Get the current rankings, or 1200 if they haven't been seen yet
+    rank1 = elo.get(id1, INITIAL_RATING)
+    rank2 = elo.get(id2, INITIAL_RATING)
 
-        # This is the outcome for the first contestant
-        outcome = None
-        if result == "win":
-            outcome = 1
-        if result == "loss":
-            outcome = 0
-        if result == "tie":
-            outcome = 0.5
+    # This implements a ratio such that dogs with a difference in elo of 400
+    # have an expected outcome of 10:1 win:loss.
+    expected_outcome = int(1 / (1 + 10 ** ((rank2 - rank1) / 400)) * 1000) / 1000
 
-        delta = k * (outcome - expected_outcome)
-        elo[id1] = rank1 + delta
-        elo[id2] = rank2 - delta
+    # This is the outcome for the first contestant
+    outcome = None
+    if result == "win":
+        outcome = 1
+    if result == "loss":
+        outcome = 0
+    if result == "tie":
+        outcome = 0.5
 
-    return sorted([(id, elo_score) for id, elo_score in elo.items()], key=lambda r: r[1], reverse=True)
+    delta = K * (outcome - expected_outcome)
+    elo[id1] = rank1 + delta
+    elo[id2] = rank2 - delta
+
+
+def record_elo(cursor, id1, id2, result):
+    """Updates `elo_ratings` with the outcome of one vote. Runs on the caller's cursor, so the new ratings are
+    committed (or rolled back) together with the vote itself."""
+    ids = sorted({id1, id2})
+
+    # Lock both rows, always in the same order so that concurrent votes can't deadlock
+    execute_values(cursor, "INSERT INTO elo_ratings (dog_id, rating) VALUES %s ON CONFLICT (dog_id) DO NOTHING",
+                   [(id, INITIAL_RATING) for id in ids])
+    cursor.execute("SELECT dog_id, rating FROM elo_ratings WHERE dog_id = ANY(%s) ORDER BY dog_id FOR UPDATE",
+                   (ids,))
+    elo = dict(cursor.fetchall())
+
+    apply_result(elo, id1, id2, result)
+    execute_values(cursor, """
+        UPDATE elo_ratings SET rating = new.rating FROM (VALUES %s) AS new (dog_id, rating)
+          WHERE elo_ratings.dog_id = new.dog_id""", list(elo.items()))
+
+
+def rebuild_elo(conn, order="submission", seed=None, checkpoint_every=None):
+    """Recomputes `elo_ratings` by replaying every vote. Votes submitted while this runs wait for it to finish.
+
+    :param order: "submission" to replay votes in the order they were cast, or "shuffle" for a random order
+    :param seed: seed for the shuffle
+    :param checkpoint_every: if given, write the ratings to `elo_checkpoints` after every this many votes,
+                             and at the end
+    """
+    assert order in REPLAY_ORDERS
+
+    with conn.cursor() as cursor:
+        cursor.execute("LOCK TABLE votes IN SHARE MODE")
+        cursor.execute("""
+            SELECT id, dog1_id, dog2_id, result FROM votes
+              WHERE dog1_id IS NOT NULL AND dog2_id IS NOT NULL AND result IS NOT NULL
+              ORDER BY submission_time, id""")
+        votes = cursor.fetchall()
+        if order == "shuffle":
+            random.Random(seed).shuffle(votes)
+
+        def checkpoint(replayed):
+            cursor.execute("""
+                INSERT INTO elo_checkpoints (replay_order, seed, votes_replayed, last_vote_id, ratings)
+                  VALUES (%s, %s, %s, %s, %s)""",
+                           (order, seed, replayed, votes[replayed - 1][0],
+                            json.dumps({str(id): rating for id, rating in elo.items()})))
+
+        elo = {}
+        for replayed, (_, id1, id2, result) in enumerate(votes, start=1):
+            apply_result(elo, id1, id2, result)
+            if checkpoint_every and replayed % checkpoint_every == 0:
+                checkpoint(replayed)
+        if checkpoint_every and len(votes) % checkpoint_every != 0:
+            checkpoint(len(votes))
+
+        cursor.execute("DELETE FROM elo_ratings")
+        execute_values(cursor, "INSERT INTO elo_ratings (dog_id, rating) VALUES %s", list(elo.items()))
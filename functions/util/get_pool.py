@@ -1,6 +1,8 @@
+import threading
+import time
 from os import getenv
-from psycopg2 import OperationalError, connect
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2 import InterfaceError, OperationalError, connect
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
 INSTANCE_CONNECTION_NAME = getenv('INSTANCE_CONNECTION_NAME', "")
 
@@ -8,6 +10,22 @@ POSTGRES_USER = getenv('POSTGRES_USER', "")
 POSTGRES_PASSWORD = getenv('POSTGRES_PASSWORD', "")
 POSTGRES_NAME = getenv('POSTGRES_DATABASE', "postgres")
 
+# How many connections each instance opens when it starts, and the most it keeps open
+POOL_MIN_CONNECTIONS = int(getenv('POOL_MIN_CONNECTIONS', "1"))
+POOL_MAX_CONNECTIONS = int(getenv('POOL_MAX_CONNECTIONS', "4"))
+
+# Seconds to wait for a free connection before giving up on a request
+POOL_TIMEOUT = float(getenv('POOL_TIMEOUT', "10"))
+
+# Connections that have sat in the pool for longer than this many seconds are checked with a `SELECT 1` before use,
+# since Cloud SQL drops idle sockets
+POOL_CHECK_AFTER_IDLE = float(getenv('POOL_CHECK_AFTER_IDLE', "30"))
+
+# How many times to try getting a working connection before failing, and the delay before the first retry (doubling
+# after that)
+CONNECT_ATTEMPTS = 3
+CONNECT_RETRY_DELAY = 0.1
+
 pg_config = {
     'user': POSTGRES_USER,
     'password': POSTGRES_PASSWORD,
@@ -15,6 +33,107 @@ pg_config = {
 }
 
 
+class ConnectionPool:
+    """A connection pool that is safe to share between threads.
+
+    Unlike psycopg2's pools, getconn waits for a connection to be returned when they are all in use, rather than
+    failing. Connections are checked before being handed out, and broken ones are closed and replaced, so that a dropped
+    socket doesn't fail every request until the instance restarts.
+    """
+
+    def __init__(self, minconn, maxconn, **kwargs):
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **kwargs)
+        # psycopg2 closes connections returned while it holds minconn idle ones, which would reconnect on most requests
+        # under load. Raising it once the first minconn are open keeps every connection, without opening all up front.
+        self._pool.minconn = maxconn
+        self._available = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._returned_at = {}
+        self.maxconn = maxconn
+        self.in_use = 0
+        self.discarded = 0
+        self.total_wait_ms = 0.0
+        self.checkouts = 0
+
+    def getconn(self, timeout=POOL_TIMEOUT):
+        start = time.perf_counter()
+        if not self._available.acquire(timeout=timeout):
+            raise PoolError(f"timed out after {timeout}s waiting for a connection")
+        try:
+            conn = self._checkout()
+        except:
+            self._available.release()
+            raise
+
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.total_wait_ms += (time.perf_counter() - start) * 1000
+        return conn
+
+    def _checkout(self):
+        delay = CONNECT_RETRY_DELAY
+        for attempt in range(CONNECT_ATTEMPTS):
+            try:
+                conn = self._pool.getconn()
+            except OperationalError:
+                # Couldn't open a new connection, the database may be restarting
+                if attempt == CONNECT_ATTEMPTS - 1:
+                    raise
+            else:
+                if self._is_healthy(conn):
+                    return conn
+                self._discard(conn)
+            time.sleep(delay)
+            delay *= 2
+        raise OperationalError(f"no working connection after {CONNECT_ATTEMPTS} attempts")
+
+    def _is_healthy(self, conn):
+        with self._lock:
+            returned_at = self._returned_at.pop(id(conn), None)
+        if conn.closed:
+            return False
+        if returned_at is not None and time.monotonic() - returned_at < POOL_CHECK_AFTER_IDLE:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (OperationalError, InterfaceError):
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self.discarded += 1
+        self._pool.putconn(conn, close=True)
+
+    def putconn(self, conn):
+        try:
+            if conn.closed:
+                self._discard(conn)
+            else:
+                # psycopg2 rolls back any open transaction, and closes the connection if that fails
+                self._pool.putconn(conn)
+                if not conn.closed:
+                    with self._lock:
+                        self._returned_at[id(conn)] = time.monotonic()
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._available.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_connections": self.maxconn,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "discarded": self.discarded,
+                "mean_wait_ms": self.total_wait_ms / self.checkouts if self.checkouts else None,
+            }
+
+
 def get_pool():
     try:
         return __connect(f'/cloudsql/{INSTANCE_CONNECTION_NAME}')
@@ -28,7 +147,7 @@ def __connect(host):
     Helper functions to connect to Postgres
     """
     pg_config['host'] = host
-    return SimpleConnectionPool(1, 1, **pg_config)
+    return ConnectionPool(POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, **pg_config)
 
 
 def get_connection(conn_details=None):
@@ -0,0 +1,192 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+from os import getenv
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow, every variant is served as the original upload
+    Image = None
+
+# If set, images are kept on the local filesystem under this directory (for on-prem use),
+# otherwise they are kept in the `images` table of the database.
+IMAGE_STORE_PATH = getenv('IMAGE_STORE_PATH', "")
+
+# Prefix for the image urls we hand out, empty by default so they are relative to the cloud functions url.
+IMAGE_BASE_URL = getenv('IMAGE_BASE_URL', "")
+
+# Longest side, in pixels, of each pre-sized variant
+VARIANT_SIZES = {
+    "thumbnail": 160,
+    "display": 640,
+}
+VARIANTS = ["original", *VARIANT_SIZES]
+
+
+def decode_image(image):
+    """Decodes an image as submitted by the frontend: base64, optionally as a data url.
+
+    :return: a (data, content_type) tuple. Anything that isn't base64 is stored as its utf-8 bytes.
+    """
+    content_type = "application/octet-stream"
+    payload = image
+    if image.startswith("data:") and "," in image:
+        header, payload = image[len("data:"):].split(",", 1)
+        content_type = header.split(";")[0] or content_type
+
+    try:
+        return base64.b64decode(payload, validate=True), content_type
+    except (binascii.Error, ValueError):
+        return image.encode("utf-8"), content_type
+
+
+def make_variants(data, content_type):
+    """
+    :return: a dictionary from each variant name to a (data, content_type) tuple
+    """
+    variants = {variant: (data, content_type) for variant in VARIANTS}
+    if Image is None:
+        return variants
+
+    try:
+        original = Image.open(io.BytesIO(data))
+        original.load()
+    except (OSError, ValueError):
+        # Not something Pillow can read, so all we can serve is the original
+        return variants
+
+    variants["original"] = (data, Image.MIME.get(original.format, content_type))
+    for variant, size in VARIANT_SIZES.items():
+        resized = original.convert("RGB")
+        resized.thumbnail((size, size))
+        out = io.BytesIO()
+        resized.save(out, format="JPEG", quality=85, optimize=True)
+        variants[variant] = (out.getvalue(), "image/jpeg")
+    return variants
+
+
+def image_urls(image_hash):
+    return {variant: f"{IMAGE_BASE_URL}get_dog_image?hash={image_hash}&variant={variant}" for variant in VARIANTS}
+
+
+def etag(image_hash, variant):
+    # Images are content addressed, so the hash and variant identify the bytes exactly
+    return f'"{image_hash}-{variant}"'
+
+
+def put_image(store, image):
+    """Stores an image and all of its variants.
+
+    :param store: the store to write to, see `get_image_store`
+    :param image: the image as submitted, a base64 string
+    :return: the hex sha256 of the original image, which identifies it in the store
+    """
+    data, content_type = decode_image(image)
+    image_hash = hashlib.sha256(data).hexdigest()
+    if not store.contains(image_hash):
+        for variant, (variant_data, variant_content_type) in make_variants(data, content_type).items():
+            store.put(image_hash, variant, variant_data, variant_content_type)
+    return image_hash
+
+
+class LocalImageStore:
+    """Keeps each image variant as two files (data and content type) under a root directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, image_hash, variant):
+        return os.path.join(self.root, image_hash[:2], image_hash, variant)
+
+    def contains(self, image_hash):
+        return os.path.exists(self._path(image_hash, VARIANTS[-1]))
+
+    def put(self, image_hash, variant, data, content_type):
+        path = self._path(image_hash, variant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for file_path, contents in ((path + ".type", content_type.encode("utf-8")), (path, data)):
+            # Write then rename, so a concurrent reader never sees a partial file
+            tmp_path = f"{file_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(contents)
+            os.replace(tmp_path, file_path)
+
+    def get(self, image_hash, variant):
+        """
+        :return: a (data, content_type) tuple, or None if there is no such image
+        """
+        path = self._path(image_hash, variant)
+        try:
+            with open(path + ".type", "rb") as f:
+                content_type = f.read().decode("utf-8")
+            with open(path, "rb") as f:
+                return f.read(), content_type
+        except FileNotFoundError:
+            return None
+
+
+class PostgresImageStore:
+    """Keeps each image variant as a row of the `images` table."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def contains(self, image_hash):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM images WHERE hash = %s LIMIT 1", (image_hash,))
+            return cursor.fetchone() is not None
+
+    def put(self, image_hash, variant, data, content_type):
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO images (hash, variant, content_type, data) VALUES (%s, %s, %s, %s)
+                  ON CONFLICT (hash, variant) DO NOTHING""",
+                           (image_hash, variant, content_type, data))
+
+    def get(self, image_hash, variant):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT data, content_type FROM images WHERE hash = %s AND variant = %s",
+                           (image_hash, variant))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return bytes(row[0]), row[1]
+
+
+def get_image_store(conn):
+    if IMAGE_STORE_PATH:
+        return LocalImageStore(IMAGE_STORE_PATH)
+    return PostgresImageStore(conn)
+
+
+def move_dog_image(conn, dog_id, image):
+    """Moves a dog's image, as stored inline before the image store, into the store.
+
+    :param image: the dogs.image column (postgres BYTEA)
+    :return: the image's hash
+    """
+    # Convert from wacky in-memory format (postgres BYTEA) to byte-string
+    image_hash = put_image(get_image_store(conn), str(bytes(image), 'UTF-8'))
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE dogs SET image_hash = %s, image = NULL WHERE id = %s", (image_hash, dog_id))
+    return image_hash
+
+
+def migrate_images(conn, batch_size=100):
+    """Moves every dog's inline image into the store, committing after each batch.
+
+    :return: how many images were moved
+    """
+    moved = 0
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id, image FROM dogs WHERE image_hash IS NULL ORDER BY id LIMIT %s", (batch_size,))
+            rows = cursor.fetchall()
+        if not rows:
+            return moved
+        for dog_id, image in rows:
+            move_dog_image(conn, dog_id, image)
+        conn.commit()
+        moved += len(rows)
@@ -0,0 +1,125 @@
+import atexit
+import hashlib
+import json
+import logging
+import queue
+import sys
+import traceback
+from logging.handlers import QueueHandler, QueueListener
+from os import getenv
+
+# How many records can wait to be written before new ones are dropped. Errors don't wait, so are never dropped.
+LOG_QUEUE_SIZE = int(getenv('LOG_QUEUE_SIZE', "1000"))
+
+# Strings longer than this are logged as their length and hash, and lists longer than this are cut short
+LOG_MAX_FIELD_LENGTH = int(getenv('LOG_MAX_FIELD_LENGTH', "256"))
+
+# Fields that are never logged in full, however short, such as base64 images
+HASHED_FIELDS = {"image"}
+
+
+def summarize(value, max_length=LOG_MAX_FIELD_LENGTH):
+    """Makes a json-serializable copy of a payload that is small enough to log, replacing long strings and the values of
+    `HASHED_FIELDS` with their length and sha256, and keeping only the first `max_length` items of long lists.
+    """
+    if isinstance(value, dict):
+        return {key: _hashed(item) if key in HASHED_FIELDS and item is not None else summarize(item, max_length)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        summary = [summarize(item, max_length) for item in value[:max_length]]
+        if len(value) > max_length:
+            summary.append(f"... {len(value) - max_length} more")
+        return summary
+    if isinstance(value, str) and len(value) > max_length:
+        return _hashed(value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+
+def _hashed(value):
+    data = value.encode() if isinstance(value, str) else repr(value).encode()
+    return {"length": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one line of json, which Cloud Logging parses into a structured entry, with the record's
+    `fields` (passed with `extra`, already summarized)."""
+
+    def format(self, record):
+        entry = {"severity": record.levelname, "message": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            entry["traceback"] = record.exc_text
+        return json.dumps(entry)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """Hands records to a background thread through a bounded queue, so writing them doesn't block the request.
+
+    When the queue is full, records are dropped and counted. Errors are instead written right away by `error_handler`,
+    since the background thread may not get any CPU once the response is sent, and the function's instance may be
+    stopped before they are written.
+    """
+
+    def __init__(self, log_queue, error_handler):
+        super().__init__(log_queue)
+        self.error_handler = error_handler
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Tracebacks have to be formatted before the frames they refer to are gone, but everything else is left to the
+        # listener, including formatting the message itself
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if record.levelno >= logging.ERROR:
+            self.error_handler.handle(self.prepare(record))
+        else:
+            super().emit(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_output = logging.StreamHandler(sys.stdout)
+_output.setFormatter(JsonFormatter())
+
+_queue = queue.Queue(LOG_QUEUE_SIZE)
+_handler = BoundedQueueHandler(_queue, _output)
+_listener = QueueListener(_queue, _output)
+_listener.start()
+atexit.register(_listener.stop)
+
+logger = logging.getLogger("cloudfunction")
+logger.setLevel(logging.INFO)
+logger.addHandler(_handler)
+logger.propagate = False
+
+
+def log(level, message, **fields):
+    """Logs a structured record, in the background unless it is an error. `fields` are summarized right away, on the calling thread, so later
+    changes to them (e.g. a handler editing its request) don't change what is logged."""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"fields": summarize(fields)})
+
+
+def log_exception(message, **fields):
+    """Logs an error with the traceback of the exception being handled, before returning."""
+    logger.exception(message, extra={"fields": summarize(fields)})
+
+
+def flush():
+    """Waits for every record logged so far to be written."""
+    _queue.join()
+
+
+def dropped_records():
+    """:return: how many records have been dropped because the queue was full"""
+    return _handler.dropped
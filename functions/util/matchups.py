@@ -0,0 +1,117 @@
+import networkx
+import numpy
+
+from util.vote_columns import LOSS, TIE, WIN
+
+
+class Matchups:
+    """Head-to-head results between every pair of dogs, as dense count matrices indexed by position in `dogs`.
+
+    wins[i, j] is the number of times dogs[i] beat dogs[j], so the losses matrix is its transpose, and ties is
+    symmetric.
+    """
+
+    def __init__(self, dogs, wins, ties):
+        self.dogs = dogs
+        self.wins = wins
+        self.ties = ties
+
+    @classmethod
+    def from_votes(cls, votes):
+        """Counts a VoteColumns' results. A dog voted against itself is not a matchup, so those votes are ignored."""
+        votes = votes.take(votes.dog1 != votes.dog2)
+        dogs = votes.dogs()
+        n = len(dogs)
+        first = numpy.searchsorted(dogs, votes.dog1)
+        second = numpy.searchsorted(dogs, votes.dog2)
+
+        def count(rows, columns):
+            return numpy.bincount(rows * n + columns, minlength=n * n).reshape(n, n)
+
+        win = votes.result == WIN
+        loss = votes.result == LOSS
+        tie = votes.result == TIE
+        wins = count(numpy.r_[first[win], second[loss]], numpy.r_[second[win], first[loss]])
+        ties = count(first[tie], second[tie])
+        return cls(dogs, wins, ties + ties.T)
+
+    @property
+    def losses(self):
+        return self.wins.T
+
+    def totals(self):
+        return self.wins + self.wins.T + self.ties
+
+    def margins(self):
+        """:return: the fraction of their matchups that dogs[i] won against dogs[j], or NaN if they never met"""
+        totals = self.totals()
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(totals > 0, self.wins / totals, numpy.nan)
+
+    def victory_margins(self):
+        """:return: the margins of only the pairs where dogs[i] has the higher margin against dogs[j], NaN otherwise"""
+        margins = self.margins()
+        with numpy.errstate(invalid="ignore"):
+            return numpy.where(margins > margins.T, margins, numpy.nan)
+
+    def copeland_scores(self):
+        """:return: for each dog, the number of dogs it beats minus the number it loses to"""
+        victories = ~numpy.isnan(self.victory_margins())
+        return victories.sum(axis=1) - victories.sum(axis=0)
+
+    def worst_defeats(self):
+        """:return: for each dog, the highest margin any dog has against it, or 0 if it has no matchups"""
+        margins = numpy.nan_to_num(self.margins(), nan=-numpy.inf)
+        worst = margins.max(axis=0, initial=-numpy.inf)
+        return numpy.where(numpy.isinf(worst), 0, worst)
+
+    def condorcet_winner(self):
+        """:return: the dog that beats every other dog head to head, or None if there isn't one"""
+        return self._beats_everyone(~numpy.isnan(self.victory_margins()))
+
+    def condorcet_loser(self):
+        """:return: the dog that every other dog beats head to head, or None if there isn't one"""
+        return self._beats_everyone(~numpy.isnan(self.victory_margins()).T)
+
+    def _beats_everyone(self, victories):
+        # At most one dog can beat all n - 1 others
+        beats = victories.sum(axis=1)
+        candidates = numpy.flatnonzero(beats == len(self.dogs) - 1)
+        return self.dogs[candidates[0]].item() if len(candidates) and len(self.dogs) > 1 else None
+
+    def win_ratios(self, ties_count_as_wins=False):
+        """:return: for each dog, its wins (and ties, optionally) as a fraction of its wins, ties and losses, or 0 if it
+                    has none"""
+        wins = self.wins.sum(axis=1)
+        if ties_count_as_wins:
+            wins = wins + self.ties.sum(axis=1)
+        decided = wins + self.losses.sum(axis=1)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(decided > 0, wins / decided, 0.0)
+
+    def matchup_graph(self):
+        """:return: a networkx DiGraph with an edge each way between every pair of dogs that have met, with their
+                    wins, losses, ties, and margin"""
+        return self._graph(self.margins())
+
+    def victory_graph(self):
+        """:return: the matchup graph, keeping only the edge with the higher margin of each pair, and neither on a tie"""
+        return self._graph(self.victory_margins())
+
+    def _graph(self, margins):
+        g = networkx.DiGraph()
+        g.add_nodes_from(self.dogs.tolist())
+        losses = self.losses
+        for i, j in zip(*numpy.nonzero(~numpy.isnan(margins))):
+            g.add_edge(self.dogs[i].item(), self.dogs[j].item(),
+                       wins=self.wins[i, j].item(),
+                       losses=losses[i, j].item(),
+                       ties=self.ties[i, j].item(),
+                       margin=margins[i, j].item())
+        return g
+
+
+def ranked(dogs, scores, reverse=False):
+    """:return: (dog, score) pairs sorted by score, keeping the order of dogs with equal scores"""
+    order = numpy.argsort(-scores if reverse else scores, kind="stable")
+    return list(zip(dogs[order].tolist(), scores[order].tolist()))
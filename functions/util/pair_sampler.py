@@ -0,0 +1,52 @@
+import random
+
+
+def pair_key(dog1, dog2):
+    """Encodes an unordered pair of dog ids as a single integer, so a voter's seen pairs can be kept in a flat set."""
+    if dog1 > dog2:
+        dog1, dog2 = dog2, dog1
+    return (dog1 << 32) | dog2
+
+
+def seen_pair_index(pairs):
+    """
+    :param pairs: an iterable of (dog1_id, dog2_id) tuples, in either orientation
+    :return: a set of pair keys, see `pair_key`
+    """
+    return {pair_key(dog1, dog2) for dog1, dog2 in pairs if dog1 != dog2}
+
+
+def sample_unseen_pair(dog_ids, seen, rng=random):
+    """Picks a uniformly random ordered pair of distinct dogs whose unordered pair is not in `seen`.
+
+    While less than half of the pairs have been seen we sample and reject, which takes fewer than two tries on average
+    and never looks at the full N^2 set of pairs. Past that point (which only happens with a small number of dogs) we
+    enumerate the remaining pairs and pick one of them.
+
+    :param dog_ids: a list of distinct dog ids
+    :param seen: a set of pair keys, as built by `seen_pair_index`
+    :param rng: the source of randomness, anything with `randrange` and `sample`
+    :return: a dictionary of shape {"dog1": …, "dog2": …}, or None if every pair has been seen
+    """
+    n = len(dog_ids)
+    total_pairs = n * (n - 1) // 2
+
+    ids = set(dog_ids)
+    seen_count = sum(1 for key in seen if key >> 32 in ids and key & 0xFFFFFFFF in ids)
+    if seen_count >= total_pairs:
+        return None
+
+    if seen_count * 2 <= total_pairs:
+        while True:
+            dog1, dog2 = rng.sample(dog_ids, 2)
+            if pair_key(dog1, dog2) not in seen:
+                return {"dog1": dog1, "dog2": dog2}
+
+    unseen = [(dog1, dog2)
+              for i, dog1 in enumerate(dog_ids)
+              for dog2 in dog_ids[i + 1:]
+              if pair_key(dog1, dog2) not in seen]
+    dog1, dog2 = unseen[rng.randrange(len(unseen))]
+    if rng.randrange(2):
+        dog1, dog2 = dog2, dog1
+    return {"dog1": dog1, "dog2": dog2}
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from os import getenv
+
+from util.snapshot import Snapshot
+
+# Where rankings are kept between runs, and how much space they may take up there before the least recently used are
+# deleted
+RANK_CACHE_DIR = getenv('RANK_CACHE_DIR', os.path.join(os.path.expanduser("~"), ".cache", "dog-project", "rankings"))
+RANK_CACHE_BYTES = int(getenv('RANK_CACHE_BYTES', str(64 * 1024 * 1024)))
+
+# Part of every key, so rankings cached on disk by older code are never used. Increase it whenever a ranking method
+# changes what it returns.
+RANK_CACHE_VERSION = 1
+
+# How many rankings each process keeps in memory
+RANK_CACHE_ENTRIES = int(getenv('RANK_CACHE_ENTRIES', "64"))
+
+
+def vote_marker(conn):
+    """:return: something that changes whenever votes are added or removed: the highest vote id and the number of
+                votes. conn can also be a Snapshot, whose marker is recorded when it is exported."""
+    if isinstance(conn, Snapshot):
+        return [conn.metadata.get("max_vote_id"), conn.metadata.get("vote_count")]
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT MAX(id), COUNT(*) FROM votes")
+        return list(cursor.fetchone())
+
+
+def cache_key(ranking_method, filters, marker, window=None):
+    """:param marker: see vote_marker
+    :param window: the (from, until) dates of the votes ranked
+    :return: a key that is the same for equivalent filters, whatever order they are given in and however missing
+             filters are represented, or None if the marker can't tell whether votes have changed (like a snapshot
+             exported without one), so the ranking shouldn't be cached"""
+    if marker is None or all(value is None for value in marker):
+        return None
+    normalized = {name: value for name, value in filters.items() if value not in (None, False, "", [])}
+    if "ignore_dogs" in normalized:
+        normalized["ignore_dogs"] = sorted({int(dog) for dog in normalized["ignore_dogs"]})
+    key = json.dumps({"version": RANK_CACHE_VERSION, "method": ranking_method, "filters": normalized,
+                      "marker": marker, "window": window}, sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class RankCache:
+    """Rankings by key, kept in memory and on disk (unless directory is None), each evicting the least recently used.
+
+    A random method (elo) is cached like the rest, so repeated runs return the same ranking until votes change.
+    """
+
+    def __init__(self, directory=RANK_CACHE_DIR, max_bytes=RANK_CACHE_BYTES, max_entries=RANK_CACHE_ENTRIES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """:return: the ranking stored under key, or None. A None key (see cache_key) is never stored."""
+        if key is None:
+            return None
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        if self.directory is None:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                ranking = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # The file's modification time is its last use, for eviction
+        os.utime(path)
+        self._remember(key, ranking)
+        return ranking
+
+    def put(self, key, ranking):
+        if key is None:
+            return
+        self._remember(key, ranking)
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Written to a temporary file first, so that a concurrent run never reads half a ranking
+        temporary = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump(ranking, f)
+        os.replace(temporary, self._path(key))
+        self._evict_files()
+
+    def get_or_compute(self, key, compute):
+        ranking = self.get(key)
+        if ranking is None:
+            ranking = compute()
+            self.put(key, ranking)
+        return ranking
+
+    def _remember(self, key, ranking):
+        with self._lock:
+            self._memory[key] = ranking
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def _evict_files(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pickle"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,49 @@
+from itertools import combinations
+
+import numpy
+
+
+def ranking_order(rank):
+    """:return: the dog ids of a ranking, best first, whether it is a list of ids or of (id, score) pairs"""
+    return [entry[0] if isinstance(entry, (list, tuple)) else entry for entry in rank]
+
+
+def positions(order, dogs):
+    """:return: each of dogs' position (0 being first) in order"""
+    position = {dog: i for i, dog in enumerate(order)}
+    return numpy.array([position[dog] for dog in dogs], dtype=float)
+
+
+def spearman_rho(a, b):
+    """Spearman's rank correlation between two orderings, over the dogs they both contain"""
+    dogs = sorted(set(a) & set(b))
+    if len(dogs) < 2:
+        return float("nan")
+    # Rank the shared dogs among themselves, so dogs only one ranking has don't leave gaps
+    x = numpy.argsort(numpy.argsort(positions(a, dogs)))
+    y = numpy.argsort(numpy.argsort(positions(b, dogs)))
+    n = len(dogs)
+    return 1 - 6 * float(((x - y) ** 2).sum()) / (n * (n * n - 1))
+
+
+def kendall_tau(a, b):
+    """Kendall's tau-a between two orderings, over the dogs they both contain: the fraction of pairs of dogs they put in
+    the same order, minus the fraction they put in opposite orders"""
+    dogs = sorted(set(a) & set(b))
+    if len(dogs) < 2:
+        return float("nan")
+    x = positions(a, dogs)
+    y = positions(b, dogs)
+    agreement = numpy.sign(x[:, None] - x[None, :]) * numpy.sign(y[:, None] - y[None, :])
+    n = len(dogs)
+    return float(numpy.triu(agreement, 1).sum()) / (n * (n - 1) / 2)
+
+
+def rank_correlations(rankings):
+    """
+    :param rankings: a dictionary from method to ranking
+    :return: (method_a, method_b, spearman rho, kendall tau) for every pair of methods
+    """
+    orders = {method: ranking_order(rank) for method, rank in rankings.items()}
+    return [(a, b, spearman_rho(orders[a], orders[b]), kendall_tau(orders[a], orders[b]))
+            for a, b in combinations(orders, 2)]
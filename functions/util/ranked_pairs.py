@@ -1,39 +1,137 @@
-import networkx
+import numpy
+
 
 def ranked_pairs_ordering(dog_ids, matchups):
     """ Implements https://en.wikipedia.org/wiki/Ranked_pairs
 
     :param dog_ids: List of N IDs of contestants
-    :param matchups: An NxN matrix of win magnitude where matchups[i][j]
-                     is the i'ths dogs win ratio against the j'th.
+    :param matchups: An NxN matrix (nested lists or a NumPy array) of win magnitude where matchups[i][j]
+                     is the i'ths dogs win ratio against the j'th. None or NaN entries are not matchups.
     :return: a copy of dog_ids ordered by ranked pairs outcome
     """
     if len(dog_ids) == 0:
         return dog_ids
-    assert len(dog_ids) == len(matchups) == len(matchups[0])
+    margins = numpy.asarray(matchups, dtype=float)
+    assert margins.shape == (len(dog_ids), len(dog_ids))
+
+    # Of the two edges between a pair of dogs, whichever comes second in the locking order is always rejected: either
+    # the first was locked and the second would close a cycle, or the first closed a cycle and the second is implied.
+    # So only the first one of each pair is a candidate, which is the larger margin, or i->j for i < j on a tie.
+    reverse = margins.T
+    first_on_tie = numpy.triu(numpy.ones(margins.shape, dtype=bool))
+    candidates = ~numpy.isnan(margins) & ((margins > reverse) | numpy.isnan(reverse) |
+                                          ((margins == reverse) & first_on_tie))
+    winners, losers = numpy.nonzero(candidates)
+    # A stable sort, so equal margins are locked in row-major order
+    by_margin = numpy.argsort(-margins[winners, losers], kind="stable")
+
+    # Most locked edges agree with the dogs' total margins, so starting from that order leaves little to rearrange
+    initial_order = numpy.argsort(-numpy.nansum(margins, axis=1), kind="stable")
+
+    children = lock_pairs(len(dog_ids),
+                          zip(winners[by_margin].tolist(), losers[by_margin].tolist()),
+                          initial_order.tolist())
+    return [dog_ids[x] for x in topological_order(children)]
+
+
+def lock_pairs(n, edges, initial_order=None):
+    """Locks in each edge, in order, unless it would create a cycle with the edges locked before it.
+
+    Rather than searching the whole graph for a cycle after every edge, this keeps a topological order of the locked
+    graph as it grows (Pearce and Kelly's dynamic topological sort). An edge u->v that already points forward in that
+    order can't close a cycle, and is locked straight away. Otherwise, v can only reach u through the nodes placed
+    between them, so that window is all we search, and if there is no cycle we rearrange just the nodes found.
+
+    :param n: the number of nodes, which are the integers 0 to n - 1
+    :param edges: (u, v) pairs, in decreasing order of priority
+    :param initial_order: a permutation of the nodes to start the topological order from
+    :return: the locked graph, as a list of each node's children in the order they were locked
+    """
+    bits = [1 << i for i in range(n)]
+    children = [[] for _ in range(n)]
+    # Adjacency as bitsets, so searches can intersect them with the window
+    child_masks = [0] * n
+    parent_masks = [0] * n
+
+    nodes = list(initial_order) if initial_order is not None else list(range(n))
+    order = [0] * n
+    for position, node in enumerate(nodes):
+        order[node] = position
 
-    g = networkx.DiGraph()
-    g.add_nodes_from(range(len(matchups)))
+    for u, v in edges:
+        upper = order[u]
+        lower = order[v]
+        if lower <= upper:
+            # Most cycles are v->u or v->x->u, which we can see without a search
+            if u == v or child_masks[v] & (parent_masks[u] | bits[u]):
+                continue
 
-    edges = []
-    for i in range(len(matchups)):
-        for j in range(len(matchups[0])):
-            margin = matchups[i][j]
-            if margin is not None:
-                edges.append((i, j, margin))
+            window = 0
+            for node in nodes[lower + 1:upper]:
+                window |= bits[node]
 
-    edges.sort(key=lambda x: x[2], reverse=True)
+            forward = _search(v, child_masks, window, bits, stop=bits[u])
+            if forward is None:
+                continue
+            backward = _search(u, parent_masks, window, bits)
 
-    for edge in edges:
-        g.add_edge(edge[0], edge[1])
+            # Place everything that reaches u before everything v reaches, in the positions they already took up
+            backward.sort(key=order.__getitem__)
+            forward.sort(key=order.__getitem__)
+            affected = backward + forward
+            for node, position in zip(affected, sorted(order[node] for node in affected)):
+                order[node] = position
+                nodes[position] = node
+
+        children[u].append(v)
+        child_masks[u] |= bits[v]
+        parent_masks[v] |= bits[u]
+
+    return children
+
+
+def _search(start, masks, window, bits, stop=0):
+    """Finds every node reachable from start through nodes in the window.
+
+    :return: the nodes found (including start), or None if any of them has an edge into `stop`
+    """
+    found = [start]
+    stack = [start]
+    seen = bits[start]
+    while stack:
+        new = masks[stack.pop()] & window & ~seen
+        seen |= new
+        while new:
+            low = new & -new
+            new ^= low
+            node = low.bit_length() - 1
+            if masks[node] & stop:
+                return None
+            found.append(node)
+            stack.append(node)
+    return found
+
+
+def topological_order(children):
+    """Orders the nodes of a DAG generation by generation, visiting each generation's children in the order they were
+    added. This is the same order as `networkx.topological_sort` on the equivalent DiGraph.
+    """
+    indegree = [0] * len(children)
+    for node_children in children:
+        for child in node_children:
+            indegree[child] += 1
 
-        # find cycle throws an error if there is no cycle, in which case we want the edge
-        try:
-            networkx.find_cycle(g)
-            g.remove_edge(edge[0], edge[1])
-        except:
-            pass
+    order = []
+    generation = [node for node in range(len(children)) if indegree[node] == 0]
+    while generation:
+        order.extend(generation)
+        next_generation = []
+        for node in generation:
+            for child in children[node]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    next_generation.append(child)
+        generation = next_generation
 
-    # now, we know that g is a DAG, so we can use networkx's topological sort.
-    ordering = networkx.topological_sort(g)
-    return [dog_ids[x] for x in ordering]
+    assert len(order) == len(children), "the locked graph has a cycle"
+    return order
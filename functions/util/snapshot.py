@@ -0,0 +1,193 @@
+import calendar
+import json
+import time
+
+import numpy
+
+from util.vote_columns import COLUMNS, VoteColumns, load_votes
+
+MAGIC = b"DOGSNAP1"
+
+# Arrays start on multiples of this many bytes, so they can be mapped in place whatever their type
+ALIGNMENT = 64
+
+# (name, dtype, categorical) of the columns of each table besides votes. Categorical columns are strings stored as
+# indexes into a list of their values, -1 being NULL. Ages are floats so that NULL can be NaN, which no comparison
+# matches, as in SQL.
+VOTER_COLUMNS = [
+    ("id", numpy.int32, False),
+    ("creation_time", numpy.float64, False),
+    ("gender_identity", numpy.int32, True),
+    ("age", numpy.float32, False),
+    ("education", numpy.int32, True),
+    ("location", numpy.int32, True),
+]
+DOG_COLUMNS = [
+    ("id", numpy.int32, False),
+    ("submission_time", numpy.float64, False),
+    ("age_months", numpy.int32, False),
+    ("weight_id", numpy.int32, False),
+    ("breed", numpy.int32, True),
+]
+
+
+def export_snapshot(conn, path):
+    """Writes every vote, and the voters and dogs they refer to (without emails or images), to a snapshot file.
+
+    Everything is read in one REPEATABLE READ transaction, so that the marker recorded is that of exactly the votes
+    written, even while votes are being cast. conn must not be in a transaction already.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cursor.execute("SELECT MAX(id), COUNT(*) FROM votes")
+        max_vote_id, vote_count = cursor.fetchone()
+
+    # In id order, which Snapshot.votes relies on to pick the same first votes as the database does
+    votes = load_votes(conn, in_id_order=True)
+    tables = {"votes": {name: getattr(votes, name) for name, _ in COLUMNS}}
+    categories = {}
+
+    with conn.cursor() as cursor:
+        for table, columns, query in [
+            ("voters", VOTER_COLUMNS, """
+                SELECT id, EXTRACT(EPOCH FROM creation_time), gender_identity, age, education, location
+                FROM voters ORDER BY id"""),
+            ("dogs", DOG_COLUMNS, """
+                SELECT id, EXTRACT(EPOCH FROM submission_time), age_months, weight_id, breed
+                FROM dogs ORDER BY id"""),
+        ]:
+            cursor.execute(query)
+            rows = cursor.fetchall()
+            tables[table] = {}
+            for (name, dtype, categorical), values in zip(columns, zip(*rows) if rows else [()] * len(columns)):
+                if categorical:
+                    categories.setdefault(table, {})[name], tables[table][name] = _encode(values)
+                else:
+                    tables[table][name] = numpy.array([numpy.nan if v is None else v for v in values], dtype)
+    conn.rollback()
+
+    write_snapshot(path, tables, categories, {
+        "exported_at": time.time(),
+        "max_vote_id": max_vote_id,
+        "vote_count": vote_count,
+    })
+
+
+def _encode(values):
+    categories = sorted({str(value) for value in values if value is not None})
+    index = {category: i for i, category in enumerate(categories)}
+    return categories, numpy.array([-1 if value is None else index[str(value)] for value in values], numpy.int32)
+
+
+def write_snapshot(path, tables, categories=None, metadata=None):
+    """Writes arrays to a file as: MAGIC, the length of a json header, the header, and each array's raw bytes.
+
+    :param tables: a dictionary from table name, to column name, to a one dimensional numpy array
+    :param categories: a dictionary from table name, to column name, to the list of strings its codes refer to
+    :param metadata: anything json-serializable, to store with the arrays
+    """
+    header = {"tables": {}, "categories": categories or {}, "metadata": metadata or {}}
+    offset = 0
+    for table, columns in tables.items():
+        header["tables"][table] = {}
+        for name, array in columns.items():
+            header["tables"][table][name] = {"dtype": array.dtype.str, "offset": offset, "length": len(array)}
+            offset += _padded(array.nbytes)
+
+    encoded = json.dumps(header).encode()
+    start = _padded(len(MAGIC) + 8 + len(encoded))
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(encoded).to_bytes(8, "little"))
+        f.write(encoded)
+        f.write(b"\0" * (start - f.tell()))
+        for columns in tables.values():
+            for array in columns.values():
+                data = numpy.ascontiguousarray(array).tobytes()
+                f.write(data)
+                f.write(b"\0" * (_padded(len(data)) - len(data)))
+
+
+def _padded(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+class Snapshot:
+    """A snapshot file, with its columns mapped into memory rather than read, so opening one takes milliseconds."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a vote snapshot")
+            header_length = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_length))
+        start = _padded(len(MAGIC) + 8 + header_length)
+
+        self.path = path
+        self.categories = header["categories"]
+        self.metadata = header["metadata"]
+        self.tables = {}
+        for table, columns in header["tables"].items():
+            self.tables[table] = {}
+            for name, column in columns.items():
+                dtype = numpy.dtype(column["dtype"])
+                if column["length"] == 0:
+                    self.tables[table][name] = numpy.empty(0, dtype)
+                else:
+                    self.tables[table][name] = numpy.memmap(path, dtype, "r", start + column["offset"],
+                                                            (column["length"],))
+
+    def votes(self, filters, since, until):
+        """:return: the votes matching xranking's filters and cast between the dates given, as a VoteColumns, with
+                    the same results as querying the database"""
+        votes = self.tables["votes"]
+        time = votes["submission_time"]
+        keep = (time >= _epoch(since)) & (time <= _epoch(until))
+
+        if _has_voter_filters(filters):
+            voters = self.tables["voters"]
+            row = numpy.clip(numpy.searchsorted(voters["id"], votes["voter_id"]), 0, max(len(voters["id"]) - 1, 0))
+            keep &= (voters["id"][row] == votes["voter_id"]) & self._voter_mask(filters)[row]
+
+        selected = VoteColumns(*(numpy.asarray(votes[name]) for name, _ in COLUMNS)).take(numpy.flatnonzero(keep))
+
+        return selected.filtered(filters["first_n"], filters["ignore_dogs"])
+
+    def voter_ids(self, filters, since, until):
+        """:return: the ids of voters matching the filters who registered between the dates given"""
+        voters = self.tables["voters"]
+        created = voters["creation_time"]
+        keep = (created >= _epoch(since)) & (created <= _epoch(until)) & self._voter_mask(filters)
+        return numpy.asarray(voters["id"])[keep].tolist()
+
+    def _voter_mask(self, filters):
+        voters = self.tables["voters"]
+        mask = numpy.ones(len(voters["id"]), dtype=bool)
+
+        def code(column, value):
+            values = self.categories.get("voters", {}).get(column, [])
+            return values.index(value) if value in values else -2
+
+        if filters.get("education"):
+            mask &= voters["education"] == code("education", filters["education"])
+        if filters.get("location"):
+            mask &= voters["location"] == code("location", filters["location"])
+        if filters.get("gender"):
+            mask &= voters["gender_identity"] == code("gender_identity", filters["gender"])
+        with numpy.errstate(invalid="ignore"):
+            if filters.get("age_min"):
+                mask &= voters["age"] >= filters["age_min"]
+            if filters.get("age_max"):
+                mask &= voters["age"] <= filters["age_max"]
+        if filters.get("voter"):
+            mask &= voters["id"] == int(filters["voter"])
+        return mask
+
+
+def _has_voter_filters(filters):
+    return any(filters.get(f) for f in ["education", "location", "gender", "age_min", "age_max", "voter"])
+
+
+def _epoch(day):
+    """Seconds since the epoch at midnight of a date, the same as EXTRACT(EPOCH ...) of a TIMESTAMP on that date"""
+    return calendar.timegm(day.timetuple())
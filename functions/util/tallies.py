@@ -0,0 +1,55 @@
+def record_vote(cursor, dog1, dog2, result):
+    """Counts a vote in `vote_tallies`, from both dogs' sides. Runs on the caller's cursor, so the tally is committed
+    (or rolled back) together with the vote itself.
+
+    :param result: the result of dog1 against dog2, one of "win", "loss" or "tie"
+    """
+    win = int(result == "win")
+    loss = int(result == "loss")
+    tie = int(result == "tie")
+
+    if dog1 == dog2:
+        # Both sides of the vote land on the same row, which one INSERT can't update twice
+        rows = [(dog1, dog2, win + loss, loss + win, 2 * tie)]
+    else:
+        rows = [(dog1, dog2, win, loss, tie), (dog2, dog1, loss, win, tie)]
+
+    # Lock the rows in key order, whichever way round the vote was cast, so that concurrent votes can't deadlock
+    for row in sorted(rows):
+        cursor.execute("""
+            INSERT INTO vote_tallies (dog_a, dog_b, wins, losses, ties) VALUES (%s, %s, %s, %s, %s)
+              ON CONFLICT (dog_a, dog_b) DO UPDATE SET
+                wins = vote_tallies.wins + EXCLUDED.wins,
+                losses = vote_tallies.losses + EXCLUDED.losses,
+                ties = vote_tallies.ties + EXCLUDED.ties""", row)
+
+
+def rebuild_tallies(conn):
+    """Recomputes `vote_tallies` from scratch out of `votes`. Votes submitted while this runs wait for it to finish."""
+    with conn.cursor() as cursor:
+        cursor.execute("LOCK TABLE votes IN SHARE MODE")
+        cursor.execute("DELETE FROM vote_tallies")
+        cursor.execute("""
+            INSERT INTO vote_tallies (dog_a, dog_b, wins, losses, ties)
+            SELECT
+              dog_a,
+              dog_b,
+              COUNT(*) FILTER (WHERE result = 'win'),
+              COUNT(*) FILTER (WHERE result = 'loss'),
+              COUNT(*) FILTER (WHERE result = 'tie')
+            FROM
+              (SELECT
+                 dog1_id AS dog_a,
+                 dog2_id AS dog_b,
+                 result
+               FROM votes
+               UNION ALL
+               SELECT
+                 dog2_id AS dog_a,
+                 dog1_id AS dog_b,
+                 CASE result WHEN 'win' THEN 'loss' :: vote_result
+                             WHEN 'loss' THEN 'win' :: vote_result
+                             ELSE result END
+               FROM votes) AS both_sides
+            WHERE dog_a IS NOT NULL AND dog_b IS NOT NULL AND result IS NOT NULL
+            GROUP BY dog_a, dog_b""")
@@ -0,0 +1,99 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in milliseconds, of the histogram buckets. Each is double the last, with one more bucket for anything
+# slower than the last bound.
+BUCKET_BOUNDS_MS = [0.125 * 2 ** i for i in range(20)]
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+class Histogram:
+    """Counts durations into fixed, exponentially sized buckets, so it stays small no matter how many it sees."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        bucket = 0
+        while bucket < len(BUCKET_BOUNDS_MS) and ms > BUCKET_BOUNDS_MS[bucket]:
+            bucket += 1
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, p):
+        """:return: the upper bound of the bucket the p'th percentile duration falls in"""
+        if self.count == 0:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return BUCKET_BOUNDS_MS[bucket] if bucket < len(BUCKET_BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max_ms,
+            "buckets": {("+inf" if i == len(BUCKET_BOUNDS_MS) else str(BUCKET_BOUNDS_MS[i])): count
+                        for i, count in enumerate(self.buckets) if count},
+        }
+
+
+class StageTimer:
+    """Times the stages of handling one request, in the order they happen."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings_ms = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings_ms[name] = self.timings_ms.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def total_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def record(self, function_name):
+        """Adds this request's timings to the in-process histograms for the function.
+
+        :return: the timings, including the total
+        """
+        timings_ms = {**self.timings_ms, "total": self.total_ms()}
+        with _histograms_lock:
+            for stage, ms in timings_ms.items():
+                _histograms.setdefault((function_name, stage), Histogram()).record(ms)
+        return timings_ms
+
+
+def server_timing(timings_ms):
+    """:return: the timings as a `Server-Timing` header value, which browsers show alongside the request"""
+    return ", ".join(f"{stage};dur={ms:.2f}" for stage, ms in timings_ms.items())
+
+
+def dump_histograms():
+    """
+    :return: a dictionary from function name, to stage, to a summary of how long that stage has taken in this process
+    """
+    with _histograms_lock:
+        out = {}
+        for (function_name, stage), histogram in _histograms.items():
+            out.setdefault(function_name, {})[stage] = histogram.to_dict()
+        return out
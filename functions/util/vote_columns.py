@@ -0,0 +1,144 @@
+import numpy
+
+# Results are stored as small integer codes, the index into this list
+RESULTS = ["win", "loss", "tie"]
+WIN, LOSS, TIE = range(len(RESULTS))
+
+# Rows fetched from the server at a time
+CHUNK_SIZE = 50000
+
+# Stand-in voter id for votes without a voter
+NO_VOTER = -1
+
+COLUMNS = [
+    ("dog1", numpy.int32),
+    ("dog2", numpy.int32),
+    ("result", numpy.int8),
+    ("voter_id", numpy.int32),
+    # seconds since the epoch
+    ("submission_time", numpy.float64),
+]
+
+
+class VoteColumns:
+    """Votes stored column by column in typed arrays, which take a few bytes per vote rather than a dictionary each."""
+
+    def __init__(self, dog1, dog2, result, voter_id, submission_time):
+        self.dog1 = dog1
+        self.dog2 = dog2
+        self.result = result
+        self.voter_id = voter_id
+        self.submission_time = submission_time
+
+    @classmethod
+    def from_rows(cls, rows):
+        """:param rows: (dog1, dog2, result code, voter id, submission time) tuples"""
+        if len(rows) == 0:
+            return cls(*(numpy.empty(0, dtype) for _, dtype in COLUMNS))
+        return cls(*(numpy.array(column, dtype) for column, (_, dtype) in zip(zip(*rows), COLUMNS)))
+
+    @classmethod
+    def concatenate(cls, chunks):
+        if not chunks:
+            return cls.from_rows([])
+        return cls(*(numpy.concatenate([getattr(chunk, name) for chunk in chunks]) for name, _ in COLUMNS))
+
+    def __len__(self):
+        return len(self.dog1)
+
+    def take(self, indices):
+        """:return: the votes at the given indices (or boolean mask), in that order"""
+        return VoteColumns(*(getattr(self, name)[indices] for name, _ in COLUMNS))
+
+    def dogs(self):
+        """:return: the sorted ids of every dog in these votes"""
+        return numpy.union1d(self.dog1, self.dog2)
+
+    def by_voter(self):
+        """:return: a dictionary from voter id to a VoteColumns of their votes, in submission order"""
+        order = numpy.lexsort((self.submission_time, self.voter_id))
+        voters = self.voter_id[order]
+        starts = numpy.flatnonzero(numpy.r_[True, voters[1:] != voters[:-1]]) if len(voters) else []
+        ends = numpy.r_[starts[1:], len(voters)] if len(voters) else []
+        return {voters[start].item(): self.take(order[start:end]) for start, end in zip(starts, ends)}
+
+    def filtered(self, first_n=None, ignore_dogs=None):
+        """Applies xranking's filters that depend on other votes, as load_votes does in its query. The votes must be
+        in the order load_votes(..., in_id_order=True) returns them, as they are in snapshots, for this to match it.
+
+        :param first_n: only keep each voter's first n votes, by submission time and then by their order here
+        :param ignore_dogs: ids of dogs to leave out the votes of. This applies after first_n, so a voter's first n
+                            votes can include some with these dogs, which are then removed.
+        :return: the votes kept, in no particular order
+        """
+        votes = self
+        if first_n:
+            # Each voter's votes in order, keeping those less than n places after the start of their voter's run.
+            # lexsort is stable, so votes cast at the same time stay in id order.
+            by_voter = numpy.lexsort((votes.submission_time, votes.voter_id))
+            voter_ids = votes.voter_id[by_voter]
+            run_start = numpy.flatnonzero(numpy.r_[True, voter_ids[1:] != voter_ids[:-1]])
+            run_lengths = numpy.diff(numpy.r_[run_start, len(voter_ids)])
+            place = numpy.arange(len(voter_ids)) - numpy.repeat(run_start, run_lengths)
+            votes = votes.take(by_voter[place < first_n])
+        if ignore_dogs:
+            to_ignore = [int(dog_id) for dog_id in ignore_dogs]
+            votes = votes.take(~(numpy.isin(votes.dog1, to_ignore) | numpy.isin(votes.dog2, to_ignore)))
+        return votes
+
+    def results(self):
+        """:return: a list of (dog1, dog2, result) tuples, with results as strings"""
+        return [(dog1, dog2, RESULTS[result])
+                for dog1, dog2, result in zip(self.dog1.tolist(), self.dog2.tolist(), self.result.tolist())]
+
+
+def load_votes(conn, where="", first_n=None, ignore_dogs=None, in_id_order=False, chunk_size=CHUNK_SIZE):
+    """Reads votes through a server-side cursor, chunk_size rows at a time, so only one chunk of rows is ever held as
+    Python objects. Votes missing a dog or a result are skipped. All filtering happens in the query, so only the votes
+    used are sent.
+
+    :param where: extra SQL conditions, each starting with AND, on `votes` joined with `voters`
+    :param first_n: only keep each voter's first n votes that match `where`, by submission time and then id
+    :param ignore_dogs: ids of dogs to leave out the votes of. This applies after first_n, so a voter's first n votes
+                        can include some with these dogs, which are then removed.
+    :param in_id_order: return the votes in the order they were cast, rather than in no particular order
+    :return: a VoteColumns
+    """
+    with conn.cursor() as cursor:
+        outer_where = ""
+        if first_n:
+            outer_where += bytes.decode(cursor.mogrify("AND place <= %s", (first_n,)))
+        if ignore_dogs:
+            outer_where += bytes.decode(cursor.mogrify(" AND dog1_id <> ALL(%s) AND dog2_id <> ALL(%s)",
+                                                       (list(ignore_dogs), list(ignore_dogs))))
+
+    place = ", ROW_NUMBER() OVER (PARTITION BY votes.voter_id ORDER BY votes.submission_time, votes.id) AS place" \
+        if first_n else ""
+
+    chunks = []
+    with conn.cursor(name="load_votes") as cursor:
+        cursor.itersize = chunk_size
+        cursor.execute(
+            f"""
+            SELECT
+              dog1_id,
+              dog2_id,
+              CASE result WHEN 'win' THEN {WIN} WHEN 'loss' THEN {LOSS} ELSE {TIE} END,
+              COALESCE(voter_id, {NO_VOTER}),
+              EXTRACT(EPOCH FROM submission_time)
+            FROM
+              (SELECT votes.id, votes.dog1_id, votes.dog2_id, votes.result, votes.voter_id, votes.submission_time
+                 {place}
+               FROM votes LEFT JOIN voters ON (votes.voter_id = voters.id)
+               WHERE votes.dog1_id IS NOT NULL AND votes.dog2_id IS NOT NULL AND votes.result IS NOT NULL
+                {where}) AS filtered
+            WHERE 1 = 1 {outer_where}
+            {"ORDER BY id" if in_id_order else ""}""")
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(VoteColumns.from_rows(rows))
+
+    return VoteColumns.concatenate(chunks)
@@ -8,28 +8,83 @@ Computes a ranking for dogs, then writes the ranking to stdout in the specified
 
 import argparse
 import json
-import random
-
-import networkx
-from psycopg2.extras import RealDictCursor
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
 
 from util.elo import compute_elo
 from util.get_pool import get_connection
-
-
-def main(credentials, ranking_method, output_format, filters):
-    with open(credentials) as f:
+from util.matchups import Matchups, ranked
+from util.rank_cache import RankCache, cache_key, vote_marker
+from util.rank_stats import rank_correlations
+from util.ranked_pairs import ranked_pairs_ordering
+from util.snapshot import Snapshot
+from util.vote_columns import load_votes
+
+RANKING_METHODS = ["ranked_pairs", "copeland", "elo", "minimax", "win_ratio", "win_tie_ratio"]
+
+# Methods that only pick out some dogs, rather than ranking all of them
+SELECTION_METHODS = ["condorcet"]
+
+# Only votes cast in this window are ranked
+VOTES_FROM = date(2019, 4, 3)
+VOTES_UNTIL = date(2019, 4, 22)
+
+
+def main(source, ranking_methods, output_format, filters, workers=None, cache=None):
+    conn = connect(source)
+
+    if len(ranking_methods) == 1:
+        rank_func = rank_function(ranking_methods[0], filters, cache)
+        rank = rank_func(conn)
+
+        # if flatten_ties:
+        #     rank = [x for row in rank for x in row]
+
+        print(format_rank(rank, output_format))
+        return
+
+    rankings = {}
+    if cache:
+        marker = vote_marker(conn)
+        keys = {method: cache_key(method, filters, marker, (VOTES_FROM, VOTES_UNTIL)) for method in ranking_methods}
+        rankings = {method: cache.get(keys[method]) for method in ranking_methods}
+        rankings = {method: rank for method, rank in rankings.items() if rank is not None}
+
+    # Load the votes once, and compute every ranking that isn't cached at the same time
+    missing = [method for method in ranking_methods if method not in rankings]
+    if missing:
+        computed = rank_all(missing, get_votes(conn, filters), workers)
+        if cache:
+            for method, rank in computed.items():
+                cache.put(keys[method], rank)
+        rankings.update(computed)
+
+    rankings = {method: rankings[method] for method in ranking_methods}
+    for method, rank in rankings.items():
+        print(f"{method}:")
+        print(format_rank(rank, output_format))
+        print()
+
+    print("method_a,method_b,spearman_rho,kendall_tau")
+    orderings = {method: rank for method, rank in rankings.items() if method in RANKING_METHODS}
+    for method_a, method_b, rho, tau in rank_correlations(orderings):
+        print(f"{method_a},{method_b},{rho:.4f},{tau:.4f}")
+
+
+def connect(args):
+    """:return: the Snapshot given by --snapshot, or else a connection to the database given by --credentials"""
+    if args.snapshot:
+        return Snapshot(args.snapshot)
+    with open(args.credentials) as f:
         connection_details = json.load(f)
+    return get_connection(connection_details)
 
-    conn = get_connection(connection_details)
-
-    rank_func = rank_function(ranking_method, filters)
-    rank = rank_func(conn)
 
-    # if flatten_ties:
-    #     rank = [x for row in rank for x in row]
-
-    print(format_rank(rank, output_format))
+def add_source_arguments(parser):
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--credentials",
+                        help="Path to the credentials for the postgres instance the data is stored in.")
+    source.add_argument("--snapshot", help="Path to a snapshot file (from export_snapshot.py) to read instead.")
 
 
 def filter_statement(conn, filters):
@@ -53,118 +108,76 @@ def filter_statement(conn, filters):
         return f
 
 def get_votes(conn, filters):
-    """Returns a list of each vote, as an array of dictionaries of shape {"dog1":…, "dog2":…, "result":…} """
+    """Returns every vote matching the filters, as a VoteColumns. conn can also be a Snapshot, to read the votes from a
+    snapshot file instead of the database."""
+    if isinstance(conn, Snapshot):
+        return conn.votes(filters, VOTES_FROM, VOTES_UNTIL)
 
-    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-        cursor.execute(
-            f"""
-            SELECT dog1_id as dog1, dog2_id as dog2, result, submission_time, voter_id
-            FROM votes LEFT JOIN voters ON (votes.voter_id = voters.id) WHERE 1 = 1
-             AND votes.submission_time >= make_date(2019, 4, 3)
-             AND votes.submission_time <= make_date(2019, 4, 22) 
-             {filter_statement(conn, filters)}
-             ORDER BY random();""")
+    ignore_dogs = [int(dog_id_str) for dog_id_str in filters["ignore_dogs"]] if filters["ignore_dogs"] else None
+    with conn.cursor() as cursor:
+        window = bytes.decode(cursor.mogrify(
+            "AND votes.submission_time >= %s AND votes.submission_time <= %s", (VOTES_FROM, VOTES_UNTIL)))
+    return load_votes(conn, f"""
+             {window}
+             {filter_statement(conn, filters)}""", first_n=filters["first_n"], ignore_dogs=ignore_dogs)
 
-        results = cursor.fetchall()
 
-        if filters["first_n"]:
-            n = filters["first_n"]
-            voter_votes = {v["voter_id"]: [] for v in results}
+def rank_function(ranking_method, filters, cache=None):
+    """Given a ranking method, returns a function that, given a connection to a database, will compute that
+    ranking.
 
-            for result in results:
-                voter_votes[result["voter_id"]].append(result)
+    :param ranking_method: one of RANKING_METHODS or SELECTION_METHODS
+    :param cache: a RankCache to reuse the ranking from, if it was computed before with the same votes and filters
+    :return: a ranking over the data in the database, with ties represented as nested arrays
+    """
 
-            for v in voter_votes:
-                voter_votes[v] = sorted(voter_votes[v], key=lambda x: x["submission_time"])[0:n]
-            results = [v for vote_list in voter_votes.values() for v in vote_list]
+    def rank(conn):
+        def compute():
+            return rank_votes(ranking_method, get_votes(conn, filters))
 
-        if filters["ignore_dogs"]:
-            to_ignore = [int(dog_id_str) for dog_id_str in filters["ignore_dogs"]]
-            results = [r for r in results if r["dog1"] not in to_ignore and r["dog2"] not in to_ignore]
+        if cache is None:
+            return compute()
+        key = cache_key(ranking_method, filters, vote_marker(conn), (VOTES_FROM, VOTES_UNTIL))
+        return cache.get_or_compute(key, compute)
 
-    return results
+    return rank
 
 
-def rank_function(ranking_method, filters):
-    """Given a ranking method, returns a function that, given a connection to a database, will compute that
-    ranking.
+def rank_votes(ranking_method, votes, seed=None):
+    """Computes a ranking from a VoteColumns snapshot, rather than from the database
 
-    :param ranking_method: one of "ranked_pairs", "copeland", "elo", "minimax", "win_ratio"
-    :return: a ranking over the data in the database, with ties represented as nested arrays
+    :param seed: seed for methods that are random, so that their ranking can be reproduced
     """
 
-    def ranked_pairs(conn):
-        matchups = get_victory_graph(conn, filters)
-
-        g = networkx.DiGraph()
-        g.add_nodes_from(matchups.nodes)
-
-        edges = [(u, v, matchups.get_edge_data(u, v)) for (u, v) in matchups.edges]
-        edges.sort(key=lambda x: x[2]["margin"], reverse=True)
-        for u, v, data in edges:
-            g.add_edge(u, v, **data)
-            try:
-                networkx.find_cycle(g)
-                g.remove_edge(u, v)
-            except:
-                pass
-
-        assert networkx.is_directed_acyclic_graph(g)
-        return list(networkx.topological_sort(g))
-
-    def copeland(conn):
-        g = get_victory_graph(conn, filters)
-        return sorted([(n, g.out_degree(n) - g.in_degree(n)) for n in g.nodes],
-                      key=lambda x: x[1], reverse=True)
-
-    def elo(conn):
-        votes = get_votes(conn, filters)
-        random.shuffle(votes)
-        return compute_elo([(v["dog1"], v["dog2"], v["result"]) for v in votes])
-
-    def minimax(conn):
-        g = get_matchup_graph(conn, filters)
-
-        # lowest_loss_rate = float("inf")
-        # winner = None
-        #
-        # for n in g.nodes:
-        #     greatest_margin = max(g.get_edge_data(u, v)["margin"] for u, v in g.in_edges(n))
-        #     if greatest_margin < lowest_loss_rate:
-        #         lowest_loss_rate = greatest_margin
-        #         winner = n
-        return sorted(g.nodes, key=lambda n: max(g.get_edge_data(u, v)["margin"] for u, v in g.in_edges(n)))
-
-    def win_ratio(conn):
-        matchups = get_matchups(conn, filters)
-
-        wins_and_ties_vs_losses = {}
-        for dog in matchups:
-            wins_and_ties_vs_losses[dog] = [0, 0]
-            for matchup in matchups[dog]:
-                wins = matchups[dog][matchup]["wins"]
-                losses = matchups[dog][matchup]["losses"]
-                wins_and_ties_vs_losses[dog][0] += wins
-                wins_and_ties_vs_losses[dog][1] += losses
-
-        ratios = [(dog, (x[0] / ((x[0] + x[1]) or float("inf")))) for dog, x in wins_and_ties_vs_losses.items()]
-        return sorted(ratios, key=lambda x: x[1], reverse=True)
-
-    def win_tie_ratio(conn):
-        matchups = get_matchups(conn, filters)
-
-        wins_and_ties_vs_losses = {}
-        for dog in matchups:
-            wins_and_ties_vs_losses[dog] = [0, 0]
-            for matchup in matchups[dog]:
-                wins = matchups[dog][matchup]["wins"]
-                ties = matchups[dog][matchup]["ties"]
-                losses = matchups[dog][matchup]["losses"]
-                wins_and_ties_vs_losses[dog][0] += wins + ties
-                wins_and_ties_vs_losses[dog][1] += losses
-
-        ratios = [(dog, (x[0] / ((x[0] + x[1]) or float("inf")))) for dog, x in wins_and_ties_vs_losses.items()]
-        return sorted(ratios, key=lambda x: x[1], reverse=True)
+    def ranked_pairs(votes):
+        matchups = Matchups.from_votes(votes)
+        return ranked_pairs_ordering(matchups.dogs.tolist(), matchups.victory_margins())
+
+    def copeland(votes):
+        matchups = Matchups.from_votes(votes)
+        return ranked(matchups.dogs, matchups.copeland_scores(), reverse=True)
+
+    def elo(votes):
+        return compute_elo(votes.results(), shuffle=True, seed=seed)
+
+    def minimax(votes):
+        # Ordered by the largest margin any dog has against each dog, smallest first
+        matchups = Matchups.from_votes(votes)
+        return [dog for dog, _ in ranked(matchups.dogs, matchups.worst_defeats())]
+
+    def condorcet(votes):
+        # Any Condorcet-consistent method (like ranked pairs) puts the winner first and the loser last, so when they
+        # exist this answers who is best and worst without a full ranking
+        matchups = Matchups.from_votes(votes)
+        return {"winner": matchups.condorcet_winner(), "loser": matchups.condorcet_loser()}
+
+    def win_ratio(votes):
+        matchups = Matchups.from_votes(votes)
+        return ranked(matchups.dogs, matchups.win_ratios(), reverse=True)
+
+    def win_tie_ratio(votes):
+        matchups = Matchups.from_votes(votes)
+        return ranked(matchups.dogs, matchups.win_ratios(ties_count_as_wins=True), reverse=True)
 
     methods = {
         "ranked_pairs": ranked_pairs,
@@ -173,99 +186,53 @@ def rank_function(ranking_method, filters):
         "minimax": minimax,
         "win_ratio": win_ratio,
         "win_tie_ratio": win_tie_ratio,
+        "condorcet": condorcet,
     }
+    assert set(methods) == set(RANKING_METHODS + SELECTION_METHODS)
+
+    return methods[ranking_method](votes)
 
-    return methods[ranking_method]
+
+def rank_all(ranking_methods, votes, workers=None):
+    """Computes several rankings of the same votes, each in its own process.
+
+    :return: a dictionary from method to ranking
+    """
+    with ProcessPoolExecutor(workers) as executor:
+        rankings = executor.map(rank_votes, ranking_methods, [votes] * len(ranking_methods))
+        return dict(zip(ranking_methods, rankings))
 
 
 def get_matchups(conn, filters):
-    results = get_votes(conn, filters)
-    dogs = {result["dog1"] for result in results} | {result["dog2"] for result in results}
-    matchups = {}
-    for dog in dogs:
-        matchups[dog] = {}
-    for dog1 in dogs:
-        for dog2 in dogs:
-            if dog1 == dog2:
-                continue
-            matchups[dog1][dog2] = {"wins": 0, "losses": 0, "ties": 0}
-            matchups[dog2][dog1] = {"wins": 0, "losses": 0, "ties": 0}
-
-    for vote in results:
-        dog1 = vote["dog1"]
-        dog2 = vote["dog2"]
-        result = vote["result"]
-        if result == "win":
-            matchups[dog1][dog2]["wins"] += 1
-            matchups[dog2][dog1]["losses"] += 1
-        if result == "loss":
-            matchups[dog1][dog2]["losses"] += 1
-            matchups[dog2][dog1]["wins"] += 1
-        if result == "tie":
-            matchups[dog1][dog2]["ties"] += 1
-            matchups[dog2][dog1]["ties"] += 1
-
-    return matchups
+    """:return: the head-to-head results of the votes matching the filters, as a Matchups"""
+    return Matchups.from_votes(get_votes(conn, filters))
 
 
 def get_matchup_graph(conn, filters):
-    matchups = get_matchups(conn, filters)
-    ids = matchups.keys()
-
-    g = networkx.DiGraph()
-    g.add_nodes_from(ids)
-    for dog1 in matchups:
-        for dog2 in matchups[dog1]:
-            dog1to2 = matchups[dog1][dog2]
-            total_votes_dog1to2 = sum(dog1to2.values())
-            if total_votes_dog1to2 != 0:
-                g.add_edge(dog1, dog2,
-                           wins=dog1to2["wins"],
-                           losses=dog1to2["losses"],
-                           ties=dog1to2["ties"],
-                           margin=dog1to2["wins"] / total_votes_dog1to2)
-
-            dog2to1 = matchups[dog2][dog1]
-            total_votes_dog2to1 = sum(dog2to1.values())
-            if total_votes_dog2to1 != 0:
-                g.add_edge(dog2, dog1,
-                           wins=dog2to1["wins"],
-                           losses=dog2to1["losses"],
-                           ties=dog2to1["ties"],
-                           margin=dog2to1["wins"] / total_votes_dog2to1)
-
-    return g
+    return get_matchups(conn, filters).matchup_graph()
 
 
 def get_victory_graph(conn, filters):
     """every out-edge is a loss to another candidate, every in-edge is a win"""
-    matchups = get_matchup_graph(conn, filters)
-    edges_to_remove = []
-    for u, v in matchups.edges:
-        margin_u_to_v = matchups.get_edge_data(u, v)["margin"]
-        margin_v_to_u = matchups.get_edge_data(v, u)["margin"]
-
-        # u->v has higher win margin than v->u, keep lower margin
-        if margin_u_to_v <= margin_v_to_u:
-            edges_to_remove.append((u, v))
-
-    matchups.remove_edges_from(edges_to_remove)
-    return matchups
+    return get_matchups(conn, filters).victory_graph()
 
 
 def format_rank(rank, fmt):
     if fmt == "python_array":
         return repr(rank)
     elif fmt == "columns":
+        if isinstance(rank, dict):
+            # A selection method's dogs by name, like condorcet's winner and loser, left empty if there is none
+            return "\n".join(f"{name},{'' if dog is None else dog}" for name, dog in rank.items())
         return "\n".join(",".join(str(y) for y in x) for x in rank)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("--credentials", required=True,
-                        help="Path to the credentials for the postgres instance the data is stored in.")
-    parser.add_argument("--method", required=True,
-                        choices=["ranked_pairs", "copeland", "elo", "minimax", "win_ratio", "win_tie_ratio"])
+    add_source_arguments(parser)
+    parser.add_argument("--method", required=True, nargs="+", choices=RANKING_METHODS + SELECTION_METHODS + ["all"],
+                        help="One or more methods, or all ranking methods. Several methods are computed from one load "
+                             "of the votes, in parallel, and followed by the rank correlations between them.")
     parser.add_argument("--output_format", default="python_array", choices=["python_array", "columns"])
     # parser.add_argument("--flatten_ties", action="store_true")
     parser.add_argument("--remove_dogs")
@@ -277,6 +244,10 @@ if __name__ == '__main__':
     parser.add_argument("--voter", type=int)
     parser.add_argument("--first_n", type=int)
     parser.add_argument("--ignore_dogs", nargs="*")
+    parser.add_argument("--workers", type=int,
+                        help="Number of processes to compute several methods with. Defaults to the number of CPUs.")
+    parser.add_argument("--no_cache", action="store_true",
+                        help="Recompute rankings, rather than reusing ones computed from the same votes and filters.")
     args = parser.parse_args()
 
     filters = {
@@ -290,4 +261,5 @@ if __name__ == '__main__':
         "voter": args.voter
     }
 
-    main(args.credentials, args.method, args.output_format, filters)
+    methods = RANKING_METHODS if "all" in args.method else list(dict.fromkeys(args.method))
+    main(args, methods, args.output_format, filters, args.workers, None if args.no_cache else RankCache())
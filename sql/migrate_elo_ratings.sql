@@ -0,0 +1,22 @@
+-- Brings a database created before elo_ratings up to date with setup.sql. Safe to run more than once.
+-- Deploy in this order, because submit_vote updates elo_ratings and get_elo_ranking reads from it:
+--   1. run this file
+--   2. replay the existing votes into the ratings: `maintenance.py rebuild_elo`
+--   3. deploy the functions
+
+CREATE TABLE IF NOT EXISTS elo_ratings
+(
+  dog_id INTEGER PRIMARY KEY REFERENCES dogs (id),
+  rating DOUBLE PRECISION NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS elo_checkpoints
+(
+  id             SERIAL PRIMARY KEY,
+  creation_time  TIMESTAMP   NOT NULL DEFAULT now(),
+  replay_order   VARCHAR(20) NOT NULL,
+  seed           INTEGER,
+  votes_replayed INTEGER     NOT NULL,
+  last_vote_id   INTEGER,
+  ratings        JSONB       NOT NULL
+);
@@ -0,0 +1,15 @@
+-- Brings a database created before the image store up to date with setup.sql. Safe to run more than once.
+-- Afterwards, move the existing images into the store with `maintenance.py migrate_images`; until then,
+-- get_dog moves each dog's image the first time it is read.
+
+ALTER TABLE dogs ALTER COLUMN image DROP NOT NULL;
+ALTER TABLE dogs ADD COLUMN IF NOT EXISTS image_hash CHAR(64);
+
+CREATE TABLE IF NOT EXISTS images
+(
+  hash         CHAR(64)    NOT NULL,
+  variant      VARCHAR(20) NOT NULL,
+  content_type VARCHAR(100) NOT NULL,
+  data         BYTEA       NOT NULL,
+  PRIMARY KEY (hash, variant)
+);
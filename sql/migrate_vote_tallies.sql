@@ -0,0 +1,18 @@
+-- Brings a database created before vote_tallies up to date with setup.sql. Safe to run more than once.
+-- Deploy in this order, because submit_vote writes to vote_tallies and get_votes/get_ranking read from it:
+--   1. run this file
+--   2. fill in the tallies from the existing votes: `maintenance.py rebuild_tallies`
+--   3. deploy the functions
+
+CREATE TABLE IF NOT EXISTS vote_tallies
+(
+  dog_a  INTEGER REFERENCES dogs (id),
+  dog_b  INTEGER REFERENCES dogs (id),
+  wins   INTEGER NOT NULL DEFAULT 0,
+  losses INTEGER NOT NULL DEFAULT 0,
+  ties   INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (dog_a, dog_b)
+);
+
+CREATE INDEX IF NOT EXISTS voters_uuid_idx ON voters (uuid);
+CREATE INDEX IF NOT EXISTS votes_voter_id_idx ON votes (voter_id);
@@ -31,13 +31,25 @@ CREATE TABLE dogs
 (
   id              SERIAL PRIMARY KEY,
   submission_time TIMESTAMP                       NOT NULL DEFAULT NOW(),
-  image           BYTEA                           NOT NULL,
+  image           BYTEA,                          -- only set for dogs submitted before the image store
+  image_hash      CHAR(64),                       -- sha256 of the original image, the key into the image store
   age_months      INTEGER                         NOT NULL,
   weight_id       INTEGER REFERENCES weights (id) NOT NULL,
   breed           VARCHAR(100)                    NOT NULL,
   submitter_email VARCHAR(300)                    NOT NULL
 );
 
+-- Content addressed image store: every submitted image, and its resized variants, keyed by the
+-- sha256 of the original image. Unused when the functions are configured with IMAGE_STORE_PATH.
+CREATE TABLE images
+(
+  hash         CHAR(64)    NOT NULL,
+  variant      VARCHAR(20) NOT NULL,
+  content_type VARCHAR(100) NOT NULL,
+  data         BYTEA       NOT NULL,
+  PRIMARY KEY (hash, variant)
+);
+
 
 CREATE TYPE education_level AS ENUM (
   'No high school',
@@ -76,3 +88,41 @@ CREATE TABLE votes
   dog2_id         INTEGER REFERENCES dogs (id),
   result          vote_result
 );
+
+-- Running head-to-head counts, kept up to date by submit_vote (and rebuilt from votes by
+-- `maintenance.py rebuild_tallies`). wins/losses/ties are the results of dog_a against dog_b,
+-- every vote is counted from both sides, so (a, b) and (b, a) mirror each other.
+CREATE TABLE vote_tallies
+(
+  dog_a  INTEGER REFERENCES dogs (id),
+  dog_b  INTEGER REFERENCES dogs (id),
+  wins   INTEGER NOT NULL DEFAULT 0,
+  losses INTEGER NOT NULL DEFAULT 0,
+  ties   INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (dog_a, dog_b)
+);
+
+-- Current Elo rating of every dog that has been voted on, kept up to date by submit_vote
+-- (and rebuilt from votes by `maintenance.py rebuild_elo`).
+CREATE TABLE elo_ratings
+(
+  dog_id INTEGER PRIMARY KEY REFERENCES dogs (id),
+  rating DOUBLE PRECISION NOT NULL
+);
+
+-- Ratings part way through (and at the end of) a `maintenance.py rebuild_elo` replay.
+-- last_vote_id is the id of the last vote replayed, in the replay's order.
+CREATE TABLE elo_checkpoints
+(
+  id             SERIAL PRIMARY KEY,
+  creation_time  TIMESTAMP   NOT NULL DEFAULT now(),
+  replay_order   VARCHAR(20) NOT NULL,
+  seed           INTEGER,
+  votes_replayed INTEGER     NOT NULL,
+  last_vote_id   INTEGER,
+  ratings        JSONB       NOT NULL
+);
+
+-- Pair selection looks up every vote a voter has cast, by their uuid.
+CREATE INDEX voters_uuid_idx ON voters (uuid);
+CREATE INDEX votes_voter_id_idx ON votes (voter_id);
@@ -7,5 +7,9 @@ DROP TYPE education_level CASCADE;
 DROP TYPE vote_result CASCADE;
 DROP TABLE weights CASCADE;
 DROP TABLE dogs CASCADE;
+DROP TABLE images CASCADE;
 DROP TABLE votes CASCADE;
+DROP TABLE vote_tallies CASCADE;
+DROP TABLE elo_ratings CASCADE;
+DROP TABLE elo_checkpoints CASCADE;
 DROP TABLE voters CASCADE;
\ No newline at end of file